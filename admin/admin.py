@@ -1,41 +1,131 @@
-from fastapi import APIRouter, Request, Form, HTTPException, Depends
+from fastapi import APIRouter, Depends, Request, Form, HTTPException
 from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.templating import Jinja2Templates
 import os
 import json
-import psycopg2
+import base64
+import secrets
+from datetime import date
+from typing import Optional, Tuple
+from urllib.parse import urlencode
 from psycopg2.extras import DictCursor
 
-router = APIRouter()
+from clinic_cache import clinic_cache, notify_clinic_changed
+from database import get_pool
+from export import analysis_filters, set_export_token
+from rollups import fetch_stats
+
+# Accès réservé : authentification HTTP Basic contre ADMIN_USER / ADMIN_PASSWORD.
+# Sans ADMIN_PASSWORD, l'admin est désactivée.
+ADMIN_USER = os.getenv("ADMIN_USER", "admin")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "")
+
+basic_auth = HTTPBasic(realm="admin")
+
+def require_admin(credentials: HTTPBasicCredentials = Depends(basic_auth)):
+    if not ADMIN_PASSWORD:
+        raise HTTPException(status_code=503, detail="Administration désactivée (ADMIN_PASSWORD non défini)")
+    # Comparaisons à temps constant, toutes deux évaluées
+    user_ok = secrets.compare_digest(credentials.username.encode(), ADMIN_USER.encode())
+    password_ok = secrets.compare_digest(credentials.password.encode(), ADMIN_PASSWORD.encode())
+    if not (user_ok and password_ok):
+        raise HTTPException(status_code=401, detail="Identifiants invalides",
+                            headers={"WWW-Authenticate": 'Basic realm="admin"'})
+
+router = APIRouter(dependencies=[Depends(require_admin)])
 templates = Jinja2Templates(directory="admin/templates")
 
-def get_db_connection():
-    database_url = os.getenv("DATABASE_URL")
-    if not database_url:
-        raise HTTPException(status_code=500, detail="DATABASE_URL non définie")
-    try:
-        conn = psycopg2.connect(database_url)
-        print("DEBUG: Admin connected using DATABASE_URL")
-        return conn
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database connection error: {e}")
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
 
-async def get_db():
-    db = get_db_connection()
-    try:
-        yield db
-    finally:
-        db.close()
+CLINIC_COLUMNS = ("api_key, email_clinique, pricing, analysis_quota, default_quota, subscription_start, "
+                  "rate_limit_per_minute, rate_limit_burst, export_token_hash")
+
+# Requêtes synchrones, exécutées via get_pool().run() hors de la boucle d'événements
+def fetch_clinics(db):
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(f"SELECT {CLINIC_COLUMNS} FROM clinics")
+        return cursor.fetchall()
+
+def fetch_clinic(db, api_key: str):
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(f"SELECT {CLINIC_COLUMNS} FROM clinics WHERE api_key = %s", (api_key,))
+        return cursor.fetchone()
+
+def update_clinic_row(db, api_key: str, email_clinique: str, pricing_json: str,
+                      rate_limit_per_minute: Optional[float] = None, rate_limit_burst: Optional[int] = None):
+    with db.cursor() as cursor:
+        cursor.execute(
+            "UPDATE clinics SET email_clinique = %s, pricing = %s, rate_limit_per_minute = %s, rate_limit_burst = %s "
+            "WHERE api_key = %s",
+            (email_clinique, pricing_json, rate_limit_per_minute, rate_limit_burst, api_key)
+        )
+    notify_clinic_changed(db, api_key)
+    db.commit()
+    clinic_cache.invalidate(api_key)
+
+def fetch_analyses(db, clinic: Optional[str], date_from: Optional[date], date_to: Optional[date],
+                   after: Optional[Tuple[str, int]], limit: int):
+    """Page d'analyses en pagination par clé sur (timestamp, id), servie par les index des migrations"""
+    conditions, params = analysis_filters(clinic, date_from, date_to)
+    if after:
+        conditions.append("(timestamp, id) < (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            f"SELECT id, clinic_api_key, client_email, result, timestamp FROM analyses {where} "
+            "ORDER BY timestamp DESC, id DESC LIMIT %s",
+            params + [limit]
+        )
+        return cursor.fetchall()
+
+def fetch_analysis_stats(db, clinic: Optional[str], date_from: Optional[date], date_to: Optional[date]) -> dict:
+    """Répartition par stade et densité moyenne, calculées par Postgres sur les colonnes JSONB"""
+    conditions, params = analysis_filters(clinic, date_from, date_to)
+    conditions.insert(0, "TRUE")
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            f"""
+            SELECT result->>'stade_principal' AS stade,
+                   count(*) AS total,
+                   sum((result->>'densite_moyenne')::float)
+                       FILTER (WHERE jsonb_typeof(result->'densite_moyenne') = 'number') AS densite_sum,
+                   count(*) FILTER (WHERE jsonb_typeof(result->'densite_moyenne') = 'number') AS densite_count
+            FROM analyses
+            WHERE {' AND '.join(conditions)}
+            GROUP BY 1
+            ORDER BY 1
+            """,
+            params
+        )
+        rows = cursor.fetchall()
+    densite_sum = sum(row['densite_sum'] or 0 for row in rows)
+    densite_count = sum(row['densite_count'] for row in rows)
+    return {
+        "total": sum(row['total'] for row in rows),
+        "stades": {row['stade'] or "inconnu": row['total'] for row in rows},
+        "densite_moyenne": densite_sum / densite_count if densite_count else None
+    }
+
+def encode_cursor(timestamp: str, analysis_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps([timestamp, analysis_id]).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    timestamp, analysis_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return str(timestamp), int(analysis_id)
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    return date.fromisoformat(value) if value else None
 
 @router.get("/", response_class=HTMLResponse, name="admin_dashboard")
-async def admin_dashboard(request: Request, db=Depends(get_db)):
+async def admin_dashboard(request: Request):
     try:
-        cursor = db.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT api_key, email_clinique, pricing, analysis_quota, default_quota, subscription_start FROM clinics")
-        clinics = cursor.fetchall()
+        clinics = await get_pool().run(fetch_clinics)
         clinic_list = []
         for clinic in clinics:
-            pricing = json.loads(clinic['pricing']) if clinic['pricing'] else {}
+            pricing = clinic['pricing'] or {}
             clinic_list.append({
                 "api_key": clinic['api_key'],
                 "email_clinique": clinic['email_clinique'],
@@ -44,35 +134,58 @@ async def admin_dashboard(request: Request, db=Depends(get_db)):
                 "default_quota": clinic['default_quota'],
                 "subscription_start": clinic['subscription_start']
             })
-        return templates.TemplateResponse("dashboard.html", {"request": request, "clinics": clinic_list})
+        return templates.TemplateResponse(request, "dashboard.html", {"clinics": clinic_list})
     except Exception as e:
         return HTMLResponse(f"<h1>Erreur dans le dashboard admin</h1><p>{str(e)}</p>", status_code=500)
 
+async def render_edit_clinic(request: Request, api_key: str, export_token: Optional[str] = None):
+    row = await get_pool().run(fetch_clinic, api_key)
+    if not row:
+        raise HTTPException(status_code=404, detail="Clinique non trouvée")
+    pricing_dict = row['pricing'] if isinstance(row['pricing'], dict) else {}
+    return templates.TemplateResponse(request, "edit_clinic.html", {"export_token": export_token, "clinic": {
+        "api_key": row['api_key'],
+        "email_clinique": row['email_clinique'],
+        "pricing": pricing_dict,
+        "analysis_quota": row['analysis_quota'],
+        "default_quota": row['default_quota'],
+        "subscription_start": row['subscription_start'],
+        "rate_limit_per_minute": row['rate_limit_per_minute'],
+        "rate_limit_burst": row['rate_limit_burst'],
+        "has_export_token": row['export_token_hash'] is not None
+    }})
+
 @router.get("/edit/{api_key}", response_class=HTMLResponse)
-async def edit_clinic(request: Request, api_key: str, db=Depends(get_db)):
+async def edit_clinic(request: Request, api_key: str):
     try:
-        cursor = db.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT api_key, email_clinique, pricing, analysis_quota, default_quota, subscription_start FROM clinics WHERE api_key = %s", (api_key,))
-        row = cursor.fetchone()
+        return await render_edit_clinic(request, api_key)
+    except Exception as e:
+        return HTMLResponse(f"<h1>Erreur lors de l'édition</h1><p>{str(e)}</p>", status_code=500)
+
+# Le jeton ouvre l'export de toutes les analyses de la clinique : la route exige
+# l'authentification admin même si le routeur est monté ailleurs sans elle
+@router.post("/edit/{api_key}/export-token", response_class=HTMLResponse, dependencies=[Depends(require_admin)])
+async def regenerate_export_token(request: Request, api_key: str, confirm: bool = Form(False)):
+    """Nouveau jeton d'export, affiché une seule fois. Remplacer un jeton actif le révoque
+    aussitôt : il faut alors cocher la confirmation du formulaire."""
+    try:
+        row = await get_pool().run(fetch_clinic, api_key)
         if not row:
             raise HTTPException(status_code=404, detail="Clinique non trouvée")
-        try:
-            pricing_dict = json.loads(row['pricing']) if row['pricing'] else {}
-        except Exception:
-            pricing_dict = {}
-        return templates.TemplateResponse("edit_clinic.html", {"request": request, "clinic": {
-            "api_key": row['api_key'],
-            "email_clinique": row['email_clinique'],
-            "pricing": pricing_dict,
-            "analysis_quota": row['analysis_quota'],
-            "default_quota": row['default_quota'],
-            "subscription_start": row['subscription_start']
-        }})
+        if row['export_token_hash'] is not None and not confirm:
+            raise HTTPException(status_code=400,
+                                detail="Un jeton d'export est actif : confirmez sa révocation pour en créer un nouveau.")
+        token = await get_pool().run(set_export_token, api_key)
+        if row['export_token_hash'] is not None:
+            print(f"DEBUG: export token of clinic {api_key} revoked and replaced")
+        return await render_edit_clinic(request, api_key, export_token=token)
+    except HTTPException:
+        raise
     except Exception as e:
-        return HTMLResponse(f"<h1>Erreur lors de l'édition</h1><p>{str(e)}</p>", status_code=500)
+        return HTMLResponse(f"<h1>Erreur lors de la création du jeton</h1><p>{str(e)}</p>", status_code=500)
 
 @router.post("/edit/{api_key}")
-async def update_clinic(api_key: str, request: Request, db=Depends(get_db)):
+async def update_clinic(api_key: str, request: Request):
     try:
         form_data = await request.form()
         email_clinique = form_data.get("email_clinique")
@@ -81,11 +194,16 @@ async def update_clinic(api_key: str, request: Request, db=Depends(get_db)):
             json.loads(pricing_json)
         except Exception as e:
             raise HTTPException(status_code=400, detail="Le champ Pricing doit être un JSON valide.")
+        # Champs vides : débit par défaut du service
+        per_minute, burst = form_data.get("rate_limit_per_minute"), form_data.get("rate_limit_burst")
+        try:
+            rate_limit_per_minute = float(per_minute) if per_minute else None
+            rate_limit_burst = int(burst) if burst else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Limites de débit attendues sous forme de nombres.")
         try:
-            cursor = db.cursor()
-            cursor.execute("UPDATE clinics SET email_clinique = %s, pricing = %s WHERE api_key = %s", (email_clinique, pricing_json, api_key))
-            db.commit()
-            cursor.close()
+            await get_pool().run(update_clinic_row, api_key, email_clinique, pricing_json,
+                                 rate_limit_per_minute, rate_limit_burst)
             url = request.url_for("admin_dashboard")
             return RedirectResponse(url=url, status_code=303)
         except Exception as e:
@@ -96,25 +214,61 @@ async def update_clinic(api_key: str, request: Request, db=Depends(get_db)):
         print(f"DEBUG: Exception in update_config: {e}")
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
+@router.get("/analyses/stats")
+async def analysis_stats(clinic: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    try:
+        start, end = parse_date(date_from), parse_date(date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates attendues au format AAAA-MM-JJ.")
+    return await get_pool().run(fetch_analysis_stats, clinic, start, end)
+
+@router.get("/stats")
+async def clinic_stats(clinic: Optional[str] = None, date_from: Optional[str] = None, date_to: Optional[str] = None):
+    """Volume, stades, densité et traitements par jour, lus dans les agrégats sans parcourir les analyses"""
+    try:
+        start, end = parse_date(date_from), parse_date(date_to)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates attendues au format AAAA-MM-JJ.")
+    return await get_pool().run(fetch_stats, clinic, start, end)
+
 @router.get("/analyses", response_class=HTMLResponse)
-async def list_analyses(request: Request, db=Depends(get_db)):
+async def list_analyses(request: Request, clinic: Optional[str] = None, date_from: Optional[str] = None,
+                        date_to: Optional[str] = None, cursor: Optional[str] = None, page_size: int = PAGE_SIZE):
     try:
-        cursor = db.cursor(cursor_factory=DictCursor)
-        cursor.execute("SELECT id, clinic_api_key, client_email, result, timestamp FROM analyses ORDER BY timestamp DESC")
-        analyses = cursor.fetchall()
+        try:
+            start, end = parse_date(date_from), parse_date(date_to)
+            after = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            return HTMLResponse("<h1>Filtres invalides</h1><p>Dates attendues au format AAAA-MM-JJ.</p>", status_code=400)
+        page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+
+        # Une ligne de plus que la page pour savoir s'il existe une page suivante
+        rows = await get_pool().run(fetch_analyses, clinic, start, end, after, page_size + 1)
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+
         analysis_list = []
-        for a in analyses:
-            try:
-                result_dict = json.loads(a['result'])
-            except Exception:
-                result_dict = a['result']
+        for a in rows:
             analysis_list.append({
                 "id": a['id'],
                 "clinic_api_key": a['clinic_api_key'],
                 "client_email": a['client_email'],
-                "result": result_dict,
+                "result": a['result'],
                 "timestamp": a['timestamp']
             })
-        return templates.TemplateResponse("analyses.html", {"request": request, "analyses": analysis_list})
+
+        filters = {k: v for k, v in {"clinic": clinic, "date_from": date_from, "date_to": date_to}.items() if v}
+        next_url = None
+        if has_next:
+            last = rows[-1]
+            next_url = "?" + urlencode({**filters, "page_size": page_size,
+                                        "cursor": encode_cursor(last['timestamp'].isoformat(), last['id'])})
+        return templates.TemplateResponse(request, "analyses.html", {
+            "analyses": analysis_list,
+            "filters": filters,
+            "page_size": page_size,
+            "next_url": next_url,
+            "first_url": "?" + urlencode({**filters, "page_size": page_size}) if cursor else None
+        })
     except Exception as e:
         return HTMLResponse(f"<h1>Erreur lors du chargement des analyses</h1><p>{str(e)}</p>", status_code=500)
@@ -0,0 +1,125 @@
+import os
+import math
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+# Débit par clinique : seau de jetons en mémoire, rechargé à RATE_LIMIT_PER_MINUTE
+# analyses par minute jusqu'à RATE_LIMIT_BURST. Les colonnes rate_limit_per_minute
+# et rate_limit_burst de la table clinics remplacent ces valeurs par clinique.
+# Les seaux sont propres à chaque processus : avec N workers uvicorn, la limite
+# effective est N fois la limite configurée.
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 30))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", 10))
+RATE_LIMIT_CLINICS = int(os.getenv("RATE_LIMIT_CLINICS", 10000))
+
+# Analyses synchrones en cours par processus, et file d'attente courte au-delà
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 16))
+ADMISSION_QUEUE = int(os.getenv("ADMISSION_QUEUE", 16))
+ADMISSION_WAIT = float(os.getenv("ADMISSION_WAIT", 2))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 5))
+
+
+class Overloaded(Exception):
+    """Demande refusée sans traitement ; `retry_after` en secondes"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float, burst: int):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """Consomme un jeton ; retourne 0, ou le délai avant le prochain jeton disponible"""
+        rate = self.per_minute / 60
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / rate if rate > 0 else float("inf")
+
+
+class RateLimiter:
+    """Seaux de jetons par api_key, les moins récemment utilisés oubliés au-delà de `maxsize`"""
+
+    def __init__(self, maxsize: int = RATE_LIMIT_CLINICS):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, api_key: str, per_minute: Optional[float] = None, burst: Optional[int] = None):
+        """Lève Overloaded si la clinique a épuisé son débit"""
+        per_minute = RATE_LIMIT_PER_MINUTE if per_minute is None else per_minute
+        burst = RATE_LIMIT_BURST if burst is None else burst
+        if per_minute <= 0:
+            # 0 : pas de limite pour cette clinique
+            return
+        with self._lock:
+            bucket = self._buckets.get(api_key)
+            if bucket is None:
+                bucket = self._buckets[api_key] = TokenBucket(per_minute, burst)
+            elif (bucket.per_minute, bucket.burst) != (per_minute, burst):
+                # Configuration modifiée dans l'admin : nouveau débit, jetons conservés
+                bucket.per_minute, bucket.burst = per_minute, burst
+                bucket.tokens = min(bucket.tokens, burst)
+            self._buckets.move_to_end(api_key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+            wait = bucket.take(time.monotonic())
+        if wait > 0:
+            raise Overloaded("Trop de demandes d'analyse pour cette clinique", min(wait, 3600))
+
+
+class AdmissionGate:
+    """Plafond d'analyses simultanées avec une file d'attente bornée.
+
+    Au-delà de `max_in_flight`, au plus `max_waiting` demandes attendent une
+    place pendant `max_wait` secondes ; les autres sont refusées aussitôt. Les
+    demandes admises gardent ainsi une latence stable : la surcharge se
+    traduit par des refus rapides plutôt que par une file qui s'allonge.
+    """
+
+    def __init__(self, max_in_flight: int = MAX_IN_FLIGHT, max_waiting: int = ADMISSION_QUEUE,
+                 max_wait: float = ADMISSION_WAIT, retry_after: int = ADMISSION_RETRY_AFTER):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def start(self):
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+    async def acquire(self):
+        if self._semaphore.locked():
+            if self.waiting >= self.max_waiting:
+                raise Overloaded("Service saturé, réessayez dans quelques instants", self.retry_after)
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+            except asyncio.TimeoutError:
+                raise Overloaded("Service saturé, réessayez dans quelques instants", self.retry_after)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._semaphore.acquire()
+        self.in_flight += 1
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+rate_limiter = RateLimiter()
+admission_gate = AdmissionGate()
@@ -0,0 +1,193 @@
+import queue
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from detection import FACE_DETECTOR, VIEW_POLICY, create_detector, detection_image, hairline_landmarks, largest_face
+
+# Facteurs historiques de la chaîne ImageEnhance (contraste, luminosité, netteté)
+CONTRAST_FACTOR = 1.2
+BRIGHTNESS_FACTOR = 1.1
+SHARPNESS_FACTOR = 1.5
+
+# ImageEnhance.Sharpness mélange l'image avec ImageFilter.SMOOTH :
+# out = smooth + f * (img - smooth), soit une seule convolution f*I - (f-1)*SMOOTH
+_SMOOTH_KERNEL = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+_IDENTITY_KERNEL = np.zeros((3, 3), dtype=np.float32)
+_IDENTITY_KERNEL[1, 1] = 1
+SHARPEN_KERNEL = SHARPNESS_FACTOR * _IDENTITY_KERNEL - (SHARPNESS_FACTOR - 1) * _SMOOTH_KERNEL
+
+
+class PreparedImage(NamedTuple):
+    """Buffers produits une seule fois par vue et partagés par les étapes suivantes"""
+    bgr: np.ndarray
+    gray: np.ndarray
+
+
+def enhancement_lut(mean: int) -> np.ndarray:
+    """Contraste puis luminosité en une table de 256 entrées.
+
+    Reproduit l'arithmétique de PIL (Image.blend en float32 tronqué) pour que le
+    résultat reste identique à la chaîne ImageEnhance à un niveau de gris près.
+    """
+    values = np.arange(256, dtype=np.float32)
+    mean = np.float32(mean)
+    contrasted = np.clip(np.trunc(mean + np.float32(CONTRAST_FACTOR) * (values - mean)), 0, 255)
+    return np.clip(np.trunc(np.float32(BRIGHTNESS_FACTOR) * contrasted), 0, 255).astype(np.uint8)
+
+class DensityMap:
+    """Densité capillaire d'une vue, interrogeable sur n'importe quel rectangle en O(1).
+
+    L'image est seuillée une seule fois (Otsu sur la vue entière), puis une table
+    de sommes cumulées (image intégrale) donne le nombre de pixels « cheveu » de
+    tout rectangle en quatre lectures, quel que soit le nombre de zones mesurées.
+    """
+
+    def __init__(self, gray: np.ndarray):
+        self.threshold, mask = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        self.height, self.width = gray.shape[:2]
+        # (h+1)×(w+1), première ligne et première colonne à zéro
+        self.sums = cv2.integral(mask, sdepth=cv2.CV_32S)
+
+    def density(self, region: Tuple[int, int, int, int]) -> float:
+        return float(self.densities([region])[0])
+
+    def densities(self, regions) -> np.ndarray:
+        """N rectangles (x0, y0, x1, y1) → N densités, en une seule passe vectorisée"""
+        boxes = np.asarray(regions, dtype=np.int64).reshape(-1, 4)
+        x0 = np.clip(boxes[:, 0], 0, self.width)
+        y0 = np.clip(boxes[:, 1], 0, self.height)
+        x1 = np.clip(boxes[:, 2], 0, self.width)
+        y1 = np.clip(boxes[:, 3], 0, self.height)
+        counts = self.sums[y1, x1] - self.sums[y0, x1] - self.sums[y1, x0] + self.sums[y0, x0]
+        areas = np.maximum(x1 - x0, 0) * np.maximum(y1 - y0, 0)
+        return np.divide(counts, areas, out=np.zeros(len(boxes)), where=areas > 0)
+
+    def grid(self, rows: int = 8, cols: int = 8) -> np.ndarray:
+        """Carte grossière rows×cols des densités, par cellules régulières"""
+        ys = np.linspace(0, self.height, rows + 1).astype(np.int64)
+        xs = np.linspace(0, self.width, cols + 1).astype(np.int64)
+        y0, x0 = np.meshgrid(ys[:-1], xs[:-1], indexing="ij")
+        y1, x1 = np.meshgrid(ys[1:], xs[1:], indexing="ij")
+        boxes = np.stack([x0, y0, x1, y1], axis=-1).reshape(-1, 4)
+        return self.densities(boxes).reshape(rows, cols)
+
+
+# Classe d'analyse capillaire
+class HairLossAnalyzer:
+    norwood_classifications = {
+        "1": "Aucune perte visible",
+        "2A": "Légère récession frontotemporale",
+        "2": "Récession triangulaire frontotemporale",
+        "3": "Récession frontotemporale marquée",
+        "3A": "Récession frontale avec amincissement du vertex",
+        "3V": "Amincissement du vertex avec récession frontale limitée",
+        "4": "Calvitie frontale et vertex sévère",
+        "4A": "Calvitie frontale dominante",
+        "5": "Motif en fer à cheval",
+        "5A": "Perte du vertex étendue",
+        "6": "Calvitie avancée avec bande latérale",
+        "7": "Calvitie totale avec couronne résiduelle"
+    }
+
+    def __init__(self, detector: Optional[str] = None):
+        self.detector = create_detector(detector or FACE_DETECTOR)
+
+    def warm_up(self):
+        """Exécute le pipeline sur une image factice pour amorcer OpenCV"""
+        dummy = self.preprocess_image(np.full((1024, 1024, 3), 128, dtype=np.uint8))
+        for view in ("front", "top"):
+            self.analyze_anatomy(dummy, view)
+
+    def preprocess_image(self, rgb: np.ndarray) -> PreparedImage:
+        """Améliore la qualité de l'image pour l'analyse (contraste, luminosité, netteté)"""
+        bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+        mean = int(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY).mean() + 0.5)
+        enhanced = cv2.LUT(bgr, enhancement_lut(mean))
+
+        sharpened = cv2.filter2D(enhanced, -1, SHARPEN_KERNEL, borderType=cv2.BORDER_REPLICATE)
+        # PIL ne filtre pas le cadre d'un pixel : on le reprend tel quel
+        sharpened[0, :] = enhanced[0, :]
+        sharpened[-1, :] = enhanced[-1, :]
+        sharpened[:, 0] = enhanced[:, 0]
+        sharpened[:, -1] = enhanced[:, -1]
+
+        return PreparedImage(bgr=sharpened, gray=cv2.cvtColor(sharpened, cv2.COLOR_BGR2GRAY))
+
+    def analyze_anatomy(self, image: PreparedImage, view: Optional[str] = None) -> dict:
+        """Détecte les points anatomiques clés, selon VIEW_POLICY pour la vue donnée.
+
+        La recherche se fait sur une copie réduite (DETECTION_SIZE) et égalisée de
+        la vue ; les coordonnées renvoyées sont celles de l'image d'origine.
+        """
+        policy = VIEW_POLICY.get(view, "face")
+        if policy == "skip":
+            return {}
+        small, factor = detection_image(image.gray)
+        if policy == "hairline":
+            return hairline_landmarks(small, factor)
+
+        face = largest_face(self.detector.detect(small), factor)
+        if face is None:
+            return {}
+
+        x, y, w, h = face
+        return {
+            'face_bbox': (x, y, w, h),
+            'temporal_points': self._get_temporal_points(x, y, w, h),
+            'vertex_position': (x + w//2, y + h//3)
+        }
+
+    def _get_temporal_points(self, x, y, w, h):
+        return [
+            (x + int(w*0.15), y + h//3),
+            (x + int(w*0.85), y + h//3)
+        ]
+
+    def density_map(self, image: PreparedImage) -> DensityMap:
+        """Seuillage unique de la vue, pour mesurer ensuite autant de zones que nécessaire"""
+        return DensityMap(image.gray)
+
+    def measure_density(self, image: PreparedImage, region: Tuple[int, int, int, int]) -> float:
+        """Mesure la densité capillaire sur une région spécifique (seuil d'Otsu propre à la région).
+        Pour plusieurs régions d'une même vue, préférer density_map."""
+        crop = image.gray[region[1]:region[3], region[0]:region[2]]
+        _, thresh = cv2.threshold(crop, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+        return np.sum(thresh == 255) / thresh.size
+
+
+class AnalyzerPool:
+    """Analyseurs préchargés au démarrage, empruntés puis rendus par les tâches CPU.
+
+    cv2.CascadeClassifier n'étant pas thread-safe, chaque analyseur n'est utilisé
+    que par un seul thread à la fois ; la taille du pool suit celle du pool CPU.
+    """
+
+    def __init__(self, size: int, warm_up: bool = True):
+        self._analyzers: "queue.Queue[HairLossAnalyzer]" = queue.Queue(maxsize=size)
+        for _ in range(size):
+            analyzer = HairLossAnalyzer()
+            if warm_up:
+                analyzer.warm_up()
+            self._analyzers.put(analyzer)
+
+    def warm_up(self):
+        """Amorce tous les analyseurs. Un pool construit avant un fork (sans amorçage, les
+        threads internes d'OpenCV ne survivant pas au fork) est amorcé ainsi dans chaque worker."""
+        analyzers = [self._analyzers.get() for _ in range(self._analyzers.maxsize)]
+        try:
+            for analyzer in analyzers:
+                analyzer.warm_up()
+        finally:
+            for analyzer in analyzers:
+                self._analyzers.put(analyzer)
+
+    @contextmanager
+    def checkout(self, timeout: Optional[float] = None) -> Iterator[HairLossAnalyzer]:
+        analyzer = self._analyzers.get(timeout=timeout)
+        try:
+            yield analyzer
+        finally:
+            self._analyzers.put(analyzer)
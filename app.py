@@ -4,22 +4,41 @@ load_dotenv()
 
 import json
 import re
-import smtplib
-import base64
+import hashlib
+import asyncio
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+from datetime import date, datetime, timedelta
 from io import BytesIO
-from datetime import datetime, timedelta
-from typing import Optional, Dict, List, Tuple
-from PIL import Image, ImageEnhance
+from typing import BinaryIO, Callable, Optional, Dict, List, NamedTuple, Sequence, Set, Tuple
 
-import psycopg2
-from psycopg2.extras import DictCursor
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Depends, Form
+from psycopg2.extras import DictCursor, Json
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from openai import AsyncOpenAI
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, ValidationError
+
+from admin import router as admin_router
+from admission import Overloaded, admission_gate, rate_limiter
+from analyzer import AnalyzerPool, DensityMap, PreparedImage
+from clinic_cache import clinic_cache, ConfigListener
+from database import PoolTimeout, connect, get_pool, close_pool
+from export import FORMATS, MEDIA_TYPES, ChunkStream, clinic_for_export_token, stream_analyses
+from mailer import SMTPConfig, mailer
+from metrics import metrics, request_timings, server_timing
+from migrations import run_migrations
+from model_client import CircuitOpen, load_sdk, model_client
+from preclassifier import LocalEstimate, density_features, estimate_stage, estimate_summary, local_result, should_skip
+from payload import (GRID_LAYOUT, PAYLOAD_MODE, PAYLOAD_SIGNATURE, ImagePayload, build_grid_payload,
+                     build_view_payload, image_messages, payload_tokens)
+from rollups import apply_analysis
+from jobs import JobAlreadyDone, claim_job, complete_job, create_job, fail_job, get_job
+from result_cache import perceptual_hash, result_cache
+from uploads import MAX_UPLOAD_BYTES, UploadRejected, check_upload, decode_upload, detach_upload
 
 app = FastAPI()
 
@@ -34,14 +53,57 @@ app.add_middleware(
 )
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
+# Admin protégée par HTTP Basic (admin.require_admin), absente du schéma OpenAPI
+app.include_router(admin_router, prefix="/admin", include_in_schema=False)
 
-# Modèles Pydantic
-class SMTPConfig(BaseModel):
-    server: str = Field(..., env="SMTP_SERVER")
-    port: int = Field(..., env="SMTP_PORT")
-    user: EmailStr = Field(..., env="SMTP_USER")
-    password: str = Field(..., env="SMTP_PASSWORD")
+# Parallélisme : étapes CPU dans un pool de threads borné, appels modèle plafonnés
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", min(4, os.cpu_count() or 1)))
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", 8))
+VIEWS = ("front", "top", "side", "back")
+
+cpu_executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="analyze-cpu")
+model_semaphore: Optional[asyncio.Semaphore] = None
+analyzer_pool: Optional[AnalyzerPool] = None
+config_listener: Optional[ConfigListener] = None
 
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Refuse les corps de requête trop lourds avant même l'analyse du multipart"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > len(VIEWS) * MAX_UPLOAD_BYTES + 64 * 1024:
+        return JSONResponse({"detail": "Requête trop volumineuse"}, status_code=413)
+    return await call_next(request)
+
+@app.middleware("http")
+async def time_requests(request: Request, call_next):
+    """Durée de la requête par route, et durées par étape renvoyées dans l'en-tête Server-Timing"""
+    timings = []
+    token = request_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_timings.reset(token)
+    elapsed = time.perf_counter() - start
+    # Gabarit de la route plutôt que le chemin, pour ne pas multiplier les séries (/jobs/{job_id})
+    route = getattr(request.scope.get("route"), "path", "other")
+    metrics.request_seconds.observe(route, elapsed)
+    metrics.responses.inc(route, str(response.status_code))
+    timings.append(("total", elapsed))
+    response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+def run_cpu(fn: Callable, *args) -> asyncio.Future:
+    """Exécute `fn` dans le pool CPU avec le contexte de la requête (durées Server-Timing)"""
+    return asyncio.get_running_loop().run_in_executor(cpu_executor, contextvars.copy_context().run, fn, *args)
+
+async def db_call(stage: str, fn: Callable, *args):
+    """Helper base de données exécuté dans le pool de connexions, chronométré sous `stage`
+    (attente d'une connexion comprise)"""
+    with metrics.timed(stage):
+        return await get_pool().run(fn, *args)
+
+# Modèles Pydantic
 class ClinicConfigUpdate(BaseModel):
     api_key: str
     email: Optional[EmailStr] = None
@@ -49,114 +111,511 @@ class ClinicConfigUpdate(BaseModel):
     pricing: Dict[str, int] = {}
     button_color: str = "#0000ff"
 
-# Classe d'analyse capillaire
-class HairLossAnalyzer:
-    def __init__(self):
-        self.norwood_classifications = {
-            "1": "Aucune perte visible",
-            "2A": "Légère récession frontotemporale",
-            "2": "Récession triangulaire frontotemporale",
-            "3": "Récession frontotemporale marquée",
-            "3A": "Récession frontale avec amincissement du vertex",
-            "3V": "Amincissement du vertex avec récession frontale limitée",
-            "4": "Calvitie frontale et vertex sévère",
-            "4A": "Calvitie frontale dominante",
-            "5": "Motif en fer à cheval",
-            "5A": "Perte du vertex étendue",
-            "6": "Calvitie avancée avec bande latérale",
-            "7": "Calvitie totale avec couronne résiduelle"
-        }
-        
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-
-    def preprocess_image(self, image: Image.Image) -> Image.Image:
-        """Améliore la qualité de l'image pour l'analyse"""
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            
-        enhancers = [
-            (ImageEnhance.Contrast, 1.2),
-            (ImageEnhance.Brightness, 1.1),
-            (ImageEnhance.Sharpness, 1.5)
-        ]
-        
-        for enhancer_type, factor in enhancers:
-            enhancer = enhancer_type(image)
-            image = enhancer.enhance(factor)
-            
-        return image
-
-    def analyze_anatomy(self, image: Image.Image) -> dict:
-        """Détecte les points anatomiques clés"""
-        img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        faces = self.face_cascade.detectMultiScale(img_cv, 1.1, 4)
-        
-        if not faces:
-            return {}
-        
-        x, y, w, h = faces[0]
-        return {
-            'face_bbox': (x, y, w, h),
-            'temporal_points': self._get_temporal_points(x, y, w, h),
-            'vertex_position': (x + w//2, y + h//3)
-        }
+# Préparation des vues
+MODEL = "gpt-4-turbo"
 
-    def _get_temporal_points(self, x, y, w, h):
-        return [
-            (x + int(w*0.15), y + h//3),
-            (x + int(w*0.85), y + h//3)
-        ]
+VIEW_PROMPT = """
+    Analysez cette image ({label}) selon :
+    1. Échelle de Norwood-Hamilton
+    2. Densité capillaire (échelle Savin)
+    3. Récession temporale
+    4. Miniaturisation
+    5. Motif de perte
+    
+    Points anatomiques : {anatomy}
+    
+    Réponse JSON :
+    {{
+        "stade": "string",
+        "sous_type": "string",
+        "densite": 0-100,
+        "zones_affectees": ["liste"],
+        "traitements": ["liste"],
+        "confiance": 0-100
+    }}
+    """
 
-    def measure_density(self, image: Image.Image, region: Tuple[int, int, int, int]) -> float:
-        """Mesure la densité capillaire sur une région spécifique"""
-        img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        crop = img_cv[region[1]:region[3], region[0]:region[2]]
-        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
-        return np.sum(thresh == 255) / thresh.size
+# Mode mosaïque : les quatre vues dans une seule image, une réponse par vue
+GRID_PROMPT = """
+    Cette image regroupe quatre vues du même patient : {layout}.
+    Pour chaque vue, analysez selon :
+    1. Échelle de Norwood-Hamilton
+    2. Densité capillaire (échelle Savin)
+    3. Récession temporale
+    4. Miniaturisation
+    5. Motif de perte
 
-# Fonctions de base de données
-def get_db_connection():
-    database_url = os.getenv("DATABASE_URL")
+    Points anatomiques par vue : {anatomy}
+
+    Réponse JSON, une entrée par vue ({views}) :
+    {{
+        "<vue>": {{
+            "stade": "string",
+            "sous_type": "string",
+            "densite": 0-100,
+            "zones_affectees": ["liste"],
+            "traitements": ["liste"],
+            "confiance": 0-100
+        }}
+    }}
+    """
+GRID_POSITIONS = ("en haut à gauche", "en haut à droite", "en bas à gauche", "en bas à droite")
+
+# Toute modification du prompt, du modèle ou de la forme des images envoyées invalide les réponses en cache
+PROMPT_VERSION = hashlib.sha1(f"{MODEL}\n{VIEW_PROMPT}\n{GRID_PROMPT}\n{PAYLOAD_SIGNATURE}".encode()).hexdigest()[:12]
+
+# Carte de densité renvoyée avec chaque vue : DENSITY_GRID×DENSITY_GRID cellules
+DENSITY_GRID = int(os.getenv("DENSITY_GRID", 8))
+
+class PreparedView(NamedTuple):
+    image: PreparedImage
+    anatomy: dict
+    phash: int
+    estimate: LocalEstimate
+    density_grid: list
+
+def prepare_view(upload: BinaryIO, label: str) -> PreparedView:
+    """Étapes CPU d'une vue : décodage, amélioration, anatomie, hash perceptuel,
+    densités (un seul seuillage par vue) et estimation locale"""
+    with metrics.timed("decode"):
+        rgb = decode_upload(upload)
+    with analyzer_pool.checkout() as analyzer:
+        with metrics.timed("preprocess"):
+            prepared = analyzer.preprocess_image(rgb)
+        with metrics.timed("anatomy"):
+            anatomy = analyzer.analyze_anatomy(prepared, label)
+    with metrics.timed("density"):
+        density_map = DensityMap(prepared.gray)
+        estimate = estimate_stage(density_features(density_map, label, anatomy))
+        density_grid = density_map.grid(DENSITY_GRID, DENSITY_GRID).round(3).tolist()
+    with metrics.timed("phash"):
+        phash = perceptual_hash(prepared.gray)
+    return PreparedView(image=prepared, anatomy=anatomy, phash=phash, estimate=estimate, density_grid=density_grid)
+
+class ModelResponseError(ValueError):
+    """Réponse du modèle illisible ou sans le résultat attendu"""
+
+async def complete_json(prompt: str, image: ImagePayload, max_tokens: int = 1000) -> dict:
+    with metrics.timed("model_wait"):
+        await model_semaphore.acquire()
     try:
-        return psycopg2.connect(database_url or "")
-    except:
-        return psycopg2.connect(
-            host=os.getenv("PGHOST"),
-            port=os.getenv("PGPORT", 5432),
-            database=os.getenv("PGDATABASE"),
-            user=os.getenv("PGUSER"),
-            password=os.getenv("PGPASSWORD")
+        with metrics.timed("model"):
+            response = await model_client.complete(
+                model=MODEL,
+                messages=image_messages(prompt, image),
+                response_format={"type": "json_object"},
+                max_tokens=max_tokens
+            )
+    finally:
+        model_semaphore.release()
+    try:
+        return json.loads(response.choices[0].message.content)
+    except (TypeError, ValueError) as e:
+        raise ModelResponseError(f"Réponse du modèle illisible : {e}")
+
+def log_payload(label: str, prompt: str, image: ImagePayload) -> dict:
+    stats = {"bytes": image.bytes, "tokens": payload_tokens(prompt, image)}
+    print(f"DEBUG: payload {label} mode={PAYLOAD_MODE} {image.width}x{image.height} q={image.quality} "
+          f"{stats['bytes']} B ~{stats['tokens']} tokens")
+    return stats
+
+def finish_view(result: dict, view: PreparedView, label: str, source: str) -> dict:
+    """`source` : "model", "cache" ou "local" (estimation locale jugée assez sûre)"""
+    result.update({
+        "anatomy": view.anatomy,
+        "view": label,
+        "source": source,
+        "cache_hit": source == "cache",
+        "estimation_locale": estimate_summary(view.estimate),
+        "densite_grille": view.density_grid,
+        "timestamp": datetime.now().isoformat()
+    })
+    return result
+
+def cache_scope(api_key: str, client_email: str, label: str) -> str:
+    """Portée du cache de résultats : une photo quasi identique ne réutilise que la
+    réponse obtenue pour le même patient de la même clinique"""
+    return f"{PROMPT_VERSION}:{api_key}:{client_email.strip().lower()}:{label}"
+
+async def analyze_view(upload: BinaryIO, label: str, api_key: str, client_email: str) -> Tuple[dict, Optional[dict]]:
+    """Prépare une vue hors de la boucle d'événements puis l'envoie au modèle, sauf si
+    une vue identique ou quasi identique a déjà été analysée ou si l'estimation locale
+    suffit. Retourne le résultat et le coût estimé de l'envoi (None sans appel)."""
+    view = await run_cpu(prepare_view, upload, label)
+
+    scope = cache_scope(api_key, client_email, label)
+    result = await run_cpu(metrics.call, "cache", result_cache.lookup, scope, view.phash)
+    source, stats = "cache", None
+    if result is None and should_skip(view.estimate):
+        source, result = "local", local_result(view.estimate)
+    elif result is None:
+        image = await run_cpu(metrics.call, "encode", build_view_payload, view.image, view.anatomy)
+        prompt = VIEW_PROMPT.format(label=label, anatomy=view.anatomy)
+        stats = log_payload(label, prompt, image)
+        result = await complete_json(prompt, image)
+        source = "model"
+        await run_cpu(metrics.call, "cache", result_cache.store, scope, view.phash, result)
+
+    return finish_view(result, view, label, source), stats
+
+async def analyze_grid(uploads: Sequence[BinaryIO], api_key: str, client_email: str,
+                       on_view: Optional[Callable[[str, dict], None]]) -> Tuple[List[dict], List[dict]]:
+    """Mode mosaïque : un seul appel au modèle pour toutes les vues absentes du cache
+    que l'estimation locale ne suffit pas à trancher"""
+    prepared_views = await asyncio.gather(*(run_cpu(prepare_view, upload, label) for upload, label in zip(uploads, VIEWS)))
+    scopes = [cache_scope(api_key, client_email, label) for label in VIEWS]
+    cached = await asyncio.gather(*(
+        run_cpu(metrics.call, "cache", result_cache.lookup, scope, view.phash)
+        for scope, view in zip(scopes, prepared_views)
+    ))
+
+    sources = ["cache" if result is not None else "model" for result in cached]
+    for index, view in enumerate(prepared_views):
+        if cached[index] is None and should_skip(view.estimate):
+            sources[index], cached[index] = "local", local_result(view.estimate)
+
+    stats = []
+    if "model" in sources:
+        views = dict(zip(VIEWS, prepared_views))
+        image = await run_cpu(
+            metrics.call, "encode", build_grid_payload, [(views[label].image, views[label].anatomy) for label in GRID_LAYOUT]
         )
+        prompt = GRID_PROMPT.format(
+            layout=", ".join(f"{label} {position}" for label, position in zip(GRID_LAYOUT, GRID_POSITIONS)),
+            anatomy={label: views[label].anatomy for label in GRID_LAYOUT},
+            views=", ".join(GRID_LAYOUT)
+        )
+        stats.append(log_payload("grid", prompt, image))
+        answer = await complete_json(prompt, image, max_tokens=2500)
+        for index, (label, scope, view) in enumerate(zip(VIEWS, scopes, prepared_views)):
+            if sources[index] == "model":
+                if not isinstance(answer.get(label), dict):
+                    raise ModelResponseError(f"Réponse du modèle sans résultat pour la vue {label}")
+                cached[index] = answer[label]
+                await run_cpu(metrics.call, "cache", result_cache.store, scope, view.phash, cached[index])
+
+    outputs = []
+    for label, result, source, view in zip(VIEWS, cached, sources, prepared_views):
+        outputs.append(finish_view(result, view, label, source))
+        if on_view is not None:
+            on_view(label, outputs[-1])
+    return outputs, stats
 
-def init_db(db):
+# Sérialisation JSON
+def json_default(value):
+    """Sérialise les scalaires et tableaux NumPy présents dans les résultats"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"{type(value).__name__} non sérialisable")
+
+def json_dumps(value) -> str:
+    return json.dumps(value, default=json_default)
+
+# Fonctions de base de données
+def get_clinic_config(db, api_key: str) -> Optional[dict]:
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            "SELECT api_key, email_clinique, pricing, smtp, rate_limit_per_minute, rate_limit_burst "
+            "FROM clinics WHERE api_key = %s",
+            (api_key,)
+        )
+        row = cursor.fetchone()
+    if not row:
+        return None
+    config = dict(row)
+    config['pricing'] = row['pricing'] or {}
+    return config
+
+async def load_clinic_config(api_key: str) -> Optional[dict]:
+    """Configuration de la clinique, servie par le cache du processus si possible"""
+    found, clinic_config = clinic_cache.lookup(api_key)
+    if not found:
+        clinic_config = await db_call("db_clinic", get_clinic_config, api_key)
+        clinic_cache.store(api_key, clinic_config)
+    return clinic_config
+
+# Période d'abonnement au terme de laquelle analysis_quota repart de default_quota
+QUOTA_PERIOD_DAYS = int(os.getenv("QUOTA_PERIOD_DAYS", 30))
+
+PERIOD_EXPIRED_SQL = "(subscription_start IS NOT NULL AND subscription_start + make_interval(days => %(period)s) <= now())"
+
+def reserve_quota(db, api_key: str) -> Optional[int]:
+    """Réserve une analyse en une seule instruction : recharge le quota si la période
+    est écoulée puis décrémente. Retourne le quota restant, ou None si épuisé.
+
+    Le verrou de ligne pris par l'UPDATE sérialise les requêtes concurrentes d'une
+    même clinique, et Postgres réévalue la ligne à jour : le quota ne peut jamais
+    être dépassé.
+    """
     with db.cursor() as cursor:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS clinics (
-                api_key TEXT PRIMARY KEY,
-                email_clinique TEXT,
-                pricing TEXT,
-                analysis_quota INTEGER DEFAULT 0,
-                default_quota INTEGER DEFAULT 0,
-                subscription_start TEXT
-            )
-        ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS analyses (
-                id SERIAL PRIMARY KEY,
-                clinic_api_key TEXT,
-                client_email TEXT,
-                result TEXT,
-                timestamp TEXT,
-                metadata TEXT
-            )
-        ''')
+        cursor.execute(
+            f"""
+            UPDATE clinics SET
+                analysis_quota = CASE WHEN {PERIOD_EXPIRED_SQL} THEN default_quota ELSE analysis_quota END - 1,
+                subscription_start = CASE WHEN {PERIOD_EXPIRED_SQL} THEN now() ELSE subscription_start END
+            WHERE api_key = %(api_key)s
+              AND CASE WHEN {PERIOD_EXPIRED_SQL} THEN default_quota ELSE analysis_quota END > 0
+            RETURNING analysis_quota
+            """,
+            {"api_key": api_key, "period": QUOTA_PERIOD_DAYS}
+        )
+        row = cursor.fetchone()
+    db.commit()
+    return row[0] if row else None
+
+def refund_quota(db, api_key: str):
+    """Rend une analyse réservée par reserve_quota lorsque le traitement échoue"""
+    with db.cursor() as cursor:
+        cursor.execute("UPDATE clinics SET analysis_quota = analysis_quota + 1 WHERE api_key = %s", (api_key,))
+    db.commit()
+
+def save_analysis(db, api_key: str, client_email: str, result: dict, metadata: Optional[dict] = None,
+                  job_id: Optional[str] = None):
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO analyses (clinic_api_key, client_email, result, timestamp, metadata) "
+            "VALUES (%s, %s, %s, now(), %s) RETURNING id",
+            (api_key, client_email, Json(result, dumps=json_dumps), Json(metadata or {}))
+        )
+        analysis_id = cursor.fetchone()[0]
+    # Agrégats quotidiens mis à jour dans la même transaction que l'analyse
+    apply_analysis(db, analysis_id)
+    # Job terminé dans la même transaction : un job repris après un échec ne peut pas
+    # être enregistré deux fois
+    if job_id is not None:
+        complete_job(db, job_id, {**result, "metadata": metadata or {}})
     db.commit()
 
+# Pipeline d'analyse commun au mode synchrone et au mode job
+async def run_analysis(uploads: Sequence[BinaryIO], api_key: str, client_email: str,
+                       age: int, family_history: bool,
+                       on_view: Optional[Callable[[str, dict], None]] = None,
+                       job_id: Optional[str] = None) -> Tuple[dict, dict]:
+    """Analyse les quatre vues en parallèle, agrège et enregistre le résultat.
+
+    `on_view` est appelé dès qu'une vue est analysée (mode streaming). Avec `job_id`,
+    le job est marqué terminé dans la transaction qui enregistre l'analyse. Le quota
+    doit avoir été réservé par l'appelant, qui le rend en cas d'échec.
+    """
+    async def run_view(upload: BinaryIO, label: str) -> Tuple[dict, Optional[dict]]:
+        result, stats = await analyze_view(upload, label, api_key, client_email)
+        if on_view is not None:
+            on_view(label, result)
+        return result, stats
+
+    if PAYLOAD_MODE == "grid":
+        outputs, payload_stats = await analyze_grid(uploads, api_key, client_email, on_view)
+    else:
+        pairs = await asyncio.gather(*(run_view(upload, label) for upload, label in zip(uploads, VIEWS)))
+        outputs = [result for result, _ in pairs]
+        payload_stats = [stats for _, stats in pairs if stats is not None]
+    results = dict(zip(VIEWS, outputs))
+
+    # Agrégation des résultats
+    final_result = aggregate_results(results, age, family_history)
+    metadata = {
+        "prompt_version": PROMPT_VERSION,
+        "cache_hits": [label for label, view in results.items() if view["cache_hit"]],
+        # Stade retenu et estimation locale par vue, pour l'évaluation du pré-classifieur
+        "views": {
+            label: {"stade": view.get("stade"), "source": view["source"], "local": view["estimation_locale"]}
+            for label, view in results.items()
+        },
+        "payload": {
+            "mode": PAYLOAD_MODE,
+            "model_calls": len(payload_stats),
+            "bytes": sum(stats["bytes"] for stats in payload_stats),
+            "estimated_tokens": sum(stats["tokens"] for stats in payload_stats)
+        }
+    }
+
+    # Mise à jour de la base de données
+    await db_call("db_save", save_analysis, api_key, client_email, final_result, metadata, job_id)
+    return final_result, metadata
+
+def send_result_emails(clinic_config: dict, client_email: str, final_result: dict):
+    """Met les deux emails en file d'envoi, sur le serveur SMTP de la clinique ou celui par défaut.
+
+    Ne lève jamais : l'analyse est déjà enregistrée et le quota consommé, un problème
+    d'email ne doit pas changer la réponse HTTP (le client réessaierait et paierait deux fois).
+    """
+    report = json.dumps(final_result, indent=2, default=json_default)
+    emails = [(client_email, "Vos résultats d'analyse", f"Bonjour,\n\nVos résultats :\n{report}\n\nCordialement")]
+    if clinic_config.get('email_clinique'):
+        emails.insert(0, (clinic_config['email_clinique'], "Nouvelle analyse capillaire",
+                          f"Résultats pour {client_email}:\n{report}"))
+    try:
+        smtp_config = SMTPConfig(**clinic_config['smtp']) if clinic_config.get('smtp') else SMTPConfig.from_env()
+    except (ValidationError, TypeError, ValueError) as e:
+        print(f"DEBUG: invalid SMTP configuration for clinic {clinic_config.get('api_key')}: {e}")
+        for to, subject, body in emails:
+            mailer.abandon(to, subject, body, f"configuration SMTP invalide : {e}")
+        return
+    if smtp_config is None:
+        print("DEBUG: no SMTP server configured, result emails not sent")
+        return
+
+    try:
+        with metrics.timed("email_queue"):
+            for to, subject, body in emails:
+                mailer.send(smtp_config, to, subject, body)
+    except Exception as e:
+        print(f"DEBUG: result emails not queued: {e}")
+
+# Mode job : file d'attente Postgres consommée par JOB_WORKERS workers par processus
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 2))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 2))
+JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", 600))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 2))
+
+job_wakeup: Optional[asyncio.Event] = None
+job_tasks: List[asyncio.Task] = []
+
+def normalize_view(upload: BinaryIO) -> bytes:
+    """Décode la photo à 1024×1024, redressée, et la ré-encode pour la file d'attente"""
+    rgb = decode_upload(upload)
+    _, encoded = cv2.imencode('.jpg', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return encoded.tobytes()
+
+async def submit_job(uploads: Sequence[BinaryIO], api_key: str, client_email: str,
+                     age: int, family_history: bool) -> str:
+    encoded = await asyncio.gather(*(run_cpu(metrics.call, "decode", normalize_view, upload) for upload in uploads))
+    job_id = await db_call("db_job", create_job, api_key, client_email, age, family_history, dict(zip(VIEWS, encoded)))
+    job_wakeup.set()
+    return job_id
+
+async def process_job(job: dict):
+    api_key = job['clinic_api_key']
+    try:
+        final_result, metadata = await run_analysis(
+            [BytesIO(job[view]) for view in VIEWS], api_key, job['client_email'], job['age'], job['family_history'],
+            job_id=job['id']
+        )
+    except JobAlreadyDone:
+        # Repris par un autre worker pendant que celui-ci tournait encore : rien n'est
+        # enregistré ici, l'autre exécution (ou la suivante) fait foi pour le résultat et le quota
+        print(f"DEBUG: job {job['id']} no longer running here, result discarded")
+        return
+    except Exception as e:
+        retry = job['attempts'] < JOB_MAX_ATTEMPTS and not isinstance(e, UploadRejected)
+        print(f"DEBUG: job {job['id']} failed (attempt {job['attempts']}): {e}")
+        await db_call("db_job", fail_job, job['id'], str(e), retry)
+        if not retry:
+            await db_call("db_refund", refund_quota, api_key)
+        return
+
+    clinic_config = await load_clinic_config(api_key) or {}
+    send_result_emails(clinic_config, job['client_email'], final_result)
+
+async def job_worker():
+    db_pool = get_pool()
+    while True:
+        try:
+            job = await db_pool.run(claim_job, JOB_STALE_AFTER, JOB_MAX_ATTEMPTS)
+        except Exception as e:
+            print(f"DEBUG: job claim failed: {e}")
+            job = None
+        if job is None:
+            job_wakeup.clear()
+            try:
+                await asyncio.wait_for(job_wakeup.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        try:
+            await process_job(job)
+        except Exception as e:
+            print(f"DEBUG: job {job['id']} processing error: {e}")
+
+def reject(e: Overloaded, reason: str) -> HTTPException:
+    metrics.rejections.inc(reason)
+    return HTTPException(429, str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def admit_analysis(api_key: str, consent: bool, uploads: Sequence[BinaryIO], hold_slot: bool = True) -> dict:
+    """Vérifications communes aux endpoints d'analyse ; réserve une analyse sur le quota.
+
+    Avec `hold_slot`, la demande occupe une place de admission_gate que l'appelant
+    doit rendre (admission_gate.release) à la fin de l'analyse.
+    """
+    if not warmed_up:
+        raise HTTPException(503, "Service en cours de démarrage", headers={"Retry-After": "2"})
+    if not consent:
+        raise HTTPException(400, "Consentement requis")
+
+    # Les photos restent dans les fichiers temporaires de l'upload : seule leur taille est vérifiée ici
+    for upload in uploads:
+        check_upload(upload)
+
+    clinic_config = await load_clinic_config(api_key)
+    if not clinic_config:
+        raise HTTPException(404, "Clinique non trouvée")
+
+    # Refus rapides avant toute réservation : débit de la clinique, puis saturation du processus
+    try:
+        rate_limiter.check(api_key, clinic_config.get('rate_limit_per_minute'), clinic_config.get('rate_limit_burst'))
+    except Overloaded as e:
+        raise reject(e, "rate_limit")
+    if hold_slot:
+        try:
+            await admission_gate.acquire()
+        except Overloaded as e:
+            raise reject(e, "overloaded")
+
+    # Réservation atomique du quota
+    try:
+        reserved = await db_call("db_quota", reserve_quota, api_key)
+    except Exception:
+        if hold_slot:
+            admission_gate.release()
+        raise
+    if reserved is None:
+        if hold_slot:
+            admission_gate.release()
+        raise HTTPException(403, "Quota épuisé")
+    return clinic_config
+
+async def refund_after_failure(api_key: str):
+    """Rend le quota d'une analyse déjà en échec. Un échec du remboursement (pool saturé…)
+    est seulement journalisé : il ne doit pas masquer l'erreur d'origine."""
+    try:
+        await db_call("db_refund", refund_quota, api_key)
+    except Exception as e:
+        print(f"DEBUG: quota refund failed for clinic {api_key}: {type(e).__name__}: {e}")
+
+def analysis_error(e: Exception) -> HTTPException:
+    """Traduit un échec du pipeline en réponse HTTP selon sa cause, et le journalise
+    avec l'étape en cause (étiquette posée par metrics.timed)"""
+    stage = getattr(e, "metrics_stage", None)
+    if stage is None:
+        stage = "analyze"
+        metrics.stage_errors.inc(stage, type(e).__name__)
+    print(f"DEBUG: analysis failed at stage {stage}: {type(e).__name__}: {e}")
+    if isinstance(e, UploadRejected):
+        return HTTPException(e.status_code, str(e))
+    if isinstance(e, CircuitOpen):
+        return HTTPException(503, "Service d'analyse temporairement indisponible",
+                             headers={"Retry-After": str(int(e.retry_after))})
+    # SDK déjà chargé : l'erreur vient de model_client
+    from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+    if isinstance(e, RateLimitError):
+        return HTTPException(503, "Service d'analyse saturé, réessayez dans quelques instants",
+                             headers={"Retry-After": "30"})
+    if isinstance(e, APITimeoutError):
+        return HTTPException(504, "Le service d'analyse n'a pas répondu à temps")
+    if isinstance(e, (APIConnectionError, APIStatusError)):
+        return HTTPException(502, "Service d'analyse indisponible")
+    if isinstance(e, ModelResponseError):
+        return HTTPException(502, "Réponse du service d'analyse invalide")
+    if isinstance(e, PoolTimeout):
+        return HTTPException(503, "Base de données saturée, réessayez dans quelques instants",
+                             headers={"Retry-After": "5"})
+    return HTTPException(500, f"Erreur interne ({stage})")
+
 # Endpoints FastAPI
 @app.post("/analyze")
 async def analyze(
-    background_tasks: BackgroundTasks,
     front: UploadFile = File(...),
     top: UploadFile = File(...),
     side: UploadFile = File(...),
@@ -166,106 +625,172 @@ async def analyze(
     age: int = Form(30),
     family_history: bool = Form(False),
     consent: bool = Form(...),
-    db=Depends(get_db)
+    job: bool = Form(False)
 ):
     try:
-        # Vérifications initiales
-        if not consent:
-            raise HTTPException(400, "Consentement requis")
-        
-        clinic_config = get_clinic_config(db, api_key)
-        if not clinic_config:
-            raise HTTPException(404, "Clinique non trouvée")
-        
-        # Gestion des quotas
-        reset_quota_if_needed(db, clinic_config, api_key)
-        if clinic_config['analysis_quota'] <= 0:
-            raise HTTPException(403, "Quota épuisé")
-
-        # Analyse des images
-        analyzer = HairLossAnalyzer()
-        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        
-        async def process_image(file: UploadFile, label: str):
-            img = Image.open(BytesIO(await file.read())).resize((1024, 1024))
-            img = analyzer.preprocess_image(img)
-            anatomy = analyzer.analyze_anatomy(img)
-            
-            buffered = BytesIO()
-            img.save(buffered, format="JPEG", quality=90)
-            b64_image = base64.b64encode(buffered.getvalue()).decode()
-
-            prompt = f"""
-            Analysez cette image ({label}) selon :
-            1. Échelle de Norwood-Hamilton
-            2. Densité capillaire (échelle Savin)
-            3. Récession temporale
-            4. Miniaturisation
-            5. Motif de perte
-            
-            Points anatomiques : {anatomy}
-            
-            Réponse JSON :
-            {{
-                "stade": "string",
-                "sous_type": "string",
-                "densite": 0-100,
-                "zones_affectees": ["liste"],
-                "traitements": ["liste"],
-                "confiance": 0-100
-            }}
-            """
-
-            response = await client.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[{"role": "user", "content": prompt + f"\nImage: {b64_image}"}],
-                response_format={"type": "json_object"},
-                max_tokens=1000
-            )
-            
-            result = json.loads(response.choices[0].message.content)
-            result.update({
-                "anatomy": anatomy,
-                "view": label,
-                "timestamp": datetime.now().isoformat()
-            })
-            return result
-
-        # Traitement parallèle des images
-        results = {
-            "front": await process_image(front, "front"),
-            "top": await process_image(top, "top"),
-            "side": await process_image(side, "side"),
-            "back": await process_image(back, "back")
-        }
+        uploads = [file.file for file in (front, top, side, back)]
+        clinic_config = await admit_analysis(api_key, consent, uploads, hold_slot=not job)
 
-        # Agrégation des résultats
-        final_result = self.aggregate_results(results, age, family_history)
-        
-        # Mise à jour de la base de données
-        update_clinic_quota(db, api_key, clinic_config['analysis_quota'] - 1)
-        save_analysis(db, api_key, client_email, final_result)
-        
-        # Envoi des emails
-        if clinic_config.get('email_clinique'):
-            background_tasks.add_task(
-                send_email,
-                clinic_config['email_clinique'],
-                "Nouvelle analyse capillaire",
-                f"Résultats pour {client_email}:\n{json.dumps(final_result, indent=2)}"
-            )
-            
-        background_tasks.add_task(
-            send_email,
-            client_email,
-            "Vos résultats d'analyse",
-            f"Bonjour,\n\nVos résultats :\n{json.dumps(final_result, indent=2)}\n\nCordialement"
-        )
+        try:
+            if job:
+                # Mode job : les vues décodées sont mises en file, le résultat se consulte sur /jobs/{id}
+                job_id = await submit_job(uploads, api_key, client_email, age, family_history)
+                return JSONResponse(
+                    {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"},
+                    status_code=202
+                )
+            final_result, metadata = await run_analysis(uploads, api_key, client_email, age, family_history)
+        except Exception:
+            # Le quota réservé est rendu si l'analyse n'aboutit pas
+            await db_call("db_refund", refund_quota, api_key)
+            raise
+        finally:
+            if not job:
+                admission_gate.release()
 
+        # Envoi des emails, en file : la réponse n'attend aucun échange SMTP
+        send_result_emails(clinic_config, client_email, final_result)
+
+        final_result["metadata"] = metadata
         return final_result
 
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise analysis_error(e)
+
+# Pipelines des réponses en streaming, conservés jusqu'à leur fin
+stream_tasks: Set[asyncio.Task] = set()
+
+@app.post("/analyze/stream")
+async def analyze_stream(
+    front: UploadFile = File(...),
+    top: UploadFile = File(...),
+    side: UploadFile = File(...),
+    back: UploadFile = File(...),
+    api_key: str = Form(...),
+    client_email: str = Form(...),
+    age: int = Form(30),
+    family_history: bool = Form(False),
+    consent: bool = Form(...)
+):
+    """Variante NDJSON de /analyze : une ligne par vue dès que le modèle répond,
+    puis une ligne avec le résultat agrégé (ou une ligne d'erreur)"""
+    try:
+        uploads = [file.file for file in (front, top, side, back)]
+        clinic_config = await admit_analysis(api_key, consent, uploads)
+    except HTTPException:
+        raise
+    except Exception as e:
+        # Comme /analyze : UploadRejected, PoolTimeout (503 + Retry-After)…
+        raise analysis_error(e)
+
+    # FastAPI ferme les fichiers de l'upload à la fin de la réponse, déconnexion comprise :
+    # le pipeline, qui peut lui survivre, travaille sur ses propres copies
+    loop = asyncio.get_running_loop()
+    try:
+        uploads = list(await asyncio.gather(*(loop.run_in_executor(None, detach_upload, upload)
+                                               for upload in uploads)))
     except Exception as e:
-        raise HTTPException(500, f"Erreur interne : {str(e)}")
+        admission_gate.release()
+        await refund_after_failure(api_key)
+        raise analysis_error(e)
+
+    events: asyncio.Queue = asyncio.Queue()
+
+    def on_view(label: str, result: dict):
+        events.put_nowait({"type": "view", "view": label, "result": result})
+
+    async def pipeline():
+        # Tâche indépendante du client : une déconnexion n'interrompt ni l'enregistrement ni les emails
+        try:
+            final_result, metadata = await run_analysis(uploads, api_key, client_email, age, family_history, on_view)
+        except Exception as e:
+            # L'événement final d'abord : stream() l'attend, quoi qu'il arrive au remboursement
+            error = analysis_error(e)
+            events.put_nowait({"type": "error", "status": error.status_code, "detail": error.detail})
+            await refund_after_failure(api_key)
+            return
+        finally:
+            admission_gate.release()
+            for upload in uploads:
+                upload.close()
+        events.put_nowait({"type": "result", "result": {**final_result, "metadata": metadata}})
+        send_result_emails(clinic_config, client_email, final_result)
+
+    task = asyncio.create_task(pipeline())
+    stream_tasks.add(task)
+    task.add_done_callback(stream_tasks.discard)
+
+    async def stream():
+        while True:
+            event = await events.get()
+            yield json_dumps(event) + "\n"
+            if event["type"] != "view":
+                break
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson", headers={"Cache-Control": "no-store"})
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Histogrammes de durée par étape et par route, échecs par étape (format texte Prometheus)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+class ExportResponse(StreamingResponse):
+    """Réponse d'export qui arrête la lecture en base quoi qu'il arrive : fin normale,
+    déconnexion du client (ClientDisconnect ne passe pas par `background`) ou
+    réponse jamais itérée. Sans cela, le thread producteur garderait sa connexion
+    et son créneau d'export jusqu'au passage du ramasse-miettes."""
+
+    def __init__(self, stream: ChunkStream, **kwargs):
+        super().__init__(stream, **kwargs)
+        self.stream = stream
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.stream.cancel()
+
+@app.get("/export")
+async def export(
+    authorization: Optional[str] = Header(None),
+    format: str = Query("ndjson"),
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to")
+):
+    """Analyses d'une clinique en flux NDJSON ou CSV, éventuellement limitées à une
+    période (AAAA-MM-JJ, `to` inclus). Authentification par le jeton d'export de la
+    clinique (Authorization: Bearer …), créé dans l'admin ; jamais par l'api_key,
+    qui figure dans le code du widget."""
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token.strip():
+        raise HTTPException(401, "Jeton d'export requis", headers={"WWW-Authenticate": "Bearer"})
+    if format not in FORMATS:
+        raise HTTPException(400, f"Format inconnu (attendu : {', '.join(FORMATS)})")
+    try:
+        period = [date.fromisoformat(value) if value else None for value in (date_from, date_to)]
+    except ValueError:
+        raise HTTPException(400, "Date invalide (attendu : AAAA-MM-JJ)")
+
+    api_key = await db_call("db_export_auth", clinic_for_export_token, token.strip())
+    if api_key is None:
+        raise HTTPException(401, "Jeton d'export invalide", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        stream = stream_analyses(format, api_key, *period)
+    except Overloaded as e:
+        raise reject(e, "export")
+    filename = f"analyses.{format}"
+    return ExportResponse(stream, media_type=MEDIA_TYPES[format], headers={
+        "Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"
+    })
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await db_call("db_job", get_job, job_id)
+    if not job:
+        raise HTTPException(404, "Job introuvable")
+    return job
 
 # Fonctions utilitaires
 def aggregate_results(results: dict, age: int, family_history: bool) -> dict:
@@ -278,8 +803,9 @@ def aggregate_results(results: dict, age: int, family_history: bool) -> dict:
         "sous_type_dominant": max(subtypes, key=subtypes.count) if subtypes else None,
         "densite_moyenne": np.mean([v['densite'] for v in results.values()]),
         "zones_affectees": list(set().union(*[v['zones_affectees'] for v in results.values()])),
-        "traitements_recommandes": self.get_treatments(results),
-        "risque_progression": self.predict_progression(results, age, family_history)
+        "traitements_recommandes": get_treatments(results),
+        "risque_progression": predict_progression(results, age, family_history),
+        "cartes_densite": {label: v['densite_grille'] for label, v in results.items() if 'densite_grille' in v}
     }
 
 def get_treatments(results: dict) -> list:
@@ -294,11 +820,120 @@ def predict_progression(results: dict, age: int, history: bool) -> dict:
         base_risk = "Très élevé"
     return {"niveau": base_risk, "suivi_recommandé": "Trimestriel" if base_risk != "Modéré" else "Annuel"}
 
+# Démarrage. Le serveur écoute dès le hook startup ; le reste (migrations, analyseurs,
+# première connexion, SDK openai) se fait en tâche de fond, et /ready répond 200 une
+# fois terminé. Sous gunicorn (gunicorn.conf.py), preload() fait une partie de ce
+# travail une seule fois dans le processus parent, avant le fork des workers.
+# MIGRATE_ON_STARTUP=0 quand les migrations sont lancées à part (python -m migrations).
+MIGRATE_ON_STARTUP = os.getenv("MIGRATE_ON_STARTUP", "1") != "0"
+
+schema_ready = False
+warmed_up = False
+warmup_error: Optional[str] = None
+warmup_seconds: Optional[float] = None
+warmup_task: Optional[asyncio.Task] = None
+
+def migrate():
+    """Migrations sur une connexion dédiée, fermée aussitôt (rien d'ouvert à hériter par un fork)"""
+    global schema_ready
+    db = connect()
+    try:
+        run_migrations(db)
+    finally:
+        db.close()
+    schema_ready = True
+
+def preload():
+    """Appelé par gunicorn dans le processus parent : migrations une fois par déploiement
+    plutôt qu'une fois par worker, SDK openai importé et cascades chargées une seule fois,
+    partagés ensuite par les workers en copie sur écriture"""
+    global analyzer_pool
+    start = time.perf_counter()
+    if MIGRATE_ON_STARTUP:
+        try:
+            migrate()
+        except Exception as e:
+            # Nouvel essai dans chaque worker, dont /ready signalera l'échec éventuel
+            print(f"DEBUG: preload migrations failed: {type(e).__name__}: {e}")
+    load_sdk()
+    # Amorcés après le fork, dans chaque worker (AnalyzerPool.warm_up)
+    analyzer_pool = AnalyzerPool(CPU_WORKERS, warm_up=False)
+    print(f"DEBUG: preload done in {time.perf_counter() - start:.2f}s")
+
+# Échec du démarrage (Postgres momentanément injoignable…) : nouvel essai après un
+# délai croissant, plafonné à WARMUP_MAX_BACKOFF secondes ; /ready signale l'échec entre-temps
+WARMUP_MAX_BACKOFF = float(os.getenv("WARMUP_MAX_BACKOFF", 30))
+
+async def warm_up():
+    global analyzer_pool, config_listener, warmed_up, warmup_error, warmup_seconds
+    loop = asyncio.get_running_loop()
+    start = time.perf_counter()
+    pool_warmed = False
+    attempt = 0
+    while True:
+        try:
+            if MIGRATE_ON_STARTUP and not schema_ready:
+                await loop.run_in_executor(None, migrate)
+            # Un analyseur préchargé et amorcé par thread du pool CPU
+            if analyzer_pool is None:
+                analyzer_pool = await loop.run_in_executor(cpu_executor, AnalyzerPool, CPU_WORKERS)
+            elif not pool_warmed:
+                await loop.run_in_executor(cpu_executor, analyzer_pool.warm_up)
+            pool_warmed = True
+            await loop.run_in_executor(None, load_sdk)
+            # Premières connexions du pool (DB_POOL_MIN) ouvertes avant la première requête,
+            # hors de la boucle : get_pool() lui-même n'ouvre rien
+            await loop.run_in_executor(None, get_pool().prefill)
+            break
+        except Exception as e:
+            attempt += 1
+            delay = min(WARMUP_MAX_BACKOFF, 2 ** (attempt - 1))
+            warmup_error = f"{type(e).__name__}: {e}"
+            print(f"DEBUG: warm-up failed (attempt {attempt}), retry in {delay:.0f}s: {warmup_error}")
+            await asyncio.sleep(delay)
+    warmup_error = None
+    # Invalidation du cache des cliniques lors des modifications faites dans l'admin
+    config_listener = ConfigListener(connect, clinic_cache)
+    config_listener.start()
+    job_tasks.extend(asyncio.create_task(job_worker()) for _ in range(JOB_WORKERS))
+    warmup_seconds = time.perf_counter() - start
+    print(f"DEBUG: warm-up done in {warmup_seconds:.2f}s")
+    warmed_up = True
+
+@app.get("/ready")
+async def ready():
+    """Sonde de disponibilité : 503 tant que le démarrage n'est pas terminé ; `failed` avec la
+    cause du dernier échec pendant que warm_up attend son prochain essai"""
+    if warmup_error is not None:
+        return JSONResponse({"status": "failed", "detail": warmup_error}, status_code=503,
+                            headers={"Retry-After": "5"})
+    if not warmed_up:
+        return JSONResponse({"status": "starting"}, status_code=503, headers={"Retry-After": "1"})
+    return {"status": "ready", "warmup_seconds": round(warmup_seconds, 3)}
+
 @app.on_event("startup")
 async def startup():
-    db = get_db_connection()
-    init_db(db)
-    db.close()
+    global model_semaphore, job_wakeup, warmup_task
+    model_semaphore = asyncio.Semaphore(MODEL_CONCURRENCY)
+    admission_gate.start()
+    job_wakeup = asyncio.Event()
+    mailer.start()
+    warmup_task = asyncio.create_task(warm_up())
+
+@app.on_event("shutdown")
+async def shutdown():
+    if warmup_task is not None:
+        warmup_task.cancel()
+    # Les jobs interrompus restent 'running' et seront repris après JOB_STALE_AFTER
+    for task in job_tasks:
+        task.cancel()
+    cpu_executor.shutdown(wait=False)
+    # Quelques secondes pour vider la file d'envoi ; le reste part en dead letters
+    await asyncio.get_running_loop().run_in_executor(None, mailer.stop)
+    if config_listener is not None:
+        config_listener.stop()
+    await model_client.close()
+    close_pool()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,115 @@
+"""Latence des analyses admises sous surcharge, avec et sans contrôle d'admission.
+
+    python -m bench.admission --rates 2 4 8 16 --duration 10
+
+Simule /analyze sans base de données : chaque analyse fait quatre appels au
+faux serveur OpenAI (bench.fake_openai) sous un sémaphore MODEL_CONCURRENCY,
+comme app.complete_json. Les demandes arrivent selon un processus de Poisson
+au débit `--rates` (analyses/s). Sans contrôle, toutes attendent leur tour ;
+avec admission.AdmissionGate, les demandes au-delà de la capacité sont
+refusées vite (429) et les demandes admises gardent une latence stable.
+Le débit par clinique (RateLimiter, rafale de 2) est testé à part avec `--clinic-rate`.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from typing import List, Optional
+
+from admission import AdmissionGate, Overloaded, RateLimiter
+from bench.fake_openai import FakeOpenAI
+from bench.micro import percentiles
+from model_client import ModelClient
+
+REQUEST = {"model": "fake", "messages": [{"role": "user", "content": "Analysez cette image"}],
+           "response_format": {"type": "json_object"}, "max_tokens": 200}
+
+
+async def run(rate: float, duration: float, model_concurrency: int, gate: Optional[AdmissionGate],
+              limiter: Optional[RateLimiter] = None, clinic_rate: Optional[float] = None, clinics: int = 1):
+    client = ModelClient(timeout=30)
+    semaphore = asyncio.Semaphore(model_concurrency)
+    if gate is not None:
+        gate.start()
+    admitted: List[float] = []
+    rejected: List[float] = []
+
+    async def call():
+        async with semaphore:
+            return await client.complete(**REQUEST)
+
+    async def analysis(api_key: str):
+        start = time.perf_counter()
+        try:
+            if limiter is not None:
+                limiter.check(api_key, clinic_rate, 2)
+            if gate is not None:
+                await gate.acquire()
+        except Overloaded:
+            rejected.append((time.perf_counter() - start) * 1000)
+            return
+        try:
+            await asyncio.gather(*(call() for _ in range(4)))
+        finally:
+            if gate is not None:
+                gate.release()
+        admitted.append((time.perf_counter() - start) * 1000)
+
+    tasks = []
+    deadline = time.perf_counter() + duration
+    rng = random.Random(0)
+    while time.perf_counter() < deadline:
+        tasks.append(asyncio.create_task(analysis(f"clinic-{rng.randrange(clinics)}")))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    await client.close()
+    return admitted, rejected
+
+
+def report(name: str, admitted: List[float], rejected: List[float]):
+    stats = percentiles(admitted) if admitted else {"p50": 0, "p95": 0, "p99": 0}
+    slowest_reject = max(rejected) if rejected else 0
+    print(f"{name:<22} {len(admitted):>7} {len(rejected):>7} {stats['p50']:>8.0f} {stats['p99']:>8.0f} "
+          f"{slowest_reject:>10.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", type=float, nargs="+", default=[2, 4, 8, 16], help="analyses/s offertes")
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.5, help="latence du faux modèle (s)")
+    parser.add_argument("--model-concurrency", type=int, default=8)
+    parser.add_argument("--max-in-flight", type=int, default=4)
+    parser.add_argument("--queue", type=int, default=4)
+    parser.add_argument("--wait", type=float, default=1.0)
+    parser.add_argument("--clinic-rate", type=float, help="analyses/min par clinique (teste RateLimiter)")
+    parser.add_argument("--clinics", type=int, default=4)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, jitter=0.2).start()
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    capacity = args.model_concurrency / (4 * args.latency)
+    print(f"capacité ≈ {capacity:.1f} analyses/s ; latences en ms")
+    print(f"{'débit offert':<22} {'admises':>7} {'refusées':>7} {'p50':>8} {'p99':>8} {'refus max':>10}")
+    try:
+        if args.clinic_rate:
+            limiter = RateLimiter()
+            for rate in args.rates:
+                admitted, rejected = asyncio.run(run(rate, args.duration, args.model_concurrency, None,
+                                                     limiter, args.clinic_rate, args.clinics))
+                report(f"{rate:g}/s débit clinique", admitted, rejected)
+            return
+        for rate in args.rates:
+            admitted, rejected = asyncio.run(run(rate, args.duration, args.model_concurrency, None))
+            report(f"{rate:g}/s sans contrôle", admitted, rejected)
+            gate = AdmissionGate(args.max_in_flight, args.queue, args.wait)
+            admitted, rejected = asyncio.run(run(rate, args.duration, args.model_concurrency, gate))
+            report(f"{rate:g}/s admission", admitted, rejected)
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
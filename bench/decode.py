@@ -0,0 +1,88 @@
+"""Temps et mémoire crête du décodage des photos de téléphone.
+
+    python -m bench.decode --megapixels 12 48
+
+Compare l'ancien chemin (read() complet + décodage pleine définition + resize)
+au décodage réduit de uploads.decode_upload. Chaque mesure tourne dans un
+sous-processus pour que la mémoire crête (VmHWM) lui soit propre.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from uploads import ORIENTATION_TAG, decode_upload
+
+MODES = ("legacy", "reduced")
+
+
+def make_photo(path: str, megapixels: int):
+    """JPEG 4:3 synthétique, orienté EXIF comme une photo prise en portrait"""
+    height = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    small = np.random.default_rng(megapixels).integers(0, 256, (height // 64, width // 64, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((width, height), Image.Resampling.BILINEAR)
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = 6
+    img.save(path, format="JPEG", quality=92, exif=exif)
+
+
+def peak_rss_kb() -> int:
+    """VmHWM du processus ; contrairement à ru_maxrss, il n'hérite pas du parent"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_child(mode: str, path: str, repeat: int):
+    baseline = peak_rss_kb()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        with open(path, "rb") as f:
+            if mode == "legacy":
+                Image.open(BytesIO(f.read())).resize((1024, 1024)).convert('RGB')
+            else:
+                decode_upload(f)
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    peak = peak_rss_kb() - baseline
+    print(f"{elapsed:.1f} {peak / 1024:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=int, nargs="+", default=[12, 48])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--child", nargs=2, metavar=("MODE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child[0], args.child[1], args.repeat)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for megapixels in args.megapixels:
+            path = os.path.join(tmp, f"photo_{megapixels}mp.jpg")
+            make_photo(path, megapixels)
+            size_mb = os.path.getsize(path) / 1e6
+            for mode in MODES:
+                out = subprocess.run(
+                    [sys.executable, "-m", "bench.decode", "--repeat", str(args.repeat), "--child", mode, path],
+                    check=True, capture_output=True, text=True
+                ).stdout.split()
+                print(f"{megapixels:>3} MP ({size_mb:.1f} Mo) {mode:<8} {out[0]:>8} ms/photo  mémoire crête +{out[1]} Mo")
+
+
+if __name__ == "__main__":
+    main()
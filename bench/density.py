@@ -0,0 +1,72 @@
+"""Mesure de densité sur de nombreuses zones : image intégrale contre mesure par région.
+
+    python -m bench.density --regions 16 64 256 1024
+
+Compare, pour N rectangles aléatoires d'une vue 1024×1024 :
+  per-crop : HairLossAnalyzer.measure_density (seuil d'Otsu recalculé par région)
+  per-mask : un seul seuillage, puis comptage sur la découpe de chaque région
+  integral : DensityMap (seuillage et table de sommes une fois, requêtes vectorisées)
+per-mask et integral doivent donner exactement les mêmes densités.
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from analyzer import DensityMap, HairLossAnalyzer
+
+
+def random_regions(count: int, size: int = 1024, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    corners = rng.integers(0, size - 16, (count, 2))
+    extents = rng.integers(16, size // 2, (count, 2))
+    far = np.minimum(corners + extents, size)
+    return np.column_stack([corners[:, 0], corners[:, 1], far[:, 0], far[:, 1]])
+
+
+def per_mask(gray: np.ndarray, regions: np.ndarray) -> np.ndarray:
+    _, mask = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return np.array([mask[y0:y1, x0:x1].mean() for x0, y0, x1, y1 in regions])
+
+
+def integral(gray: np.ndarray, regions: np.ndarray) -> np.ndarray:
+    return DensityMap(gray).densities(regions)
+
+
+def timed(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--regions", type=int, nargs="+", default=[16, 64, 256, 1024])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    analyzer = HairLossAnalyzer()
+    rng = np.random.default_rng(1)
+    noise = rng.integers(0, 256, (128, 128, 3), dtype=np.uint8)
+    rgb = cv2.resize(noise, (1024, 1024), interpolation=cv2.INTER_CUBIC)
+    prepared = analyzer.preprocess_image(rgb)
+
+    for count in args.regions:
+        regions = random_regions(count)
+        assert np.allclose(per_mask(prepared.gray, regions), integral(prepared.gray, regions)), "écart de densité"
+        crop = timed(lambda: [analyzer.measure_density(prepared, tuple(r)) for r in regions], args.repeat)
+        mask = timed(lambda: per_mask(prepared.gray, regions), args.repeat)
+        summed = timed(lambda: integral(prepared.gray, regions), args.repeat)
+        print(f"{count:>5} zones  per-crop {crop:8.2f} ms  per-mask {mask:8.2f} ms  integral {summed:6.2f} ms  "
+              f"(×{crop / summed:.0f} / ×{mask / summed:.1f})")
+
+    density_map = DensityMap(prepared.gray)
+    for cells in (8, 32):
+        grid = timed(lambda: density_map.grid(cells, cells), args.repeat * 10)
+        print(f"grille {cells}×{cells} : {grid:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Latence de la détection des repères anatomiques, par détecteur et par vue.
+
+    python -m bench.detection --repeat 10
+    FACE_MODEL_PATH=models/face_detection_yunet_2023mar.onnx python -m bench.detection
+
+Compare l'ancienne détection (cascade de Haar sur la vue BGR 1024×1024, pas
+de 1,1) à la détection sur copie réduite et égalisée pour chaque détecteur
+disponible, puis le coût total des quatre vues d'une analyse avec et sans la
+politique par vue (VIEW_POLICY).
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from analyzer import HairLossAnalyzer
+from detection import DETECTION_SIZE, DETECTORS, VIEW_POLICY, detection_image
+
+VIEWS = ("front", "top", "side", "back")
+
+
+def make_view(seed: int):
+    rng = np.random.default_rng(seed)
+    base = rng.integers(40, 220, (96, 96, 3), dtype=np.uint8)
+    return cv2.resize(base, (1024, 1024), interpolation=cv2.INTER_CUBIC)
+
+
+def timed(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    analyzer = HairLossAnalyzer("haar")
+    views = {label: analyzer.preprocess_image(make_view(seed)) for seed, label in enumerate(VIEWS)}
+    front = views["front"]
+
+    cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    legacy = timed(lambda: cascade.detectMultiScale(front.bgr, 1.1, 4), args.repeat)
+    print(f"{'haar 1024 BGR (historique)':<32} {legacy:8.2f} ms/vue")
+
+    small, _ = detection_image(front.gray)
+    for name, detector_class in DETECTORS.items():
+        try:
+            detector = detector_class()
+        except (FileNotFoundError, cv2.error) as e:
+            print(f"{name:<32} indisponible ({e})")
+            continue
+        elapsed = timed(lambda: detector.detect(small), args.repeat)
+        print(f"{f'{name} {DETECTION_SIZE} gris égalisé':<32} {elapsed:8.2f} ms/vue")
+
+    reduce_time = timed(lambda: detection_image(front.gray), args.repeat)
+    print(f"{'réduction + égalisation':<32} {reduce_time:8.2f} ms/vue")
+
+    before = legacy * len(VIEWS)
+    after = timed(lambda: [analyzer.analyze_anatomy(views[label], label) for label in VIEWS], args.repeat)
+    policy = ", ".join(f"{label}={VIEW_POLICY[label]}" for label in VIEWS)
+    print(f"analyse complète (4 vues) : {before:.1f} ms -> {after:.1f} ms  [{policy}]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Débit et mémoire crête de l'export des analyses sur une table synthétique.
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/postgres python -m bench.export --rows 1000000
+
+Remplit une base jetable (bench.pg) de `--rows` analyses réparties sur
+`--clinics` cliniques, puis exporte toute la table vers /dev/null, chaque
+mode dans un sous-processus pour mesurer sa mémoire crête :
+  fetchall : SELECT complet puis json.dumps ligne à ligne (comme la page d'admin)
+  ndjson   : export.export_analyses, curseur nommé
+  csv      : export.export_analyses, COPY ... TO STDOUT
+`--clinic-only` exporte une seule clinique (index analyses_clinic_timestamp_id_idx).
+Affiche lignes/s, octets produits et VmHWM du sous-processus.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import psycopg2
+from psycopg2.extras import DictCursor
+
+from bench.pg import PostgresUnavailable, throwaway_database
+from migrations import run_migrations
+
+MODES = ("fetchall", "ndjson", "csv")
+
+SEED_SQL = """
+    INSERT INTO analyses (clinic_api_key, client_email, result, timestamp, metadata)
+    SELECT 'bench-' || (g %% %(clinics)s),
+           'client' || g || '@bench.local',
+           jsonb_build_object(
+               'stade_principal', 'Stade ' || (g %% 7 + 1),
+               'densite_moyenne', (g %% 100) / 100.0,
+               'traitements', jsonb_build_array('Minoxidil', 'Finastéride'),
+               'progression', jsonb_build_object('niveau', 'Modéré', 'suivi_recommandé', 'Annuel'),
+               'vues', jsonb_build_object('front', 'Stade 2', 'top', 'Stade 3', 'side', 'Stade 2', 'back', 'Stade 1')
+           ),
+           now() - make_interval(secs => g),
+           jsonb_build_object('source', 'bench', 'payload_mode', 'grid')
+    FROM generate_series(1, %(rows)s) AS g
+"""
+
+
+def seed(database_url: str, rows: int, clinics: int):
+    db = psycopg2.connect(database_url)
+    try:
+        run_migrations(db)
+        with db.cursor() as cursor:
+            cursor.execute(SEED_SQL, {"rows": rows, "clinics": clinics})
+        db.commit()
+        db.autocommit = True
+        with db.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE analyses")
+    finally:
+        db.close()
+
+
+class CountingSink:
+    def __init__(self, out):
+        self.out = out
+        self.bytes = 0
+
+    def write(self, data: bytes) -> int:
+        self.bytes += len(data)
+        return self.out.write(data)
+
+
+def run_mode(mode: str, clinic: str):
+    """Exécuté dans le sous-processus : exporte puis affiche « lignes octets »"""
+    from database import connect
+    from export import export_analyses
+
+    db = connect()
+    with open(os.devnull, "wb") as devnull:
+        sink = CountingSink(devnull)
+        if mode == "fetchall":
+            with db.cursor(cursor_factory=DictCursor) as cursor:
+                cursor.execute(
+                    "SELECT id, clinic_api_key, client_email, result, timestamp, metadata FROM analyses "
+                    + ("WHERE clinic_api_key = %s " if clinic else "") + "ORDER BY timestamp, id",
+                    [clinic] if clinic else []
+                )
+                rows = cursor.fetchall()
+            for row in rows:
+                sink.write((json.dumps(dict(row), default=str) + "\n").encode())
+            count = len(rows)
+        else:
+            count = export_analyses(db, sink, mode, clinic or None)
+    db.close()
+    print(count, sink.bytes)
+
+
+def measure(database_url: str, mode: str, clinic: str):
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-m", "bench.export", "--child", mode, "--clinic", clinic],
+                             env={**os.environ, "DATABASE_URL": database_url}, stdout=subprocess.PIPE, text=True)
+    output = child.stdout.read()
+    _, status, usage = os.wait4(child.pid, 0)
+    elapsed = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"export {mode} en échec (statut {status})")
+    rows, size = (int(value) for value in output.split())
+    # ru_maxrss : Ko sous Linux
+    print(f"{mode:<10} {rows:>9} {rows / elapsed:>10.0f} {size / 1e6:>9.0f} {usage.ru_maxrss / 1024:>9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--clinics", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--clinic-only", action="store_true", help="exporte la seule clinique bench-0")
+    parser.add_argument("--clinic", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        run_mode(args.child, args.clinic)
+        return
+
+    try:
+        with throwaway_database() as database_url:
+            print(f"Insertion de {args.rows} analyses…")
+            start = time.perf_counter()
+            seed(database_url, args.rows, args.clinics)
+            print(f"  {time.perf_counter() - start:.0f} s")
+            clinic = "bench-0" if args.clinic_only else ""
+            print(f"{'mode':<10} {'lignes':>9} {'lignes/s':>10} {'Mo':>9} {'RSS Mo':>9}")
+            for mode in args.modes:
+                measure(database_url, mode, clinic)
+    except PostgresUnavailable as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""Serveur local compatible avec l'API Chat Completions d'OpenAI, pour les bancs d'essai.
+
+    python -m bench.fake_openai --port 8089 --latency 0.8 --jitter 0.5 --error-rate 0.05
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake uvicorn app:app
+
+Répond à POST /v1/chat/completions par un résultat d'analyse plausible (une vue,
+ou les quatre vues pour le prompt mosaïque) après `latency` secondes (± `jitter`
+en proportion). Une fraction `error_rate` des requêtes reçoit `error_status`
+(500 par défaut, 429 pour simuler la limitation de débit), et une fraction
+`stall_rate` ne répond qu'après `stall` secondes (appel « traînard »).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STAGES = ("2", "3", "3V", "4", "5A", "6")
+VIEWS = ("front", "top", "side", "back")
+
+
+def view_answer(rng: random.Random) -> dict:
+    return {
+        "stade": rng.choice(STAGES),
+        "sous_type": rng.choice(["A", "V", None]),
+        "densite": rng.randint(20, 90),
+        "zones_affectees": rng.sample(["frontale", "temporale", "vertex", "couronne"], 2),
+        "traitements": rng.sample(["Minoxidil topique", "Finastéride", "Greffe capillaire FUE", "PRP"], 2),
+        "confiance": rng.randint(60, 95)
+    }
+
+
+def prompt_text(body: dict) -> str:
+    parts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+class FakeOpenAI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.5, jitter: float = 0.3,
+                 error_rate: float = 0.0, error_status: int = 500, stall_rate: float = 0.0,
+                 stall: float = 10.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.connections = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeOpenAI":
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-openai", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _draw(self):
+        with self.lock:
+            self.requests += 1
+            delay = self.latency * (1 + self.rng.uniform(-self.jitter, self.jitter))
+            if self.rng.random() < self.stall_rate:
+                delay = self.stall
+            failed = self.rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            seed = self.rng.random()
+        return max(0.0, delay), failed, random.Random(seed)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections += 1
+
+            def _send(self, status: int, payload: dict, headers: dict = None):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Client parti entre-temps (délai dépassé, requête de couverture annulée)
+                    self.close_connection = True
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                delay, failed, rng = fake._draw()
+                time.sleep(delay)
+                if failed:
+                    headers = {"Retry-After": "1"} if fake.error_status == 429 else None
+                    self._send(fake.error_status, {"error": {"message": "injected failure", "type": "server_error"}},
+                               headers)
+                    return
+
+                text = prompt_text(body)
+                if "Pour chaque vue" in text:
+                    answer = {view: view_answer(rng) for view in VIEWS}
+                else:
+                    answer = view_answer(rng)
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "fake"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": json.dumps(answer, ensure_ascii=False)},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": 80,
+                              "total_tokens": len(text) // 4 + 80}
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.5, help="latence moyenne (s)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="variation relative de la latence")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--stall-rate", type=float, default=0.0)
+    parser.add_argument("--stall", type=float, default=10.0, help="latence des appels traînards (s)")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.host, args.port, args.latency, args.jitter, args.error_rate, args.error_status,
+                      args.stall_rate, args.stall)
+    print(f"OPENAI_BASE_URL={fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""Banc de charge de bout en bout de /analyze, hors ligne.
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/postgres \\
+        python -m bench.load --requests 200 --concurrency 16 \\
+            --config CPU_WORKERS=2 --config CPU_WORKERS=4,MODEL_CONCURRENCY=16 --config PAYLOAD_MODE=grid
+
+Démarre le faux serveur OpenAI (bench.fake_openai) et une base jetable
+(bench.pg), puis, pour chaque `--config` (variables d'environnement séparées
+par des virgules), lance `uvicorn app:app` dans un sous-processus, crée une
+clinique au quota suffisant et envoie `--requests` analyses à
+`--concurrency` requêtes simultanées. Les photos sont des JPEG synthétiques
+distincts et le cache de résultats est désactivé (RESULT_CACHE_SIZE=0) sauf
+si la configuration le redéfinit ; aucun email n'est envoyé (SMTP_SERVER vide).
+
+La clinique n'a pas de limite de débit : seul le plafond d'analyses en cours
+(MAX_IN_FLIGHT, ADMISSION_QUEUE) peut refuser des demandes.
+
+Affiche par configuration : réussites, refus d'admission (429) et échecs,
+latence p50/p95/p99 des réussites, débit et mémoire crête (VmHWM) du
+serveur, appels reçus par le faux modèle.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+import httpx
+import psycopg2
+
+from bench.fake_openai import FakeOpenAI
+from bench.micro import VIEWS, percentiles, synthetic_photo
+from bench.pg import PostgresUnavailable, free_port, throwaway_database
+from migrations import run_migrations
+
+BASE_ENV = {
+    "OPENAI_API_KEY": "bench",
+    "RESULT_CACHE_SIZE": "0",
+    "SMTP_SERVER": "",
+    "JOB_WORKERS": "1",
+}
+
+
+def parse_config(text: str) -> Dict[str, str]:
+    return dict(item.split("=", 1) for item in text.split(",") if item)
+
+
+def process_peak_rss_kb(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+    return 0
+
+
+def seed_clinic(database_url: str, quota: int) -> str:
+    api_key = f"bench-{uuid.uuid4().hex[:8]}"
+    db = psycopg2.connect(database_url)
+    try:
+        run_migrations(db)
+        with db.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO clinics (api_key, analysis_quota, default_quota, subscription_start, "
+                "rate_limit_per_minute) VALUES (%s, %s, %s, now(), 0)",
+                (api_key, quota, quota)
+            )
+        db.commit()
+    finally:
+        db.close()
+    return api_key
+
+
+def start_server(env: Dict[str, str], port: int, timeout: float = 60) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env={**os.environ, **env}
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"uvicorn s'est arrêté (code {server.returncode})")
+        # Le serveur écoute avant la fin de son démarrage (warm_up) : /analyze répond 503
+        # tant que /ready n'est pas à 200
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/ready", timeout=1).status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError("uvicorn n'a pas démarré à temps")
+
+
+async def fire(url: str, api_key: str, photo_sets: List[Dict[str, bytes]], requests: int,
+               concurrency: int, timeout: float) -> List[tuple]:
+    """(statut, latence en ms) de chaque requête ; statut 0 pour une erreur de transport"""
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def one(i: int):
+            photos = photo_sets[i % len(photo_sets)]
+            files = {label: (f"{label}.jpg", photos[label], "image/jpeg") for label in VIEWS}
+            data = {"api_key": api_key, "client_email": f"client{i}@bench.local", "consent": "true"}
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    response = await client.post(url, files=files, data=data)
+                    status = response.status_code
+                except httpx.TransportError:
+                    status = 0
+                return status, (time.perf_counter() - start) * 1000
+
+        return await asyncio.gather(*(one(i) for i in range(requests)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--config", action="append", default=None,
+                        help="variables d'environnement du serveur, ex. CPU_WORKERS=2,PAYLOAD_MODE=grid")
+    parser.add_argument("--megapixels", type=int, default=12)
+    parser.add_argument("--photo-sets", type=int, default=8, help="jeux de quatre photos distincts")
+    parser.add_argument("--latency", type=float, default=0.8, help="latence moyenne du faux modèle (s)")
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=120, help="délai client par requête (s)")
+    args = parser.parse_args()
+    configs = args.config or [""]
+
+    print(f"Génération de {args.photo_sets} jeux de photos {args.megapixels} MP…")
+    photo_sets = [
+        {label: synthetic_photo(args.megapixels, seed * len(VIEWS) + i) for i, label in enumerate(VIEWS)}
+        for seed in range(args.photo_sets)
+    ]
+
+    fake = FakeOpenAI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      error_status=args.error_status).start()
+    try:
+        with throwaway_database() as database_url:
+            print(f"{'configuration':<40} {'ok':>5} {'429':>5} {'err':>5} {'p50':>8} {'p95':>8} {'p99':>8} "
+                  f"{'req/s':>7} {'RSS Mo':>7} {'appels':>7}")
+            for config in configs:
+                env = {**BASE_ENV, "OPENAI_BASE_URL": fake.base_url, "DATABASE_URL": database_url,
+                       **parse_config(config)}
+                api_key = seed_clinic(database_url, args.requests * 2)
+                port = free_port()
+                calls_before = fake.requests
+                server = start_server(env, port)
+                try:
+                    start = time.perf_counter()
+                    outcomes = asyncio.run(fire(f"http://127.0.0.1:{port}/analyze", api_key, photo_sets,
+                                                args.requests, args.concurrency, args.timeout))
+                    elapsed = time.perf_counter() - start
+                    peak_mb = process_peak_rss_kb(server.pid) / 1024
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+
+                ok = [latency for status, latency in outcomes if status == 200]
+                throttled = sum(status == 429 for status, _ in outcomes)
+                stats = percentiles(ok) if ok else {"p50": 0, "p95": 0, "p99": 0}
+                failed = len(outcomes) - len(ok) - throttled
+                print(f"{config or '(défaut)':<40} {len(ok):>5} {throttled:>5} {failed:>5} "
+                      f"{stats['p50']:>8.0f} {stats['p95']:>8.0f} {stats['p99']:>8.0f} "
+                      f"{len(ok) / elapsed:>7.2f} {peak_mb:>7.0f} {fake.requests - calls_before:>7}")
+    except PostgresUnavailable as e:
+        sys.exit(str(e))
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Compare le service d'envoi mutualisé à une connexion SMTP par message,
+contre un serveur aiosmtpd local (pip install aiosmtpd).
+
+    python -m bench.mail_delivery --messages 200 --latency 0.02
+
+`--latency` ajoute un délai à chaque commande du serveur pour simuler un
+fournisseur distant. Un second serveur refuse un destinataire sur dix en 550
+et répond 421 à un DATA sur vingt : chaque message doit être soit reçu, soit
+placé en dead letter, jamais perdu.
+"""
+import argparse
+import asyncio
+import smtplib
+import socket
+import threading
+import time
+
+from aiosmtpd.controller import Controller
+
+from mailer import Mailer, OutgoingEmail, SMTPConfig
+
+
+class Recorder:
+    def __init__(self, latency: float, flaky: bool = False):
+        self.latency = latency
+        self.flaky = flaky
+        self.received = []
+        self.data_commands = 0
+        self.sessions = 0
+        self.lock = threading.Lock()
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        await asyncio.sleep(self.latency)
+        with self.lock:
+            self.sessions += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        await asyncio.sleep(self.latency)
+        if self.flaky and address.startswith("refuse"):
+            return "550 Boîte inconnue"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        with self.lock:
+            self.data_commands += 1
+            if self.flaky and self.data_commands % 20 == 7:
+                return "421 Service temporairement indisponible"
+            self.received.extend(envelope.rcpt_tos)
+        return "250 OK"
+
+
+def start_server(recorder: Recorder) -> Controller:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    controller = Controller(recorder, hostname="127.0.0.1", port=port)
+    controller.start()
+    return controller
+
+
+def per_message(config: SMTPConfig, messages: int):
+    """Comportement historique : connexion, envoi et fermeture pour chaque message"""
+    for i in range(messages):
+        message = OutgoingEmail(config, f"client{i}@example.com", "Vos résultats d'analyse", "Bonjour")
+        with smtplib.SMTP(config.server, config.port) as server:
+            server.sendmail(config.user, [message.to], message.as_string())
+
+
+def pooled(config: SMTPConfig, messages: int, dead_letters: list, prefix=lambda i: "client") -> Mailer:
+    mailer = Mailer(workers=2, batch_size=20, backoff=0.05, idle_timeout=5,
+                    dead_letter=lambda message, error: dead_letters.append((message.to, error)))
+    mailer.start()
+    for i in range(messages):
+        mailer.send(config, f"{prefix(i)}{i}@example.com", "Vos résultats d'analyse", "Bonjour")
+    mailer.stop(timeout=60)
+    return mailer
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="délai par commande SMTP (s)")
+    args = parser.parse_args()
+
+    for name, run in [("par message", "legacy"), ("mutualisé", "pooled")]:
+        recorder = Recorder(args.latency)
+        controller = start_server(recorder)
+        config = SMTPConfig(server="127.0.0.1", port=controller.port, user="clinique@example.com",
+                            password="", starttls=False)
+        start = time.perf_counter()
+        if run == "legacy":
+            per_message(config, args.messages)
+        else:
+            pooled(config, args.messages, [])
+        elapsed = time.perf_counter() - start
+        controller.stop()
+        assert len(recorder.received) == args.messages, (len(recorder.received), args.messages)
+        print(f"{name:12s} {elapsed:6.2f} s  {args.messages / elapsed:7.1f} msg/s  "
+              f"{recorder.sessions} session(s)")
+
+    recorder = Recorder(0, flaky=True)
+    controller = start_server(recorder)
+    config = SMTPConfig(server="127.0.0.1", port=controller.port, user="clinique@example.com",
+                        password="", starttls=False)
+    dead_letters = []
+    mailer = pooled(config, args.messages, dead_letters, prefix=lambda i: "refuse" if i % 10 == 0 else "client")
+    controller.stop()
+    refused = sum(1 for i in range(args.messages) if i % 10 == 0)
+    assert len(dead_letters) == refused, dead_letters
+    assert len(recorder.received) + len(dead_letters) == args.messages, (len(recorder.received), len(dead_letters))
+    print(f"serveur instable : {len(recorder.received)} reçus, {len(dead_letters)} dead letters (550), "
+          f"{mailer.connections_opened} connexion(s)")
+
+
+if __name__ == "__main__":
+    main()
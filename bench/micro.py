@@ -0,0 +1,101 @@
+"""Micro-bancs des étapes CPU de /analyze sur des photos de téléphone synthétiques.
+
+    python -m bench.micro --megapixels 12 48 --repeat 20
+
+Pour chaque définition : décodage (decode_upload), prétraitement
+(preprocess_image), repères anatomiques par vue (analyze_anatomy), densité
+(measure_density par région contre DensityMap), hachage perceptuel et
+encodage des vues envoyées au modèle (modes parts, crop et grid). Affiche
+p50/p95/p99 en ms et la mémoire crête (VmHWM) du processus.
+"""
+import argparse
+import time
+from io import BytesIO
+from typing import Callable, Dict, List
+
+import numpy as np
+from PIL import Image
+
+from analyzer import DensityMap, HairLossAnalyzer
+from bench.decode import peak_rss_kb
+from payload import build_grid_payload, build_view_payload
+from result_cache import perceptual_hash
+from uploads import ORIENTATION_TAG, decode_upload
+
+VIEWS = ("front", "top", "side", "back")
+REGIONS = [(256, 0, 768, 256), (102, 51, 307, 307), (307, 358, 717, 768)]
+
+
+def synthetic_photo(megapixels: int, seed: int = 0) -> bytes:
+    """JPEG 4:3 portrait (EXIF orientation 6) au grain proche d'une photo de téléphone"""
+    height = int((megapixels * 1_000_000 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (height // 64, width // 64, 3), dtype=np.uint8)
+    img = Image.fromarray(small).resize((width, height), Image.Resampling.BILINEAR)
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = 6
+    buffer = BytesIO()
+    img.save(buffer, format="JPEG", quality=92, exif=exif)
+    return buffer.getvalue()
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99}
+
+
+def measure(fn: Callable, repeat: int) -> List[float]:
+    fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(name: str, samples: List[float]):
+    stats = percentiles(samples)
+    print(f"  {name:<28} {stats['p50']:8.2f} {stats['p95']:8.2f} {stats['p99']:8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--megapixels", type=int, nargs="+", default=[12, 48])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    analyzer = HairLossAnalyzer()
+    analyzer.warm_up()
+    for megapixels in args.megapixels:
+        photos = {label: synthetic_photo(megapixels, seed) for seed, label in enumerate(VIEWS)}
+        size_mb = sum(len(data) for data in photos.values()) / len(photos) / 1e6
+        print(f"{megapixels} MP ({size_mb:.1f} Mo/photo) {'p50':>17} {'p95':>8} {'p99':>8} ms")
+
+        report("decode_upload", measure(lambda: decode_upload(BytesIO(photos["front"])), args.repeat))
+        decoded = {label: decode_upload(BytesIO(data)) for label, data in photos.items()}
+        report("preprocess_image", measure(lambda: analyzer.preprocess_image(decoded["front"]), args.repeat))
+        views = {label: analyzer.preprocess_image(rgb) for label, rgb in decoded.items()}
+        front = views["front"]
+
+        anatomy = {}
+        for label, prepared in views.items():
+            anatomy[label] = analyzer.analyze_anatomy(prepared, label)
+            report(f"analyze_anatomy {label}", measure(lambda: analyzer.analyze_anatomy(prepared, label), args.repeat))
+
+        report(f"measure_density ×{len(REGIONS)}",
+               measure(lambda: [analyzer.measure_density(front, region) for region in REGIONS], args.repeat))
+        report(f"DensityMap ×{len(REGIONS)}", measure(lambda: DensityMap(front.gray).densities(REGIONS), args.repeat))
+        report("perceptual_hash", measure(lambda: perceptual_hash(front.gray), args.repeat))
+
+        for mode in ("parts", "crop"):
+            report(f"encodage {mode}",
+                   measure(lambda: build_view_payload(front, anatomy["front"], mode), args.repeat))
+        grid_views = [(views[label], anatomy[label]) for label in VIEWS]
+        report("encodage grid (4 vues)", measure(lambda: build_grid_payload(grid_views), args.repeat))
+        print(f"  mémoire crête {peak_rss_kb() / 1024:.0f} Mo")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Migrations appliquées à une base historique jetable, sous écritures concurrentes.
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/postgres python -m bench.migrations --rows 200000
+
+Crée dans une base jetable (bench.pg) le schéma historique de l'ancien init_db
+(colonnes TEXT, sans index), le remplit de `--rows` analyses dont quelques
+valeurs atypiques (horodatages sans fuseau, vides ou illisibles, résultats non
+JSON), puis lance run_migrations depuis `--migrators` connexions à la fois
+(verrou consultatif) pendant qu'un écrivain insère et modifie des analyses.
+
+Vérifie ensuite les types des colonnes, la validité des index, qu'aucune
+ligne ni aucune modification de l'écrivain n'a été perdue pendant la recopie,
+que les triggers et fonctions temporaires ont disparu et qu'une seconde
+exécution ne fait rien. Affiche la durée des migrations et la latence
+maximale des écritures concurrentes (verrous subis) ; code de sortie 1 si une
+vérification échoue.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import psycopg2
+
+import migrations
+from bench.pg import PostgresUnavailable, throwaway_database
+
+LEGACY_SCHEMA_SQL = '''
+    CREATE TABLE clinics (
+        api_key TEXT PRIMARY KEY,
+        email_clinique TEXT,
+        pricing TEXT,
+        analysis_quota INTEGER DEFAULT 0,
+        default_quota INTEGER DEFAULT 0,
+        subscription_start TEXT
+    );
+    CREATE TABLE analyses (
+        id SERIAL PRIMARY KEY,
+        clinic_api_key TEXT,
+        client_email TEXT,
+        result TEXT,
+        timestamp TEXT,
+        metadata TEXT
+    );
+'''
+
+# Une ligne sur 1000 porte un résultat non JSON, une sur 997 un horodatage vide,
+# une sur 991 un horodatage illisible ; une sur deux n'a pas de fuseau
+SEED_SQL = '''
+    INSERT INTO clinics (api_key, email_clinique, pricing, analysis_quota, default_quota, subscription_start)
+    SELECT 'bench-' || c, 'clinique' || c || '@bench.local', '{"analyse": ' || c || '}', 100, 100,
+           to_char(now() - make_interval(days => c), 'YYYY-MM-DD"T"HH24:MI:SS.US')
+    FROM generate_series(0, %(clinics)s - 1) AS c;
+
+    INSERT INTO analyses (clinic_api_key, client_email, result, timestamp, metadata)
+    SELECT 'bench-' || (g %% %(clinics)s),
+           'client' || g || '@bench.local',
+           CASE WHEN g %% 1000 = 0 THEN 'pas du JSON ' || g
+                ELSE '{"stade_principal": "Stade ' || (g %% 7 + 1) || '", "densite_moyenne": 0.5}' END,
+           CASE WHEN g %% 997 = 0 THEN ''
+                WHEN g %% 991 = 0 THEN 'hier'
+                WHEN g %% 2 = 0 THEN to_char(now() - make_interval(secs => g), 'YYYY-MM-DD"T"HH24:MI:SS.US')
+                ELSE to_char(now() - make_interval(secs => g), 'YYYY-MM-DD"T"HH24:MI:SS.US') || '+00:00' END,
+           '{"source": "legacy"}'
+    FROM generate_series(1, %(rows)s) AS g;
+'''
+
+EXPECTED_TYPES = {
+    ("clinics", "pricing"): "jsonb",
+    ("clinics", "subscription_start"): "timestamp with time zone",
+    ("analyses", "result"): "jsonb",
+    ("analyses", "metadata"): "jsonb",
+    ("analyses", "timestamp"): "timestamp with time zone",
+}
+
+EXPECTED_INDEXES = ("analyses_timestamp_id_idx", "analyses_clinic_timestamp_id_idx",
+                    "analyses_stage_idx", "analyses_clinic_stage_idx")
+
+
+class Writer(threading.Thread):
+    """Insertions et modifications de résultats en autocommit, comme l'API pendant un déploiement"""
+
+    def __init__(self, database_url: str, rows: int):
+        super().__init__(name="bench-writer", daemon=True)
+        self.database_url = database_url
+        self.rows = rows
+        self.stop = threading.Event()
+        self.inserted = 0
+        self.updates: Dict[int, int] = {}
+        self.latencies: List[float] = []
+        self.errors: List[str] = []
+
+    def run(self):
+        db = psycopg2.connect(self.database_url)
+        db.autocommit = True
+        sequence = 0
+        try:
+            while not self.stop.is_set():
+                sequence += 1
+                start = time.perf_counter()
+                try:
+                    with db.cursor() as cursor:
+                        if sequence % 2:
+                            cursor.execute(
+                                "INSERT INTO analyses (clinic_api_key, client_email, result, timestamp, metadata) "
+                                "VALUES ('bench-0', 'writer@bench.local', %s, %s, '{}')",
+                                ('{"stade_principal": "Stade 1"}', time.strftime("%Y-%m-%dT%H:%M:%S+00:00"))
+                            )
+                            self.inserted += 1
+                        else:
+                            # Valeur propre à chaque modification : une recopie qui la perdrait se voit
+                            analysis_id = random.randint(1, self.rows)
+                            cursor.execute("UPDATE analyses SET result = %s WHERE id = %s",
+                                           (f'{{"writer": {sequence}}}', analysis_id))
+                            self.updates[analysis_id] = sequence
+                except psycopg2.Error as e:
+                    self.errors.append(f"{type(e).__name__}: {e}".strip())
+                self.latencies.append(time.perf_counter() - start)
+                time.sleep(0.002)
+        finally:
+            db.close()
+
+
+def seed(database_url: str, rows: int, clinics: int):
+    db = psycopg2.connect(database_url)
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(LEGACY_SCHEMA_SQL)
+            cursor.execute(SEED_SQL, {"rows": rows, "clinics": clinics})
+        db.commit()
+    finally:
+        db.close()
+
+
+def migrate(database_url: str) -> float:
+    db = psycopg2.connect(database_url)
+    try:
+        start = time.perf_counter()
+        migrations.run_migrations(db)
+        return time.perf_counter() - start
+    finally:
+        db.close()
+
+
+def check(database_url: str, rows: int, writer: Writer) -> List[str]:
+    """Liste des vérifications en échec"""
+    failures = []
+    db = psycopg2.connect(database_url)
+    try:
+        with db.cursor() as cursor:
+            for (table, column), expected in EXPECTED_TYPES.items():
+                actual = migrations.column_type(db, table, column)
+                if actual != expected:
+                    failures.append(f"{table}.{column} : type {actual!r}, attendu {expected!r}")
+
+            for name in EXPECTED_INDEXES:
+                cursor.execute(
+                    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = %s",
+                    (name,)
+                )
+                row = cursor.fetchone()
+                if not row or not row[0]:
+                    failures.append(f"index {name} {'invalide' if row else 'absent'}")
+
+            cursor.execute("SELECT count(*) FROM analyses")
+            count = cursor.fetchone()[0]
+            if count != rows + writer.inserted:
+                failures.append(f"{count} analyses, attendu {rows + writer.inserted}")
+
+            cursor.execute("SELECT count(*) FROM analyses WHERE jsonb_typeof(result) = 'string'")
+            kept = cursor.fetchone()[0]
+            legacy = rows // 1000 - sum(1 for analysis_id in writer.updates if analysis_id % 1000 == 0)
+            if kept != legacy:
+                failures.append(f"{kept} résultats non JSON conservés en chaîne, attendu {legacy}")
+
+            if writer.updates:
+                ids, values = zip(*writer.updates.items())
+                cursor.execute(
+                    "SELECT count(*) FROM unnest(%s::int[], %s::int[]) AS expected(id, value) "
+                    "JOIN analyses a USING (id) WHERE (a.result->>'writer')::int IS DISTINCT FROM expected.value",
+                    (list(ids), list(values))
+                )
+                lost = cursor.fetchone()[0]
+                if lost:
+                    failures.append(f"{lost} modification(s) de l'écrivain perdue(s) pendant la recopie")
+
+            cursor.execute("SELECT count(*) FROM pg_proc WHERE proname LIKE 'hx\\_%'")
+            if cursor.fetchone()[0]:
+                failures.append("fonctions temporaires hx_* restantes")
+            cursor.execute("SELECT count(*) FROM pg_trigger WHERE tgname LIKE 'hx\\_sync\\_%'")
+            if cursor.fetchone()[0]:
+                failures.append("triggers de synchronisation restants")
+
+            cursor.execute("SELECT count(*) FROM schema_migrations")
+            applied = cursor.fetchone()[0]
+            if applied != len(migrations.MIGRATIONS):
+                failures.append(f"{applied} migrations enregistrées, attendu {len(migrations.MIGRATIONS)}")
+        db.rollback()
+    finally:
+        db.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--clinics", type=int, default=20)
+    parser.add_argument("--migrators", type=int, default=2, help="processus qui lancent les migrations à la fois")
+    parser.add_argument("--batch-size", type=int, default=migrations.BATCH_SIZE)
+    args = parser.parse_args()
+    migrations.BATCH_SIZE = args.batch_size
+
+    try:
+        with throwaway_database() as database_url:
+            print(f"Schéma historique et {args.rows} analyses…")
+            start = time.perf_counter()
+            seed(database_url, args.rows, args.clinics)
+            print(f"  {time.perf_counter() - start:.1f} s")
+
+            writer = Writer(database_url, args.rows)
+            writer.start()
+            try:
+                with ThreadPoolExecutor(max_workers=args.migrators) as executor:
+                    durations = list(executor.map(migrate, [database_url] * args.migrators))
+            finally:
+                writer.stop.set()
+                writer.join()
+            rerun = migrate(database_url)
+
+            latencies = sorted(writer.latencies)
+            print(f"migrations : {max(durations):.1f} s ({args.migrators} migrateurs), "
+                  f"seconde exécution : {rerun * 1000:.0f} ms")
+            print(f"écrivain : {writer.inserted} insertions, {len(writer.updates)} lignes modifiées, "
+                  f"latence p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                  f"max {latencies[-1] * 1000:.0f} ms, {len(writer.errors)} erreur(s)")
+            for error in writer.errors[:5]:
+                print(f"  {error}")
+
+            failures = check(database_url, args.rows, writer)
+    except PostgresUnavailable as e:
+        sys.exit(str(e))
+
+    for failure in failures:
+        print(f"ÉCHEC : {failure}")
+    if failures or writer.errors:
+        sys.exit(1)
+    print("OK : schéma converti, aucune écriture perdue")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Client du modèle face à une API lente ou dégradée, contre bench.fake_openai.
+
+    python -m bench.model_client --analyses 200 --concurrency 8 --latency 0.5 --error-rate 0.05 --stall-rate 0.02
+    python -m bench.model_client --outage
+
+Chaque analyse envoie quatre appels simultanés (un par vue) et dure autant
+que le plus lent. Compare :
+  per-request : un AsyncOpenAI par analyse, réglages par défaut du SDK (historique)
+  shared      : model_client.ModelClient partagé (pool keep-alive, délais, relances)
+  hedged      : ModelClient avec requête de couverture au-delà du p95 des latences
+Affiche p50/p95/p99 par analyse, les échecs, les appels et connexions TCP
+reçus par le faux serveur. `--outage` simule une panne totale de l'API pour
+mesurer le temps d'échec avec et sans disjoncteur.
+"""
+import argparse
+import asyncio
+import os
+import time
+from typing import List, Tuple
+
+from openai import AsyncOpenAI
+
+from bench.fake_openai import FakeOpenAI
+from bench.micro import percentiles
+from model_client import CircuitBreaker, ModelClient
+
+REQUEST = {"model": "fake", "messages": [{"role": "user", "content": "Analysez cette image"}],
+           "response_format": {"type": "json_object"}, "max_tokens": 200}
+
+
+async def run(scenario: str, analyses: int, concurrency: int, timeout: float,
+              breaker_threshold: int = 5) -> List[Tuple[bool, float]]:
+    shared = None
+    if scenario != "per-request":
+        shared = ModelClient(timeout=timeout, deadline=timeout * 2, backoff=0.2, hedge=scenario == "hedged",
+                             breaker=CircuitBreaker(breaker_threshold, cooldown=5))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def analysis() -> Tuple[bool, float]:
+        async with semaphore:
+            start = time.perf_counter()
+            if shared is None:
+                client = AsyncOpenAI(api_key="bench")
+                calls = [client.chat.completions.create(**REQUEST) for _ in range(4)]
+            else:
+                calls = [shared.complete(**REQUEST) for _ in range(4)]
+            outcomes = await asyncio.gather(*calls, return_exceptions=True)
+            if shared is None:
+                await client.close()
+            ok = not any(isinstance(outcome, Exception) for outcome in outcomes)
+            return ok, (time.perf_counter() - start) * 1000
+
+    try:
+        return await asyncio.gather(*(analysis() for _ in range(analyses)))
+    finally:
+        if shared is not None:
+            await shared.close()
+
+
+def report(name: str, fake: FakeOpenAI, outcomes: List[Tuple[bool, float]], before: Tuple[int, int]):
+    latencies = [latency for _, latency in outcomes]
+    stats = percentiles(latencies)
+    failed = sum(not ok for ok, _ in outcomes)
+    print(f"{name:<14} {stats['p50']:>8.0f} {stats['p95']:>8.0f} {stats['p99']:>8.0f} {failed:>7} "
+          f"{fake.requests - before[0]:>7} {fake.connections - before[1]:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--analyses", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--stall-rate", type=float, default=0.02)
+    parser.add_argument("--stall", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=5.0, help="délai par tentative du client partagé (s)")
+    parser.add_argument("--outage", action="store_true", help="API en panne totale : effet du disjoncteur")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      error_status=args.error_status, stall_rate=args.stall_rate, stall=args.stall).start()
+    os.environ["OPENAI_BASE_URL"] = fake.base_url
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    print(f"{'scénario':<14} {'p50':>8} {'p95':>8} {'p99':>8} {'échecs':>7} {'appels':>7} {'TCP':>7}")
+    try:
+        if args.outage:
+            fake.error_rate, fake.stall_rate = 1.0, 0.0
+            for name, threshold in (("sans disj.", 0), ("disjoncteur", 5)):
+                before = (fake.requests, fake.connections)
+                report(name, fake, asyncio.run(run("shared", args.analyses, args.concurrency, args.timeout,
+                                                   threshold)), before)
+            return
+        for scenario in ("per-request", "shared", "hedged"):
+            before = (fake.requests, fake.connections)
+            report(scenario, fake, asyncio.run(run(scenario, args.analyses, args.concurrency, args.timeout)), before)
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
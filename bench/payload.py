@@ -0,0 +1,67 @@
+"""Taille et coût estimé des images envoyées au modèle, par stratégie.
+
+    python -m bench.payload --repeat 20
+
+Construit les charges utiles des quatre vues d'une analyse sur des photos
+synthétiques 1024×1024 (une vue de face avec visage détecté, trois sans) et
+rapporte, par analyse : appels au modèle, octets envoyés, jetons d'entrée
+estimés et temps de construction.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from analyzer import HairLossAnalyzer
+from app import GRID_LAYOUT, GRID_PROMPT, VIEW_PROMPT, VIEWS
+from payload import PAYLOAD_MODES, build_grid_payload, build_view_payload, payload_tokens
+
+FACE_ANATOMY = {'face_bbox': (352, 420, 320, 380), 'temporal_points': [(400, 546), (624, 546)],
+                'vertex_position': (512, 546)}
+
+
+def make_views(analyzer: HairLossAnalyzer):
+    """Textures pseudo-capillaires : bruit basse fréquence plus stries fines"""
+    rng = np.random.default_rng(0)
+    views = {}
+    for label in VIEWS:
+        base = rng.integers(60, 200, (64, 64, 3), dtype=np.uint8).repeat(16, 0).repeat(16, 1)
+        strands = rng.integers(0, 60, (1024, 1024, 1), dtype=np.uint8)
+        rgb = np.clip(base.astype(np.int16) - strands, 0, 255).astype(np.uint8)
+        anatomy = FACE_ANATOMY if label == "front" else {}
+        views[label] = (analyzer.preprocess_image(rgb), anatomy)
+    return views
+
+
+def build(mode: str, views: dict):
+    if mode == "grid":
+        image = build_grid_payload([views[label] for label in GRID_LAYOUT])
+        prompt = GRID_PROMPT.format(layout="", anatomy={label: views[label][1] for label in GRID_LAYOUT}, views="")
+        return [(prompt, image)]
+    return [(VIEW_PROMPT.format(label=label, anatomy=views[label][1]), build_view_payload(*views[label], mode=mode))
+            for label in VIEWS]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    views = make_views(HairLossAnalyzer())
+    baseline = None
+    for mode in PAYLOAD_MODES:
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            calls = build(mode, views)
+        elapsed = (time.perf_counter() - start) / args.repeat * 1000
+        # Octets sur le réseau : base64 dans tous les cas
+        sent = sum(len(image.b64) for _, image in calls)
+        tokens = sum(payload_tokens(prompt, image) for prompt, image in calls)
+        baseline = baseline or (sent, tokens)
+        sizes = ", ".join(sorted({f"{image.width}x{image.height} q{image.quality}" for _, image in calls}))
+        print(f"{mode:<7} {len(calls)} appel(s)  {sent / 1024:8.1f} Ko ({sent / baseline[0]:5.1%})  "
+              f"~{tokens:7d} jetons ({tokens / baseline[1]:5.1%})  {elapsed:6.1f} ms  [{sizes}]")
+
+
+if __name__ == "__main__":
+    main()
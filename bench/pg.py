@@ -0,0 +1,100 @@
+"""Base Postgres jetable pour les bancs d'essai.
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/postgres python -m bench.pg
+
+Avec BENCH_DATABASE_URL (serveur existant, droit CREATE DATABASE), crée une
+base temporaire et la supprime à la sortie. Sinon, si initdb et pg_ctl sont
+dans le PATH (ou dans /usr/lib/postgresql/*/bin), initialise un cluster
+temporaire sur un port libre et l'arrête à la sortie.
+"""
+import glob
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import uuid
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import psycopg2
+
+
+class PostgresUnavailable(Exception):
+    """Ni BENCH_DATABASE_URL ni binaires Postgres locaux"""
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def find_binary(name: str) -> Optional[str]:
+    found = shutil.which(name)
+    if found:
+        return found
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    return candidates[-1] if candidates else None
+
+
+@contextmanager
+def temporary_database(server_url: str) -> Iterator[str]:
+    name = f"bench_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(server_url)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE {name}")
+        parts = urlsplit(server_url)
+        yield urlunsplit(parts._replace(path=f"/{name}"))
+    finally:
+        with admin.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        admin.close()
+
+
+@contextmanager
+def temporary_cluster() -> Iterator[str]:
+    initdb, pg_ctl = find_binary("initdb"), find_binary("pg_ctl")
+    if not initdb or not pg_ctl:
+        raise PostgresUnavailable(
+            "Postgres introuvable : définir BENCH_DATABASE_URL ou installer initdb/pg_ctl"
+        )
+    if os.geteuid() == 0:
+        raise PostgresUnavailable("initdb refuse de tourner en root : définir BENCH_DATABASE_URL")
+    with tempfile.TemporaryDirectory(prefix="bench-pg-") as tmp:
+        data = os.path.join(tmp, "data")
+        port = free_port()
+        subprocess.run([initdb, "-D", data, "-U", "bench", "--auth=trust", "-E", "UTF8"],
+                       check=True, stdout=subprocess.DEVNULL)
+        options = f"-p {port} -k {tmp} -c listen_addresses=127.0.0.1 -c fsync=off -c max_connections=200"
+        subprocess.run([pg_ctl, "-D", data, "-o", options, "-l", os.path.join(tmp, "log"), "-w", "start"],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f"postgresql://bench@127.0.0.1:{port}/postgres"
+        finally:
+            subprocess.run([pg_ctl, "-D", data, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+
+
+@contextmanager
+def throwaway_database() -> Iterator[str]:
+    """URL d'une base vide, détruite à la sortie du bloc"""
+    server_url = os.getenv("BENCH_DATABASE_URL")
+    if server_url:
+        with temporary_database(server_url) as url:
+            yield url
+    else:
+        with temporary_cluster() as url:
+            yield url
+
+
+def main():
+    with throwaway_database() as url:
+        print(url)
+        input("Entrée pour détruire la base… ")
+
+
+if __name__ == "__main__":
+    main()
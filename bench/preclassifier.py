@@ -0,0 +1,108 @@
+"""Évaluation hors ligne du pré-classifieur local contre les réponses du modèle.
+
+    DATABASE_URL=postgresql://... python -m bench.preclassifier
+    DATABASE_URL=postgresql://... python -m bench.preclassifier --images photos/
+
+Sans `--images`, lit les estimations locales enregistrées dans
+`analyses.metadata->'views'` à côté du stade retenu par le modèle (vues
+servies par le modèle ou son cache). Avec `--images`, recalcule les
+estimations avec le code courant sur `photos/<id analyse>/<vue>.jpg` et les
+compare au stade du modèle de la même analyse (ou, pour les analyses
+antérieures au détail par vue, à `stade_principal`).
+
+Pour chaque seuil : part des appels au modèle évités et accord (même stade
+principal) sur les vues qui auraient été court-circuitées.
+"""
+import argparse
+import os
+from typing import List, Tuple
+
+from psycopg2.extras import DictCursor
+
+from analyzer import HairLossAnalyzer
+from database import connect
+from preclassifier import PRECLASSIFIER_STAGES, density_features, estimate_stage
+from uploads import decode_upload
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95)
+
+# (stade du modèle, stade local, confiance locale)
+Sample = Tuple[str, str, float]
+
+
+def major(stage) -> str:
+    return str(stage or "")[:1]
+
+
+def samples_from_metadata(db, limit: int) -> List[Sample]:
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            """
+            SELECT v.value->>'stade' AS model_stage,
+                   v.value->'local'->>'stade' AS local_stage,
+                   (v.value->'local'->>'confiance')::float AS confidence
+            FROM (SELECT metadata FROM analyses WHERE metadata ? 'views' ORDER BY id DESC LIMIT %s) a
+            CROSS JOIN LATERAL jsonb_each(a.metadata->'views') AS v
+            WHERE v.value->>'source' IN ('model', 'cache') AND v.value ? 'local'
+            """,
+            (limit,)
+        )
+        return [(row['model_stage'], row['local_stage'], row['confidence']) for row in cursor.fetchall()]
+
+
+def samples_from_images(db, directory: str) -> List[Sample]:
+    analyzer = HairLossAnalyzer()
+    samples = []
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        for name in sorted(os.listdir(directory)):
+            if not name.isdigit():
+                continue
+            cursor.execute("SELECT result, metadata FROM analyses WHERE id = %s", (int(name),))
+            row = cursor.fetchone()
+            if row is None:
+                continue
+            views = (row['metadata'] or {}).get('views', {})
+            for filename in sorted(os.listdir(os.path.join(directory, name))):
+                label = os.path.splitext(filename)[0]
+                with open(os.path.join(directory, name, filename), "rb") as f:
+                    prepared = analyzer.preprocess_image(decode_upload(f))
+                anatomy = analyzer.analyze_anatomy(prepared, label)
+                estimate = estimate_stage(density_features(analyzer.density_map(prepared), label, anatomy))
+                model_stage = views.get(label, {}).get('stade') or row['result'].get('stade_principal')
+                samples.append((model_stage, estimate.stage, estimate.confidence))
+    return samples
+
+
+def report(samples: List[Sample]):
+    total = len(samples)
+    if not total:
+        print("Aucune vue évaluable")
+        return
+    exact = sum(major(model) == major(local) for model, local, _ in samples)
+    close = sum(abs(int(major(model) or 0) - int(major(local) or 0)) <= 1 for model, local, _ in samples)
+    print(f"{total} vues ; accord global : {exact / total:.1%} exact, {close / total:.1%} à un stade près")
+    print(f"stades court-circuitables : {', '.join(PRECLASSIFIER_STAGES)}")
+    print(f"{'seuil':>6} {'évités':>8} {'accord':>8} {'vues':>6}")
+    for threshold in THRESHOLDS:
+        skipped = [(model, local) for model, local, confidence in samples
+                   if local in PRECLASSIFIER_STAGES and confidence >= threshold]
+        agreement = sum(major(model) == major(local) for model, local in skipped) / len(skipped) if skipped else 0
+        print(f"{threshold:>6.2f} {len(skipped) / total:>8.1%} {agreement:>8.1%} {len(skipped):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", help="répertoire photos/<id analyse>/<vue>.jpg")
+    parser.add_argument("--limit", type=int, default=10000, help="analyses les plus récentes lues")
+    args = parser.parse_args()
+
+    db = connect()
+    try:
+        samples = samples_from_images(db, args.images) if args.images else samples_from_metadata(db, args.limit)
+    finally:
+        db.close()
+    report(samples)
+
+
+if __name__ == "__main__":
+    main()
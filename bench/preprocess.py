@@ -0,0 +1,101 @@
+"""Compare le prétraitement fusionné NumPy/OpenCV à l'ancienne chaîne ImageEnhance.
+
+    python -m bench.preprocess --repeat 50
+
+Vérifie d'abord l'équivalence des sorties (écart maximal d'un niveau par canal,
+densités identiques à 1 % près) puis mesure les deux chemins, mesure de densité
+comprise, sur des images synthétiques de 1024×1024.
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance
+
+from analyzer import HairLossAnalyzer
+
+MAX_PIXEL_DIFF = 1
+MAX_DENSITY_DIFF = 0.01
+REGIONS = [(0, 0, 1024, 341), (0, 341, 1024, 682), (256, 0, 768, 512)]
+
+
+def legacy_preprocess(image: Image.Image) -> Image.Image:
+    """Chaîne historique : trois passes ImageEnhance successives"""
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    for enhancer_type, factor in [
+        (ImageEnhance.Contrast, 1.2),
+        (ImageEnhance.Brightness, 1.1),
+        (ImageEnhance.Sharpness, 1.5)
+    ]:
+        image = enhancer_type(image).enhance(factor)
+    return image
+
+
+def legacy_density(image: Image.Image, region) -> float:
+    img_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    crop = img_cv[region[1]:region[3], region[0]:region[2]]
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    _, thresh = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return np.sum(thresh == 255) / thresh.size
+
+
+def synthetic_photo(seed: int, size: int = 1024) -> np.ndarray:
+    """Image lisse bruitée, plus proche d'une photo qu'un bruit uniforme"""
+    rng = np.random.default_rng(seed)
+    base = cv2.resize(rng.integers(0, 256, (24, 24, 3), dtype=np.uint8), (size, size), interpolation=cv2.INTER_CUBIC)
+    return np.clip(base + rng.normal(0, 10, base.shape), 0, 255).astype(np.uint8)
+
+
+def check_equivalence(analyzer: HairLossAnalyzer, samples):
+    for i, rgb in enumerate(samples):
+        legacy = legacy_preprocess(Image.fromarray(rgb))
+        prepared = analyzer.preprocess_image(rgb)
+        fused_rgb = cv2.cvtColor(prepared.bgr, cv2.COLOR_BGR2RGB)
+        diff = np.abs(np.asarray(legacy, dtype=np.int16) - fused_rgb.astype(np.int16))
+        print(f"image {i}: écart max={diff.max()} moyen={diff.mean():.3f}")
+        assert diff.max() <= MAX_PIXEL_DIFF, "le prétraitement fusionné diverge de la chaîne PIL"
+        for region in REGIONS:
+            delta = abs(legacy_density(legacy, region) - analyzer.measure_density(prepared, region))
+            assert delta <= MAX_DENSITY_DIFF, f"densité divergente sur {region} ({delta:.4f})"
+
+
+def timeit(fn, repeat: int) -> float:
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    analyzer = HairLossAnalyzer()
+    samples = [synthetic_photo(seed) for seed in range(4)]
+    check_equivalence(analyzer, samples)
+
+    rgb = samples[0]
+    pil_image = Image.fromarray(rgb)
+
+    def legacy():
+        image = legacy_preprocess(pil_image)
+        for region in REGIONS:
+            legacy_density(image, region)
+
+    def fused():
+        prepared = analyzer.preprocess_image(rgb)
+        for region in REGIONS:
+            analyzer.measure_density(prepared, region)
+
+    legacy_ms = timeit(legacy, args.repeat)
+    fused_ms = timeit(fused, args.repeat)
+    print(f"ImageEnhance + densités : {legacy_ms:.2f} ms")
+    print(f"LUT + convolution + densités : {fused_ms:.2f} ms (x{legacy_ms / fused_ms:.1f})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Test de charge de la réservation de quota contre une base Postgres jetable.
+
+    DATABASE_URL=postgresql://... python -m bench.quota_stress --quota 50 --requests 400 --threads 32
+
+Crée une clinique de test, lance des réservations concurrentes et vérifie que
+le nombre de réservations accordées est exactement égal au quota.
+"""
+import argparse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app import reserve_quota, refund_quota
+from database import connect
+from migrations import run_migrations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quota", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--refunds", type=int, default=10, help="réservations rendues pendant le test")
+    args = parser.parse_args()
+
+    api_key = f"stress-{uuid.uuid4()}"
+    db = connect()
+    run_migrations(db)
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO clinics (api_key, analysis_quota, default_quota) VALUES (%s, %s, %s)",
+            (api_key, args.quota, args.quota)
+        )
+    db.commit()
+
+    def attempt(i):
+        conn = connect()
+        try:
+            granted = reserve_quota(conn, api_key) is not None
+            if granted and i < args.refunds:
+                refund_quota(conn, api_key)
+                return 0
+            return int(granted)
+        finally:
+            conn.close()
+
+    try:
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            granted = sum(executor.map(attempt, range(args.requests)))
+        with db.cursor() as cursor:
+            cursor.execute("SELECT analysis_quota FROM clinics WHERE api_key = %s", (api_key,))
+            remaining = cursor.fetchone()[0]
+    finally:
+        with db.cursor() as cursor:
+            cursor.execute("DELETE FROM clinics WHERE api_key = %s", (api_key,))
+        db.commit()
+        db.close()
+
+    print(f"quota={args.quota} requêtes={args.requests} accordées={granted} restant={remaining}")
+    assert granted + remaining == args.quota, "quota survendu ou décrément perdu"
+    assert remaining >= 0, "quota négatif"
+    print("OK : aucun dépassement de quota")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+"""Coût du démarrage : import de app, délai avant la première réponse et avant /ready.
+
+    BENCH_DATABASE_URL=postgresql://postgres@localhost/postgres python -m bench.startup --workers 4
+
+Mesure d'abord, dans des interpréteurs neufs, la durée de `import app` et
+celle de l'import des modules lourds pris isolément. Lance ensuite le serveur
+de chaque façon :
+  uvicorn          : un processus, tout le démarrage dans le hook startup
+  uvicorn-workers  : uvicorn --workers N, chaque worker réimporte tout
+  gunicorn-preload : gunicorn.conf.py, import et préchargement faits une fois avant le fork
+et relève le délai avant la première réponse HTTP, le délai avant que /ready
+réponde 200, et la mémoire de l'ensemble des processus : RSS cumulée et PSS
+(pages partagées réparties entre processus), qui montre le partage en copie
+sur écriture. Sans Postgres, /ready reste à 503 et seule la première
+réponse est mesurée.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.fake_openai import FakeOpenAI
+from bench.pg import PostgresUnavailable, free_port, throwaway_database
+
+HEAVY_MODULES = ("cv2", "numpy", "PIL.Image", "openai", "psycopg2", "fastapi")
+
+
+def import_seconds(statement: str, repeat: int) -> float:
+    """Meilleur temps sur `repeat` interpréteurs neufs"""
+    best = float("inf")
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", f"import time; s = time.perf_counter(); {statement}; "
+                                   "print(time.perf_counter() - s)"],
+            capture_output=True, text=True, check=True
+        ).stdout
+        best = min(best, float(output.split()[-1]))
+    return best
+
+
+def descendants(pid: int) -> List[int]:
+    pids = [pid]
+    try:
+        children = open(f"/proc/{pid}/task/{pid}/children").read().split()
+    except FileNotFoundError:
+        return pids
+    for child in children:
+        pids.extend(descendants(int(child)))
+    return pids
+
+
+def memory_mb(pid: int) -> Tuple[float, float]:
+    """(RSS, PSS) cumulées du processus et de ses descendants, en Mo"""
+    rss = pss = 0
+    for process in descendants(pid):
+        try:
+            with open(f"/proc/{process}/smaps_rollup") as f:
+                for line in f:
+                    if line.startswith("Rss:"):
+                        rss += int(line.split()[1])
+                    elif line.startswith("Pss:"):
+                        pss += int(line.split()[1])
+        except (FileNotFoundError, ProcessLookupError):
+            continue
+    return rss / 1024, pss / 1024
+
+
+def server_command(mode: str, port: int, workers: int) -> List[str]:
+    if mode == "gunicorn-preload":
+        return [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"]
+    command = [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+               "--log-level", "warning"]
+    if mode == "uvicorn-workers":
+        command += ["--workers", str(workers)]
+    return command
+
+
+def start_once(mode: str, env: Dict[str, str], workers: int, timeout: float,
+               settle: float) -> Dict[str, Optional[float]]:
+    port = free_port()
+    env = {**os.environ, **env, "PORT": str(port)}
+    # uvicorn lit aussi WEB_CONCURRENCY : réservé à gunicorn, sinon « uvicorn » lancerait des workers
+    env.pop("WEB_CONCURRENCY", None)
+    if mode == "gunicorn-preload":
+        env["WEB_CONCURRENCY"] = str(workers)
+    start = time.perf_counter()
+    server = subprocess.Popen(server_command(mode, port, workers), env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    first_response = ready = None
+    ready_statuses = 0
+    # Un seul client : httpx.get recrée un contexte TLS à chaque appel
+    client = httpx.Client(timeout=1)
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline and ready is None:
+            try:
+                response = client.get(f"http://127.0.0.1:{port}/ready")
+            except httpx.TransportError:
+                time.sleep(0.02)
+                continue
+            if first_response is None:
+                first_response = time.perf_counter() - start
+            if response.status_code == 200:
+                # Avec plusieurs workers, chaque connexion peut tomber sur un autre :
+                # prêt quand `workers` réponses 200 consécutives sont reçues
+                ready_statuses += 1
+                if ready_statuses >= workers:
+                    ready = time.perf_counter() - start
+            else:
+                ready_statuses = 0
+                if response.json().get("status") == "failed":
+                    break
+                time.sleep(0.02)
+        # Mémoire relevée une fois tous les workers démarrés
+        time.sleep(settle)
+        rss, pss = memory_mb(server.pid)
+    finally:
+        client.close()
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    return {"first": first_response, "ready": ready, "rss": rss, "pss": pss}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--modes", nargs="+", default=["uvicorn", "uvicorn-workers", "gunicorn-preload"],
+                        choices=["uvicorn", "uvicorn-workers", "gunicorn-preload"])
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--settle", type=float, default=3, help="attente avant le relevé mémoire (s)")
+    args = parser.parse_args()
+
+    print("Import dans un interpréteur neuf (meilleur de", args.repeat, "essais)")
+    print(f"  {'app':<12} {import_seconds('import app', args.repeat) * 1000:>8.0f} ms")
+    print(f"  {'app+openai':<12} {import_seconds('import app, openai', args.repeat) * 1000:>8.0f} ms"
+          "  (SDK chargé à l'import, comme avant)")
+    for module in HEAVY_MODULES:
+        print(f"  {module:<12} {import_seconds(f'import {module}', args.repeat) * 1000:>8.0f} ms")
+
+    fake = FakeOpenAI().start()
+    try:
+        try:
+            database = throwaway_database()
+            database_url = database.__enter__()
+        except PostgresUnavailable as e:
+            print(f"\n{e} : /ready ne peut pas passer à 200, seule la première réponse est mesurée")
+            database, database_url = None, "postgresql://bench@127.0.0.1:1/bench"
+        env = {"OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": fake.base_url, "DATABASE_URL": database_url,
+               "SMTP_SERVER": "", "PGCONNECT_TIMEOUT": "1"}
+        try:
+            print(f"\n{'mode':<18} {'1re réponse':>12} {'/ready 200':>11} {'RSS Mo':>8} {'PSS Mo':>8}")
+            for mode in args.modes:
+                runs = [start_once(mode, env, args.workers, args.timeout, args.settle) for _ in range(args.repeat)]
+                firsts = sorted(run["first"] for run in runs if run["first"] is not None)
+                readies = sorted(run["ready"] for run in runs if run["ready"] is not None)
+                first = f"{firsts[len(firsts) // 2] * 1000:.0f} ms" if firsts else "-"
+                ready = f"{readies[len(readies) // 2] * 1000:.0f} ms" if readies else "-"
+                print(f"{mode:<18} {first:>12} {ready:>11} {runs[-1]['rss']:>8.0f} {runs[-1]['pss']:>8.0f}")
+        finally:
+            if database is not None:
+                database.__exit__(None, None, None)
+    finally:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
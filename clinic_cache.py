@@ -0,0 +1,109 @@
+import os
+import time
+import select
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional, Tuple
+
+NOTIFY_CHANNEL = "clinic_config"
+
+
+class ClinicConfigCache:
+    """Cache LRU par processus des configurations de clinique, indexé par api_key.
+
+    Les entrées expirent après `ttl` secondes ; les clés inconnues sont mémorisées
+    (valeur None) pendant `negative_ttl` secondes pour ne pas interroger la base
+    à chaque requête invalide. Les modifications faites dans l'admin sont
+    propagées aux autres workers par LISTEN/NOTIFY (voir ConfigListener).
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0, negative_ttl: float = 30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, api_key: str) -> Tuple[bool, Optional[dict]]:
+        """Retourne (trouvé, config) ; config vaut None pour une clé connue comme invalide"""
+        with self._lock:
+            entry = self._entries.get(api_key)
+            if entry is None:
+                return False, None
+            expires_at, config = entry
+            if expires_at < time.monotonic():
+                del self._entries[api_key]
+                return False, None
+            self._entries.move_to_end(api_key)
+            return True, config
+
+    def store(self, api_key: str, config: Optional[dict]):
+        ttl = self.ttl if config is not None else self.negative_ttl
+        with self._lock:
+            self._entries[api_key] = (time.monotonic() + ttl, config)
+            self._entries.move_to_end(api_key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, api_key: Optional[str] = None):
+        with self._lock:
+            if api_key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(api_key, None)
+
+
+def notify_clinic_changed(db, api_key: str):
+    """Signale une modification aux autres workers ; émis au commit de la transaction"""
+    with db.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, api_key))
+
+
+class ConfigListener(threading.Thread):
+    """Thread qui écoute NOTIFY clinic_config et invalide le cache local.
+
+    Si la connexion d'écoute tombe, des notifications ont pu être perdues :
+    le cache est alors vidé entièrement avant de se reconnecter.
+    """
+
+    def __init__(self, connect: Callable, cache: ClinicConfigCache, retry_delay: float = 5.0):
+        super().__init__(name="clinic-config-listener", daemon=True)
+        self._connect = connect
+        self._cache = cache
+        self._retry_delay = retry_delay
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                while not self._stop_event.is_set():
+                    if select.select([conn], [], [], 1.0)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            self._cache.invalidate(notify.payload or None)
+            except Exception as e:
+                print(f"DEBUG: clinic config listener error: {e}")
+                self._cache.invalidate()
+                self._stop_event.wait(self._retry_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def stop(self):
+        self._stop_event.set()
+
+
+clinic_cache = ClinicConfigCache(
+    maxsize=int(os.getenv("CLINIC_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("CLINIC_CACHE_TTL", 300)),
+    negative_ttl=float(os.getenv("CLINIC_CACHE_NEGATIVE_TTL", 30))
+)
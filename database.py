@@ -0,0 +1,214 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import psycopg2
+
+
+class PoolTimeout(Exception):
+    """Aucune connexion libérée dans le délai imparti"""
+
+
+def connect():
+    """Ouvre une connexion Postgres (DATABASE_URL, sinon variables PG*)"""
+    database_url = os.getenv("DATABASE_URL")
+    try:
+        return psycopg2.connect(database_url or "")
+    except psycopg2.Error:
+        return psycopg2.connect(
+            host=os.getenv("PGHOST"),
+            port=os.getenv("PGPORT", 5432),
+            database=os.getenv("PGDATABASE"),
+            user=os.getenv("PGUSER"),
+            password=os.getenv("PGPASSWORD")
+        )
+
+
+class ConnectionPool:
+    """Pool de connexions thread-safe partagé par l'API publique et l'admin.
+
+    `connect` est une fabrique de connexions psycopg2, qui peuvent passer d'un
+    thread à l'autre (`run`). Les connexions restées inactives plus de
+    `max_idle` secondes sont vérifiées par un `SELECT 1` avant d'être rendues.
+    `run` exécute une fonction `fn(conn, ...)` dans un pool de threads dédié
+    pour que les endpoints async ne bloquent jamais la boucle d'événements.
+
+    Le constructeur n'ouvre aucune connexion : le pool est créé au premier
+    get_pool(), souvent depuis la boucle d'événements. Les connexions s'ouvrent
+    dans getconn, donc dans les threads de `run`, et `prefill` ouvre à l'avance
+    les `minconn` premières (warm_up l'appelle hors de la boucle).
+    """
+
+    def __init__(self, connect: Callable[[], Any], minconn: int = 1, maxconn: int = 10,
+                 max_idle: float = 30.0, acquire_timeout: float = 10.0):
+        if minconn > maxconn:
+            raise ValueError("minconn doit être inférieur ou égal à maxconn")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.acquire_timeout = acquire_timeout
+        self._idle: List[Tuple[Any, float]] = []
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=maxconn, thread_name_prefix="db")
+
+    def prefill(self):
+        """Ouvre des connexions jusqu'à en compter `minconn` ; bloquant, à appeler hors
+        de la boucle d'événements"""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                self._release_slot()
+                raise
+            with self._cond:
+                if not self._closed:
+                    self._idle.append((conn, time.monotonic()))
+                    self._cond.notify()
+                    continue
+            # Pool fermé pendant l'ouverture
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+
+    def getconn(self):
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolTimeout("Pool fermé")
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        break
+                    if self._size < self.maxconn:
+                        self._size += 1
+                        conn, last_used = None, None
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"Aucune connexion disponible après {self.acquire_timeout}s")
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self._release_slot()
+                    raise
+            if self._is_healthy(conn, last_used):
+                return conn
+            self._close_quietly(conn)
+            self._release_slot()
+
+    def putconn(self, conn, discard: bool = False):
+        if not discard and not getattr(conn, "closed", False):
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard or self._closed or getattr(conn, "closed", False):
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        conn = self.getconn()
+        discard = False
+        try:
+            yield conn
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+            raise
+        finally:
+            self.putconn(conn, discard=discard)
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Exécute `fn(conn, *args, **kwargs)` hors de la boucle d'événements"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(self._call, fn, args, kwargs))
+
+    def _call(self, fn, args, kwargs):
+        with self.connection() as conn:
+            return fn(conn, *args, **kwargs)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn, _ in idle:
+            self._close_quietly(conn)
+        self._executor.shutdown(wait=False)
+
+    def _is_healthy(self, conn, last_used: float) -> bool:
+        if getattr(conn, "closed", False):
+            return False
+        if time.monotonic() - last_used < self.max_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            cursor.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+def get_pool() -> ConnectionPool:
+    """Pool du processus, créé à la première utilisation"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(
+                    connect,
+                    minconn=int(os.getenv("DB_POOL_MIN", 1)),
+                    maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+                    max_idle=float(os.getenv("DB_POOL_MAX_IDLE", 30)),
+                    acquire_timeout=float(os.getenv("DB_POOL_TIMEOUT", 10))
+                )
+    return _pool
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -0,0 +1,103 @@
+import os
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Les visages sont cherchés sur une copie réduite (côté le plus long) en niveaux de gris égalisés
+DETECTION_SIZE = int(os.getenv("DETECTION_SIZE", 320))
+FACE_DETECTOR = os.getenv("FACE_DETECTOR", "haar")
+FACE_MODEL_PATH = os.getenv("FACE_MODEL_PATH", "models/face_detection_yunet_2023mar.onnx")
+FACE_SCORE_THRESHOLD = float(os.getenv("FACE_SCORE_THRESHOLD", 0.8))
+
+# Repères cherchés selon la vue : "face" (détecteur de visage), "hairline"
+# (heuristique de ligne frontale, sans détecteur) ou "skip" (aucun repère)
+VIEW_POLICY = {
+    "front": "face",
+    "side": "hairline",
+    "top": "hairline",
+    "back": "skip",
+}
+
+
+class HaarDetector:
+    """Cascade de Haar frontale livrée avec OpenCV"""
+    name = "haar"
+
+    def __init__(self):
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def detect(self, gray: np.ndarray) -> np.ndarray:
+        # Sur une vue de face, le visage occupe bien plus d'un sixième du cadre
+        side = max(24, min(gray.shape[:2]) // 6)
+        faces = self.cascade.detectMultiScale(gray, 1.1, 4, minSize=(side, side))
+        return np.asarray(faces, dtype=np.int32).reshape(-1, 4)
+
+
+class YuNetDetector:
+    """Réseau YuNet (cv2.FaceDetectorYN) exécuté sur CPU, modèle ONNX de l'opencv_zoo"""
+    name = "yunet"
+
+    def __init__(self, model_path: str = FACE_MODEL_PATH, score_threshold: float = FACE_SCORE_THRESHOLD):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Modèle de détection introuvable : {model_path}")
+        self.model = cv2.FaceDetectorYN.create(model_path, "", (DETECTION_SIZE, DETECTION_SIZE), score_threshold)
+
+    def detect(self, gray: np.ndarray) -> np.ndarray:
+        height, width = gray.shape[:2]
+        self.model.setInputSize((width, height))
+        _, faces = self.model.detect(cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR))
+        if faces is None:
+            return np.zeros((0, 4), dtype=np.int32)
+        return faces[:, :4].astype(np.int32)
+
+
+DETECTORS = {
+    "haar": HaarDetector,
+    "yunet": YuNetDetector,
+}
+
+
+def create_detector(name: str = FACE_DETECTOR):
+    """Détecteur demandé, ou la cascade de Haar s'il ne peut pas être chargé"""
+    try:
+        return DETECTORS[name]()
+    except (KeyError, FileNotFoundError, cv2.error) as e:
+        print(f"DEBUG: face detector {name!r} unavailable ({e}), falling back to haar")
+        return HaarDetector()
+
+
+def detection_image(gray: np.ndarray, size: int = DETECTION_SIZE) -> Tuple[np.ndarray, float]:
+    """Copie réduite et égalisée de la vue, avec le facteur pour revenir aux coordonnées d'origine"""
+    scale = min(1.0, size / max(gray.shape[:2]))
+    small = gray
+    if scale < 1.0:
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.equalizeHist(small), 1 / scale
+
+
+def largest_face(faces: np.ndarray, factor: float) -> Optional[Tuple[int, int, int, int]]:
+    if len(faces) == 0:
+        return None
+    x, y, w, h = faces[np.argmax(faces[:, 2] * faces[:, 3])]
+    return int(x * factor), int(y * factor), int(w * factor), int(h * factor)
+
+
+def hairline_landmarks(small: np.ndarray, factor: float) -> Dict[str, object]:
+    """Ligne frontale estimée sans visage : première ligne, en partant du haut, où
+    la moitié des pixels de la bande centrale sont sombres (cheveux)"""
+    _, mask = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    height, width = mask.shape
+    band = mask[:, width // 4: 3 * width // 4]
+    coverage = band.mean(axis=1)
+    rows = np.flatnonzero(coverage >= 0.5)
+    if len(rows) == 0:
+        return {}
+    hairline = int(rows[0])
+    # Vertex : centre de la zone la moins couverte sous la ligne frontale
+    below = mask[hairline:, width // 4: 3 * width // 4]
+    vertex = (width // 4 + int(np.argmin(below.mean(axis=0))), hairline + int(np.argmin(below.mean(axis=1))))
+    return {
+        'hairline_y': int(hairline * factor),
+        'vertex_position': (int(vertex[0] * factor), int(vertex[1] * factor))
+    }
@@ -0,0 +1,256 @@
+"""Export des analyses en flux, en NDJSON ou en CSV, à mémoire constante.
+
+    DATABASE_URL=postgresql://... python -m export [--clinic KEY] [--from 2024-01-01] [--to 2024-01-31] \\
+        [--format ndjson|csv] [--output analyses.ndjson]
+
+Le CSV est produit par Postgres (COPY ... TO STDOUT) ; le NDJSON est lu par
+lots via un curseur nommé, chaque ligne étant déjà sérialisée par Postgres.
+Dans les deux cas, le processus ne garde en mémoire qu'un lot à la fois,
+quelle que soit la taille de la table. Les analyses sortent par
+(timestamp, id) croissants, dans l'ordre des index des migrations.
+"""
+import argparse
+import hashlib
+import os
+import queue
+import secrets
+import sys
+import threading
+from datetime import date, timedelta
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from admission import ADMISSION_RETRY_AFTER, Overloaded
+from database import connect, get_pool
+from metrics import metrics
+
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+# Lignes lues par aller-retour du curseur nommé (NDJSON)
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", 2000))
+# Réponses HTTP : morceaux d'environ EXPORT_CHUNK_BYTES, au plus EXPORT_BUFFER_CHUNKS
+# en attente du client ; au-delà, la lecture en base attend le client
+EXPORT_CHUNK_BYTES = int(os.getenv("EXPORT_CHUNK_BYTES", 256 * 1024))
+EXPORT_BUFFER_CHUNKS = int(os.getenv("EXPORT_BUFFER_CHUNKS", 8))
+# Chaque export occupe une connexion du pool pendant toute sa durée
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", 2))
+
+CSV_COLUMNS = ("id", "clinic_api_key", "client_email", "timestamp", "stade_principal", "densite_moyenne",
+               "result", "metadata")
+
+# timestamp passe par to_json pour être au même format ISO 8601 dans les deux formats
+NDJSON_SQL = """
+    SELECT json_build_object('id', id, 'clinic_api_key', clinic_api_key, 'client_email', client_email,
+                             'timestamp', timestamp, 'result', result, 'metadata', metadata)::text
+    FROM analyses {where}
+    ORDER BY timestamp, id
+"""
+CSV_SQL = """
+    COPY (
+        SELECT id, clinic_api_key, client_email, to_json(timestamp) #>> '{{}}' AS timestamp,
+               result->>'stade_principal' AS stade_principal, result->>'densite_moyenne' AS densite_moyenne,
+               result::text AS result, metadata::text AS metadata
+        FROM analyses {where}
+        ORDER BY timestamp, id
+    ) TO STDOUT WITH (FORMAT csv, HEADER)
+"""
+
+
+# Jeton d'export propre à chaque clinique, distinct de l'api_key publiée dans le
+# widget ; seule son empreinte SHA-256 est conservée dans clinics.export_token_hash
+EXPORT_TOKEN_BYTES = 32
+
+
+def hash_export_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def set_export_token(db, api_key: str) -> str:
+    """Crée (ou remplace) le jeton d'export de la clinique ; retourne le jeton en clair,
+    qui n'est plus récupérable ensuite"""
+    token = secrets.token_urlsafe(EXPORT_TOKEN_BYTES)
+    with db.cursor() as cursor:
+        cursor.execute("UPDATE clinics SET export_token_hash = %s WHERE api_key = %s",
+                       (hash_export_token(token), api_key))
+    db.commit()
+    return token
+
+
+def clinic_for_export_token(db, token: str) -> Optional[str]:
+    """api_key de la clinique à laquelle appartient le jeton, ou None"""
+    with db.cursor() as cursor:
+        cursor.execute("SELECT api_key FROM clinics WHERE export_token_hash = %s", (hash_export_token(token),))
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def analysis_filters(clinic: Optional[str], date_from: Optional[date],
+                     date_to: Optional[date]) -> Tuple[List[str], list]:
+    """Conditions SQL (et leurs paramètres) d'une sélection d'analyses par clinique et
+    par période ; `date_to` est inclus"""
+    conditions, params = [], []
+    if clinic:
+        conditions.append("clinic_api_key = %s")
+        params.append(clinic)
+    if date_from:
+        conditions.append("timestamp >= %s")
+        params.append(date_from.isoformat())
+    if date_to:
+        conditions.append("timestamp < %s")
+        params.append((date_to + timedelta(days=1)).isoformat())
+    return conditions, params
+
+
+def export_analyses(db, out: BinaryIO, fmt: str, clinic: Optional[str] = None,
+                    date_from: Optional[date] = None, date_to: Optional[date] = None) -> int:
+    """Écrit les analyses sélectionnées dans `out` (flux binaire) ; retourne le nombre de lignes"""
+    conditions, params = analysis_filters(clinic, date_from, date_to)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    try:
+        if fmt == "csv":
+            with db.cursor() as cursor:
+                # COPY n'accepte pas de paramètres : la requête est composée côté client
+                cursor.copy_expert(cursor.mogrify(CSV_SQL.format(where=where), params), out)
+                return cursor.rowcount
+        rows = 0
+        # Curseur nommé : les lignes restent côté serveur et arrivent par lots
+        with db.cursor(name="export_analyses") as cursor:
+            cursor.itersize = EXPORT_FETCH_ROWS
+            cursor.execute(NDJSON_SQL.format(where=where), params)
+            while True:
+                batch = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                if not batch:
+                    return rows
+                out.write("".join(line + "\n" for (line,) in batch).encode())
+                rows += len(batch)
+    finally:
+        # Lecture seule : rien à valider, et le curseur nommé vit dans la transaction
+        db.rollback()
+
+
+class ExportCancelled(Exception):
+    """Le client de l'export s'est déconnecté"""
+
+
+_END = object()
+
+
+class ChunkStream:
+    """Tampon borné entre le thread qui lit la base et la réponse HTTP.
+
+    Le thread écrit (write) ; la réponse itère sur des morceaux d'environ
+    `chunk_size` octets. Quand `max_chunks` morceaux attendent le client,
+    write bloque : la lecture en base suit le débit du client. Une fois
+    `cancel` appelé, write lève ExportCancelled, ce qui interrompt la requête,
+    et l'itération s'arrête. La réponse doit appeler `cancel` quand elle se
+    termine, même si elle n'a jamais commencé à itérer.
+    """
+
+    def __init__(self, chunk_size: int = EXPORT_CHUNK_BYTES, max_chunks: int = EXPORT_BUFFER_CHUNKS):
+        self.chunk_size = chunk_size
+        self._queue: queue.Queue = queue.Queue(max_chunks)
+        self._buffer = bytearray()
+        self._cancelled = threading.Event()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self.chunk_size:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+        return len(data)
+
+    def finish(self, error: Optional[Exception] = None):
+        if error is None and self._buffer:
+            self._put(bytes(self._buffer))
+        self._buffer.clear()
+        self._put(error if error is not None else _END)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _put(self, item):
+        while True:
+            if self._cancelled.is_set():
+                raise ExportCancelled()
+            try:
+                self._queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self) -> Iterator[bytes]:
+        try:
+            while True:
+                try:
+                    item = self._queue.get(timeout=0.5)
+                except queue.Empty:
+                    if self._cancelled.is_set():
+                        return
+                    continue
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.cancel()
+
+
+_export_slots = threading.BoundedSemaphore(EXPORT_MAX_CONCURRENT)
+
+
+def stream_analyses(fmt: str, clinic: Optional[str] = None, date_from: Optional[date] = None,
+                    date_to: Optional[date] = None) -> ChunkStream:
+    """Export en morceaux pour une StreamingResponse. La lecture se fait dans un thread
+    dédié qui garde une connexion du pool jusqu'à la fin de l'export ou l'appel de
+    `cancel` sur le flux retourné, que l'appelant doit garantir (ExportResponse).
+    Lève Overloaded si EXPORT_MAX_CONCURRENT exports sont déjà en cours."""
+    if not _export_slots.acquire(blocking=False):
+        raise Overloaded("Trop d'exports en cours, réessayez plus tard", ADMISSION_RETRY_AFTER)
+    stream = ChunkStream()
+
+    def produce():
+        try:
+            with metrics.timed("export"), get_pool().connection() as db:
+                rows = export_analyses(db, stream, fmt, clinic, date_from, date_to)
+            print(f"DEBUG: export {fmt} of {rows} analyses done")
+            stream.finish()
+        except ExportCancelled:
+            print("DEBUG: export cancelled by client")
+        except Exception as e:
+            print(f"DEBUG: export error: {e}")
+            try:
+                stream.finish(e)
+            except ExportCancelled:
+                pass
+        finally:
+            _export_slots.release()
+
+    threading.Thread(target=produce, name="export", daemon=True).start()
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clinic", help="limite l'export à une clinique")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="premier jour (AAAA-MM-JJ)")
+    parser.add_argument("--to", dest="date_to", type=date.fromisoformat, help="dernier jour inclus (AAAA-MM-JJ)")
+    parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    parser.add_argument("--output", help="fichier de sortie (sortie standard par défaut)")
+    args = parser.parse_args()
+
+    db = connect()
+    try:
+        if args.output:
+            with open(args.output, "wb") as out:
+                rows = export_analyses(db, out, args.format, args.clinic, args.date_from, args.date_to)
+        else:
+            rows = export_analyses(db, sys.stdout.buffer, args.format, args.clinic, args.date_from, args.date_to)
+            sys.stdout.buffer.flush()
+    finally:
+        db.close()
+    print(f"{rows} analyse(s) exportée(s)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+"""Configuration gunicorn : application préchargée dans le processus parent, workers uvicorn.
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Le parent importe app (OpenCV, NumPy, FastAPI, SDK openai), applique les
+migrations et charge les cascades une seule fois (app.preload), puis forke
+WEB_CONCURRENCY workers qui partagent ces pages en copie sur écriture.
+Chaque worker n'a plus qu'à amorcer ses analyseurs et ouvrir sa première
+connexion avant que /ready ne réponde 200.
+"""
+import gc
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 8000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", 2))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", 30))
+accesslog = None
+
+
+def on_starting(server):
+    # preload_app : le module app est déjà importé à ce stade
+    import app
+    app.preload()
+    # Objets du parent exclus du ramasse-miettes : ses passages dans les workers
+    # ne réécrivent pas les pages partagées
+    gc.freeze()
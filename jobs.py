@@ -0,0 +1,150 @@
+import json
+import uuid
+from typing import Dict, Optional
+
+from psycopg2 import Binary
+from psycopg2.extras import DictCursor
+
+# File d'attente des analyses asynchrones, stockée dans Postgres et consommée
+# par les workers de chaque processus via SELECT ... FOR UPDATE SKIP LOCKED
+JOBS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS analysis_jobs (
+        id TEXT PRIMARY KEY,
+        clinic_api_key TEXT NOT NULL,
+        client_email TEXT,
+        age INTEGER,
+        family_history BOOLEAN,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        front BYTEA,
+        top BYTEA,
+        side BYTEA,
+        back BYTEA,
+        result TEXT,
+        error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        started_at TIMESTAMPTZ,
+        finished_at TIMESTAMPTZ
+    )
+'''
+JOBS_INDEX_SQL = '''
+    CREATE INDEX IF NOT EXISTS analysis_jobs_queued_idx
+    ON analysis_jobs (created_at) WHERE status IN ('queued', 'running')
+'''
+
+
+def create_job(db, api_key: str, client_email: str, age: int, family_history: bool, views: Dict[str, bytes]) -> str:
+    job_id = str(uuid.uuid4())
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO analysis_jobs (id, clinic_api_key, client_email, age, family_history, front, top, side, back) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            (job_id, api_key, client_email, age, family_history,
+             Binary(views['front']), Binary(views['top']), Binary(views['side']), Binary(views['back']))
+        )
+    db.commit()
+    return job_id
+
+
+class JobAlreadyDone(Exception):
+    """Le job n'est plus 'running' pour ce worker : repris par un autre (job jugé abandonné)
+    et déjà terminé, remis en file ou abandonné entre-temps"""
+
+
+# Jobs 'running' abandonnés qui ont épuisé leurs tentatives : marqués 'failed' et
+# leur analyse rendue au quota de la clinique, dans la même transaction
+ABANDON_STALE_JOBS_SQL = '''
+    WITH abandoned AS (
+        UPDATE analysis_jobs SET status = 'failed', finished_at = now(),
+               error = 'Abandonné après ' || attempts || ' tentative(s) interrompue(s)',
+               front = NULL, top = NULL, side = NULL, back = NULL
+        WHERE status = 'running' AND started_at < now() - make_interval(secs => %(stale_after)s)
+          AND attempts >= %(max_attempts)s
+        RETURNING clinic_api_key
+    )
+    UPDATE clinics SET analysis_quota = analysis_quota + refunds.jobs
+    FROM (SELECT clinic_api_key, count(*) AS jobs FROM abandoned GROUP BY clinic_api_key) AS refunds
+    WHERE clinics.api_key = refunds.clinic_api_key
+'''
+
+
+def claim_job(db, stale_after: float, max_attempts: int) -> Optional[dict]:
+    """Prend le plus ancien job en attente, ou un job 'running' abandonné par un worker arrêté
+    s'il lui reste des tentatives ; les autres jobs abandonnés passent en 'failed'"""
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(ABANDON_STALE_JOBS_SQL, {"stale_after": stale_after, "max_attempts": max_attempts})
+        cursor.execute(
+            '''
+            UPDATE analysis_jobs SET status = 'running', started_at = now(), attempts = attempts + 1
+            WHERE id = (
+                SELECT id FROM analysis_jobs
+                WHERE status = 'queued'
+                   OR (status = 'running' AND started_at < now() - make_interval(secs => %s) AND attempts < %s)
+                ORDER BY created_at
+                FOR UPDATE SKIP LOCKED
+                LIMIT 1
+            )
+            RETURNING id, clinic_api_key, client_email, age, family_history, attempts, front, top, side, back
+            ''',
+            (stale_after, max_attempts)
+        )
+        row = cursor.fetchone()
+    db.commit()
+    if not row:
+        return None
+    job = dict(row)
+    for view in ('front', 'top', 'side', 'back'):
+        job[view] = bytes(job[view])
+    return job
+
+
+def complete_job(db, job_id: str, result: dict):
+    """Enregistre le résultat et libère les images stockées, dans la transaction de
+    l'appelant (celle qui enregistre l'analyse). Lève JobAlreadyDone si le job n'est
+    plus en cours : l'appelant doit alors annuler sa transaction."""
+    with db.cursor() as cursor:
+        cursor.execute(
+            "UPDATE analysis_jobs SET status = 'done', result = %s, error = NULL, finished_at = now(), "
+            "front = NULL, top = NULL, side = NULL, back = NULL WHERE id = %s AND status = 'running'",
+            (json.dumps(result), job_id)
+        )
+        if cursor.rowcount == 0:
+            raise JobAlreadyDone(job_id)
+
+
+def fail_job(db, job_id: str, error: str, retry: bool):
+    with db.cursor() as cursor:
+        if retry:
+            cursor.execute("UPDATE analysis_jobs SET status = 'queued', error = %s WHERE id = %s", (error, job_id))
+        else:
+            cursor.execute(
+                "UPDATE analysis_jobs SET status = 'failed', error = %s, finished_at = now(), "
+                "front = NULL, top = NULL, side = NULL, back = NULL WHERE id = %s",
+                (error, job_id)
+            )
+    db.commit()
+
+
+def get_job(db, job_id: str) -> Optional[dict]:
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            "SELECT id, status, attempts, result, error, created_at, started_at, finished_at "
+            "FROM analysis_jobs WHERE id = %s",
+            (job_id,)
+        )
+        row = cursor.fetchone()
+    if not row:
+        return None
+    job = {
+        "id": row['id'],
+        "status": row['status'],
+        "attempts": row['attempts'],
+        "created_at": row['created_at'].isoformat(),
+        "started_at": row['started_at'].isoformat() if row['started_at'] else None,
+        "finished_at": row['finished_at'].isoformat() if row['finished_at'] else None
+    }
+    if row['status'] == 'done':
+        job['result'] = json.loads(row['result'])
+    elif row['status'] == 'failed':
+        job['error'] = row['error']
+    return job
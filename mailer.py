@@ -0,0 +1,322 @@
+import os
+import time
+import random
+import smtplib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.text import MIMEText
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, EmailStr, Field
+
+from database import get_pool
+from metrics import metrics
+
+DEAD_LETTERS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS email_dead_letters (
+        id SERIAL PRIMARY KEY,
+        recipient TEXT NOT NULL,
+        subject TEXT,
+        body TEXT,
+        smtp_server TEXT,
+        smtp_user TEXT,
+        attempts INTEGER NOT NULL,
+        error TEXT,
+        created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+'''
+
+
+class SMTPConfig(BaseModel):
+    server: str = Field(..., env="SMTP_SERVER")
+    port: int = Field(..., env="SMTP_PORT")
+    user: EmailStr = Field(..., env="SMTP_USER")
+    password: str = Field(..., env="SMTP_PASSWORD")
+    starttls: bool = True
+
+    @classmethod
+    def from_env(cls) -> Optional["SMTPConfig"]:
+        """Serveur par défaut des cliniques sans configuration SMTP propre"""
+        if not os.getenv("SMTP_SERVER"):
+            return None
+        return cls(
+            server=os.getenv("SMTP_SERVER"),
+            port=int(os.getenv("SMTP_PORT", 587)),
+            user=os.getenv("SMTP_USER"),
+            password=os.getenv("SMTP_PASSWORD", ""),
+            starttls=os.getenv("SMTP_STARTTLS", "1") != "0"
+        )
+
+    def key(self) -> Tuple:
+        return (self.server, self.port, self.user, self.password, self.starttls)
+
+
+class OutgoingEmail:
+    __slots__ = ("config", "to", "subject", "body", "attempts", "not_before")
+
+    def __init__(self, config: Optional[SMTPConfig], to: str, subject: str, body: str):
+        self.config = config
+        self.to = to
+        self.subject = subject
+        self.body = body
+        self.attempts = 0
+        self.not_before = 0.0
+
+    def as_string(self) -> str:
+        msg = MIMEText(self.body, "plain", "utf-8")
+        msg["Subject"] = self.subject
+        msg["From"] = self.config.user
+        msg["To"] = self.to
+        return msg.as_string()
+
+
+def is_permanent(error: Exception) -> bool:
+    """Refus définitif du serveur (5xx) : inutile de réessayer"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return error.smtp_code >= 500
+    return False
+
+
+class Mailer:
+    """Service d'envoi des emails, découplé des requêtes.
+
+    `send` ne fait que mettre le message en file (bornée à `max_queued`) et
+    rend la main immédiatement. `workers` threads envoient les messages par
+    lots de `batch_size` sur une connexion SMTP gardée ouverte par
+    configuration (STARTTLS et login une seule fois, puis réutilisée jusqu'à
+    `idle_timeout` secondes d'inactivité). Un échec temporaire est réessayé
+    avec un délai exponentiel ; un refus définitif, l'épuisement des
+    `max_attempts` tentatives ou une file pleine passent par `dead_letter`.
+    """
+
+    def __init__(self, workers: int = 2, max_queued: int = 1000, batch_size: int = 20,
+                 max_attempts: int = 5, backoff: float = 2.0, idle_timeout: float = 60.0,
+                 timeout: float = 30.0, dead_letter: Optional[Callable[[OutgoingEmail, str], None]] = None):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.dead_letter = dead_letter
+        self._pending: Dict[Tuple, Deque[OutgoingEmail]] = {}
+        self._queued = 0
+        self._busy: set = set()
+        self._connections: Dict[Tuple, Tuple[smtplib.SMTP, float]] = {}
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        # Dead letters de send() (file pleine) écrites hors de l'appelant, souvent la boucle d'événements
+        self._dead_letters = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mailer-dead-letters")
+        self._stopping = False
+        self.sent = 0
+        self.connections_opened = 0
+
+    def start(self):
+        self._stopping = False
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"mailer-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 10.0):
+        """Laisse `timeout` secondes pour vider la file, puis ferme les connexions"""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._queued and time.monotonic() < deadline:
+                self._condition.wait(0.1)
+            self._stopping = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()) + 1)
+        self._threads.clear()
+        with self._condition:
+            leftovers = [message for queue in self._pending.values() for message in queue]
+            self._pending.clear()
+            self._queued = 0
+        for message in leftovers:
+            self._give_up(message, "service arrêté avant l'envoi")
+        # Attend les écritures en cours ; le nouvel exécuteur ne crée son thread qu'au premier usage
+        self._dead_letters.shutdown(wait=True)
+        self._dead_letters = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mailer-dead-letters")
+        for key in list(self._connections):
+            self._close(key)
+
+    def send(self, config: SMTPConfig, to: str, subject: str, body: str) -> bool:
+        message = OutgoingEmail(config, to, subject, body)
+        with self._condition:
+            if self._queued < self.max_queued and not self._stopping:
+                self._pending.setdefault(config.key(), deque()).append(message)
+                self._queued += 1
+                self._condition.notify()
+                return True
+        self._dead_letters.submit(self._give_up, message, "file d'envoi pleine")
+        return False
+
+    def abandon(self, to: str, subject: str, body: str, error: str):
+        """Message qui ne peut pas être envoyé (configuration SMTP invalide) : dead letter directe"""
+        self._dead_letters.submit(self._give_up, OutgoingEmail(None, to, subject, body), error)
+
+    def _next_batch(self) -> Optional[Tuple[Tuple, List[OutgoingEmail]]]:
+        """Lot prêt à partir, pour une configuration qu'aucun autre thread n'est en train de servir"""
+        while True:
+            with self._condition:
+                if self._stopping:
+                    return None
+                now = time.monotonic()
+                best, wake_at = None, now + self.idle_timeout
+                for key, queue in self._pending.items():
+                    if key in self._busy or not queue:
+                        continue
+                    ready_at = min(message.not_before for message in queue)
+                    if ready_at <= now and best is None:
+                        best = key
+                    wake_at = min(wake_at, ready_at)
+                if best is not None:
+                    queue = self._pending[best]
+                    batch = [m for m in queue if m.not_before <= now][:self.batch_size]
+                    for message in batch:
+                        queue.remove(message)
+                    if not queue:
+                        del self._pending[best]
+                    self._busy.add(best)
+                    return best, batch
+                idle = self._take_idle(now)
+                if not idle:
+                    self._condition.wait(max(0.05, wake_at - now))
+                    continue
+            # Hors du verrou : QUIT est un aller-retour réseau (jusqu'à `timeout` secondes)
+            for server in idle:
+                self._quit(server)
+
+    def _run(self):
+        while True:
+            picked = self._next_batch()
+            if picked is None:
+                return
+            key, batch = picked
+            try:
+                self._deliver(key, batch)
+            finally:
+                with self._condition:
+                    self._busy.discard(key)
+                    self._queued -= len(batch)
+                    self._condition.notify_all()
+
+    def _deliver(self, key: Tuple, batch: List[OutgoingEmail]):
+        for index, message in enumerate(batch):
+            message.attempts += 1
+            try:
+                self._send_one(key, message)
+                self.sent += 1
+            except Exception as e:
+                if is_permanent(e) or message.attempts >= self.max_attempts:
+                    self._give_up(message, str(e))
+                else:
+                    print(f"DEBUG: email to {message.to} failed (attempt {message.attempts}): {e}")
+                    self._retry(message)
+                if getattr(e, "smtp_code", None) == 421 or \
+                        not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)):
+                    # Connexion ou serveur en cause (421 : fermeture annoncée) : le reste du lot attend aussi
+                    self._close(key)
+                    for rest in batch[index + 1:]:
+                        self._retry(rest)
+                    return
+
+    def _send_one(self, key: Tuple, message: OutgoingEmail):
+        with metrics.timed("email_send"):
+            server = self._connection(key, message.config)
+            try:
+                server.sendmail(message.config.user, [message.to], message.as_string())
+            except smtplib.SMTPServerDisconnected:
+                # Connexion fermée par le serveur depuis le dernier envoi : une seule reconnexion
+                self._close(key)
+                server = self._connection(key, message.config)
+                server.sendmail(message.config.user, [message.to], message.as_string())
+        self._connections[key] = (server, time.monotonic())
+
+    def _connection(self, key: Tuple, config: SMTPConfig) -> smtplib.SMTP:
+        if key in self._connections:
+            return self._connections[key][0]
+        server = smtplib.SMTP(config.server, config.port, timeout=self.timeout)
+        try:
+            if config.starttls:
+                server.starttls()
+            if config.password:
+                server.login(config.user, config.password)
+        except Exception:
+            server.close()
+            raise
+        self.connections_opened += 1
+        self._connections[key] = (server, time.monotonic())
+        return server
+
+    def _close(self, key: Tuple):
+        entry = self._connections.pop(key, None)
+        if entry is not None:
+            self._quit(entry[0])
+
+    @staticmethod
+    def _quit(server: smtplib.SMTP):
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+    def _take_idle(self, now: float) -> List[smtplib.SMTP]:
+        """Appelé sous le verrou : retire les connexions inutilisées des configurations au
+        repos, que l'appelant ferme ensuite hors du verrou"""
+        idle = []
+        for key, (server, last_used) in list(self._connections.items()):
+            if key not in self._busy and now - last_used > self.idle_timeout:
+                del self._connections[key]
+                idle.append(server)
+        return idle
+
+    def _retry(self, message: OutgoingEmail):
+        delay = self.backoff * 2 ** (message.attempts - 1) * random.uniform(0.8, 1.2)
+        message.not_before = time.monotonic() + delay
+        with self._condition:
+            self._pending.setdefault(message.config.key(), deque()).append(message)
+            self._queued += 1
+            self._condition.notify()
+
+    def _give_up(self, message: OutgoingEmail, error: str):
+        print(f"DEBUG: email to {message.to} abandoned after {message.attempts} attempt(s): {error}")
+        if self.dead_letter is None:
+            return
+        try:
+            self.dead_letter(message, error)
+        except Exception as e:
+            print(f"DEBUG: dead letter write failed: {e}")
+
+
+def store_dead_letter(db, message: OutgoingEmail, error: str):
+    with db.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO email_dead_letters (recipient, subject, body, smtp_server, smtp_user, attempts, error) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            (message.to, message.subject, message.body,
+             f"{message.config.server}:{message.config.port}" if message.config else None,
+             message.config.user if message.config else None, message.attempts, error)
+        )
+    db.commit()
+
+
+def record_dead_letter(message: OutgoingEmail, error: str):
+    with get_pool().connection() as db:
+        store_dead_letter(db, message, error)
+
+
+mailer = Mailer(
+    workers=int(os.getenv("MAIL_WORKERS", 2)),
+    max_queued=int(os.getenv("MAIL_QUEUE_SIZE", 1000)),
+    batch_size=int(os.getenv("MAIL_BATCH_SIZE", 20)),
+    max_attempts=int(os.getenv("MAIL_MAX_ATTEMPTS", 5)),
+    backoff=float(os.getenv("MAIL_BACKOFF", 2)),
+    idle_timeout=float(os.getenv("MAIL_IDLE_TIMEOUT", 60)),
+    dead_letter=record_dead_letter
+)
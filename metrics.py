@@ -0,0 +1,143 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Bornes des histogrammes de durée, en secondes : de la milliseconde (hash,
+# requêtes SQL) à la trentaine de secondes (appel au modèle saturé)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Durées (étape, secondes) mesurées pendant la requête HTTP en cours, pour l'en-tête Server-Timing
+request_timings: ContextVar[Optional[List[Tuple[str, float]]]] = ContextVar("request_timings", default=None)
+
+
+class Histogram:
+    """Histogramme cumulatif au format Prometheus, une série par valeur d'étiquette"""
+
+    def __init__(self, name: str, help: str, label: str, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        # valeur d'étiquette -> [compte par borne (+ dépassement), somme, nombre]
+        self._series: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: str, seconds: float):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {value: (list(counts), total, count) for value, (counts, total, count) in self._series.items()}
+        for value, (counts, total, count) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{self.label}="{value}",le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{self.label}="{value}"}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{self.label}="{value}"}} {count}')
+        return lines
+
+
+class Counter:
+    """Compteur au format Prometheus, une série par combinaison d'étiquettes"""
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...]):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *values: str):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for key, count in sorted(values.items()):
+            labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, key))
+            lines.append(f"{self.name}{{{labels}}} {count}")
+        return lines
+
+
+class Metrics:
+    """Métriques du processus exposées sur /metrics.
+
+    Chaque étape chronométrée par `timed` alimente `stage_seconds` et, en cas
+    d'exception, `stage_errors` (étape, type d'exception). Le coût par mesure
+    est de quelques microsecondes : deux lectures d'horloge et un verrou.
+    """
+
+    def __init__(self):
+        self.stage_seconds = Histogram("hairloss_stage_duration_seconds", "Durée des étapes du pipeline", "stage")
+        self.stage_errors = Counter("hairloss_stage_errors_total", "Échecs par étape et type d'erreur",
+                                    ("stage", "error"))
+        self.request_seconds = Histogram("hairloss_http_request_duration_seconds", "Durée des requêtes HTTP",
+                                         "route")
+        self.responses = Counter("hairloss_http_responses_total", "Réponses HTTP par route et statut",
+                                 ("route", "status"))
+        self.model_events = Counter("hairloss_model_events_total",
+                                    "Relances, requêtes de couverture et ouvertures du disjoncteur", ("event",))
+        self.rejections = Counter("hairloss_admission_rejections_total",
+                                  "Analyses refusées à l'admission (débit de la clinique, saturation)", ("reason",))
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.stage_errors.inc(stage, type(e).__name__)
+            # L'étape la plus interne est retenue pour le classement de l'erreur côté HTTP
+            if not hasattr(e, "metrics_stage"):
+                e.metrics_stage = stage
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stage_seconds.observe(stage, elapsed)
+            timings = request_timings.get()
+            if timings is not None:
+                timings.append((stage, elapsed))
+
+    def call(self, stage: str, fn: Callable[..., Any], *args) -> Any:
+        """`fn(*args)` chronométré sous `stage`, pour les fonctions passées à un pool de threads"""
+        with self.timed(stage):
+            return fn(*args)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.stage_seconds, self.stage_errors, self.request_seconds, self.responses,
+                       self.model_events, self.rejections):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def server_timing(timings: List[Tuple[str, float]]) -> str:
+    """En-tête Server-Timing : durée cumulée par étape (les vues sont traitées en
+    parallèle, la somme peut dépasser la durée de la requête)"""
+    totals: Dict[str, List[float]] = {}
+    for stage, seconds in timings:
+        entry = totals.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    return ", ".join(
+        f'{stage};dur={total * 1000:.1f}' + (f';desc="x{count}"' if count > 1 else "")
+        for stage, (total, count) in totals.items()
+    )
+
+
+metrics = Metrics()
@@ -0,0 +1,340 @@
+import os
+import time
+from typing import Callable, List, Tuple
+
+from database import connect
+from jobs import JOBS_INDEX_SQL, JOBS_TABLE_SQL
+from mailer import DEAD_LETTERS_TABLE_SQL
+from rollups import COUNTS_TABLE_SQL, DAILY_TABLE_SQL, rebuild
+
+# Verrou consultatif : un seul worker applique les migrations, les autres attendent
+MIGRATION_LOCK_ID = 48_151_623
+MIGRATION_LOCK_POLL = float(os.getenv("MIGRATION_LOCK_POLL", 1))
+BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", 5000))
+SWAP_ATTEMPTS = 5
+
+
+def migration_001_initial_schema(db):
+    """Schéma historique (colonnes TEXT), tel que créé par l'ancien init_db"""
+    with db.cursor() as cursor:
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS clinics (
+                api_key TEXT PRIMARY KEY,
+                email_clinique TEXT,
+                pricing TEXT,
+                analysis_quota INTEGER DEFAULT 0,
+                default_quota INTEGER DEFAULT 0,
+                subscription_start TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analyses (
+                id SERIAL PRIMARY KEY,
+                clinic_api_key TEXT,
+                client_email TEXT,
+                result TEXT,
+                timestamp TEXT,
+                metadata TEXT
+            )
+        ''')
+        # Pas d'index de pagination ici : sur une base existante, un CREATE INDEX simple
+        # bloquerait les écritures sur analyses pendant toute sa construction, sur une
+        # colonne TEXT aussitôt remplacée. La migration 002 les crée en CONCURRENTLY
+        # sur la colonne TIMESTAMPTZ (CONVERSION_INDEXES).
+        cursor.execute(JOBS_TABLE_SQL)
+        cursor.execute(JOBS_INDEX_SQL)
+
+
+# (table, clé primaire, colonne, nouveau type, fonction de conversion)
+CONVERSIONS = [
+    ("clinics", "api_key", "pricing", "JSONB", "hx_text_to_jsonb"),
+    ("clinics", "api_key", "subscription_start", "TIMESTAMPTZ", "hx_text_to_timestamptz"),
+    ("analyses", "id", "result", "JSONB", "hx_text_to_jsonb"),
+    ("analyses", "id", "metadata", "JSONB", "hx_text_to_jsonb"),
+    ("analyses", "id", "timestamp", "TIMESTAMPTZ", "hx_text_to_timestamptz"),
+]
+
+# Index à reconstruire sur la nouvelle colonne avant la bascule : (table, colonne) -> [(nom, colonnes)]
+CONVERSION_INDEXES = {
+    ("analyses", "timestamp"): [
+        ("analyses_timestamp_id_idx", "{column}, id"),
+        ("analyses_clinic_timestamp_id_idx", "clinic_api_key, {column}, id"),
+    ],
+}
+
+CONVERSION_FUNCTIONS_SQL = r'''
+    CREATE OR REPLACE FUNCTION hx_text_to_jsonb(value TEXT) RETURNS JSONB AS $$
+    BEGIN
+        IF value IS NULL OR value = '' THEN
+            RETURN NULL;
+        END IF;
+        RETURN value::jsonb;
+    EXCEPTION WHEN others THEN
+        -- Valeur historique non JSON : conservée comme chaîne JSON
+        RETURN to_jsonb(value);
+    END
+    $$ LANGUAGE plpgsql IMMUTABLE;
+
+    CREATE OR REPLACE FUNCTION hx_text_to_timestamptz(value TEXT) RETURNS TIMESTAMPTZ AS $$
+    BEGIN
+        IF value IS NULL OR value = '' THEN
+            RETURN NULL;
+        END IF;
+        IF value ~ '(Z|[+-]\d{2}(:?\d{2})?)$' THEN
+            RETURN value::timestamptz;
+        END IF;
+        -- datetime.now().isoformat() sans fuseau : heure UTC des serveurs
+        RETURN value::timestamp AT TIME ZONE 'UTC';
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql IMMUTABLE;
+'''
+
+
+def column_type(db, table: str, column: str) -> str:
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            (table, column)
+        )
+        row = cursor.fetchone()
+    return row[0] if row else ""
+
+
+def create_index_concurrently(db, name: str, table: str, definition: str):
+    """CREATE INDEX CONCURRENTLY idempotent : un index invalide laissé par un échec est reconstruit"""
+    previous = db.autocommit
+    db.autocommit = True
+    try:
+        with db.cursor() as cursor:
+            cursor.execute(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+                (name,)
+            )
+            row = cursor.fetchone()
+            if row and row[0]:
+                return
+            if row:
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            cursor.execute(f"CREATE INDEX CONCURRENTLY {name} ON {table} ({definition})")
+    finally:
+        db.autocommit = previous
+
+
+def sync_trigger_sql(table: str, column: str, converter: str) -> str:
+    """Trigger qui tient `<colonne>_new` à jour pendant la recopie : toute ligne insérée ou
+    dont la colonne change est convertie au passage, y compris les lignes déjà recopiées"""
+    return f'''
+        CREATE OR REPLACE FUNCTION hx_sync_{table}_{column}() RETURNS trigger AS $$
+        BEGIN
+            NEW.{column}_new := {converter}(NEW.{column});
+            RETURN NEW;
+        END
+        $$ LANGUAGE plpgsql;
+        DROP TRIGGER IF EXISTS hx_sync_{column} ON {table};
+        CREATE TRIGGER hx_sync_{column} BEFORE INSERT OR UPDATE OF {column} ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE hx_sync_{table}_{column}();
+    '''
+
+
+def backfill(db, table: str, key: str, column: str, converter: str):
+    """Recopie par lots de BATCH_SIZE lignes, chaque lot dans sa propre transaction courte"""
+    last_key = None
+    while True:
+        with db.cursor() as cursor:
+            cursor.execute(
+                f'''
+                WITH batch AS (
+                    SELECT {key} FROM {table}
+                    WHERE %(last)s::text IS NULL OR {key} > %(last)s
+                    ORDER BY {key} LIMIT %(limit)s
+                ), updated AS (
+                    UPDATE {table} t SET {column}_new = {converter}(t.{column})
+                    FROM batch WHERE t.{key} = batch.{key}
+                    RETURNING t.{key}
+                )
+                SELECT count(*), max({key}) FROM updated
+                ''',
+                {"last": last_key, "limit": BATCH_SIZE}
+            )
+            count, last_key = cursor.fetchone()
+        db.commit()
+        if count < BATCH_SIZE:
+            return
+        time.sleep(0.01)
+
+
+def swap_columns(db, pending: List[Tuple[str, str, str, str, str]]):
+    """Bascule finale sous verrou court : retrait des triggers de synchronisation (les
+    colonnes `_new` sont déjà à jour), remplacement des colonnes TEXT et renommage
+    des index reconstruits"""
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        try:
+            with db.cursor() as cursor:
+                cursor.execute("SET LOCAL lock_timeout = '5s'")
+                for table in sorted({conversion[0] for conversion in pending}):
+                    cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+                for table, key, column, new_type, converter in pending:
+                    cursor.execute(f"DROP TRIGGER IF EXISTS hx_sync_{column} ON {table}")
+                    cursor.execute(f"DROP FUNCTION IF EXISTS hx_sync_{table}_{column}()")
+                    cursor.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+                    cursor.execute(f"ALTER TABLE {table} RENAME COLUMN {column}_new TO {column}")
+                    for index_name, _ in CONVERSION_INDEXES.get((table, column), []):
+                        cursor.execute(f"ALTER INDEX {index_name}_new RENAME TO {index_name}")
+            db.commit()
+            return
+        except Exception as e:
+            db.rollback()
+            if attempt == SWAP_ATTEMPTS:
+                raise
+            print(f"DEBUG: migration swap attempt {attempt} failed: {e}")
+            time.sleep(attempt)
+
+
+def migration_002_jsonb_timestamptz(db):
+    """pricing, result, metadata en JSONB ; timestamp, subscription_start en TIMESTAMPTZ.
+
+    Chaque colonne est recopiée dans une colonne `<nom>_new` par petits lots
+    (aucun verrou long), un trigger y reportant les écritures faites entre-temps ;
+    les index sont reconstruits en CONCURRENTLY, puis une transaction courte
+    remplace les anciennes colonnes.
+    """
+    pending = [c for c in CONVERSIONS if column_type(db, c[0], c[2]) == "text"]
+    if pending:
+        with db.cursor() as cursor:
+            cursor.execute(CONVERSION_FUNCTIONS_SQL)
+            for table, key, column, new_type, converter in pending:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_new {new_type}")
+                # Avant la recopie : aucune écriture concurrente ne peut plus être perdue
+                cursor.execute(sync_trigger_sql(table, column, converter))
+        db.commit()
+
+        for table, key, column, new_type, converter in pending:
+            backfill(db, table, key, column, converter)
+            for index_name, columns in CONVERSION_INDEXES.get((table, column), []):
+                create_index_concurrently(db, f"{index_name}_new", table, columns.format(column=f"{column}_new"))
+
+        swap_columns(db, pending)
+
+    with db.cursor() as cursor:
+        cursor.execute("ALTER TABLE analyses ALTER COLUMN timestamp SET DEFAULT now()")
+        cursor.execute("DROP FUNCTION IF EXISTS hx_text_to_jsonb(TEXT)")
+        cursor.execute("DROP FUNCTION IF EXISTS hx_text_to_timestamptz(TEXT)")
+
+
+def migration_003_stage_indexes(db):
+    """Index d'expression pour filtrer et agréger par stade directement en SQL"""
+    create_index_concurrently(db, "analyses_stage_idx", "analyses", "(result->>'stade_principal')")
+    create_index_concurrently(
+        db, "analyses_clinic_stage_idx", "analyses", "clinic_api_key, (result->>'stade_principal')"
+    )
+
+
+def migration_004_clinic_rollups(db):
+    """Agrégats quotidiens par clinique, initialisés depuis l'historique"""
+    with db.cursor() as cursor:
+        cursor.execute(DAILY_TABLE_SQL)
+        cursor.execute(COUNTS_TABLE_SQL)
+    rebuild(db)
+
+
+def migration_005_smtp_delivery(db):
+    """Serveur SMTP propre à chaque clinique et emails abandonnés par le service d'envoi"""
+    with db.cursor() as cursor:
+        cursor.execute("ALTER TABLE clinics ADD COLUMN IF NOT EXISTS smtp JSONB")
+        cursor.execute(DEAD_LETTERS_TABLE_SQL)
+
+
+def migration_006_clinic_rate_limits(db):
+    """Débit d'analyses propre à chaque clinique (NULL : valeurs par défaut de admission.py)"""
+    with db.cursor() as cursor:
+        cursor.execute("ALTER TABLE clinics ADD COLUMN IF NOT EXISTS rate_limit_per_minute REAL")
+        cursor.execute("ALTER TABLE clinics ADD COLUMN IF NOT EXISTS rate_limit_burst INTEGER")
+
+
+def migration_007_export_tokens(db):
+    """Empreinte du jeton d'export de chaque clinique (NULL : export désactivé)"""
+    with db.cursor() as cursor:
+        cursor.execute("ALTER TABLE clinics ADD COLUMN IF NOT EXISTS export_token_hash TEXT")
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS clinics_export_token_hash_idx ON clinics (export_token_hash)"
+        )
+
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "initial_schema", migration_001_initial_schema),
+    (2, "jsonb_timestamptz", migration_002_jsonb_timestamptz),
+    (3, "stage_indexes", migration_003_stage_indexes),
+    (4, "clinic_rollups", migration_004_clinic_rollups),
+    (5, "smtp_delivery", migration_005_smtp_delivery),
+    (6, "clinic_rate_limits", migration_006_clinic_rate_limits),
+    (7, "export_tokens", migration_007_export_tokens),
+]
+
+
+def acquire_migration_lock(db):
+    """Verrou de session pris par essais successifs en autocommit.
+
+    Attendre dans pg_advisory_lock garderait une transaction (donc un snapshot)
+    ouverte ; or CREATE INDEX CONCURRENTLY, lancé par le détenteur du verrou,
+    attend la fin des snapshots plus anciens : les deux s'attendraient l'un l'autre.
+    """
+    previous = db.autocommit
+    db.autocommit = True
+    try:
+        while True:
+            with db.cursor() as cursor:
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+                if cursor.fetchone()[0]:
+                    return
+            time.sleep(MIGRATION_LOCK_POLL)
+    finally:
+        db.autocommit = previous
+
+
+def run_migrations(db):
+    """Applique dans l'ordre les migrations absentes de schema_migrations"""
+    acquire_migration_lock(db)
+    try:
+        with db.cursor() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            ''')
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+        db.commit()
+
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            print(f"DEBUG: applying migration {version:03d}_{name}")
+            migrate(db)
+            with db.cursor() as cursor:
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        with db.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        db.commit()
+
+
+def main():
+    """python -m migrations : migrations lancées une fois par déploiement (pré-déploiement Railway)"""
+    db = connect()
+    try:
+        run_migrations(db)
+    finally:
+        db.close()
+    print("Schéma à jour")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+import os
+import time
+import random
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING, Deque, Optional
+
+import httpx
+
+from metrics import metrics
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+# Client du modèle partagé par tout le processus : connexions HTTP gardées
+# ouvertes d'une requête à l'autre, délais par appel, relances bornées sur
+# 429/5xx, requête de couverture optionnelle pour l'appel le plus lent et
+# disjoncteur qui échoue immédiatement tant que l'API est dégradée.
+MODEL_MAX_CONNECTIONS = int(os.getenv("MODEL_MAX_CONNECTIONS", 32))
+MODEL_KEEPALIVE = float(os.getenv("MODEL_KEEPALIVE", 30))
+MODEL_CONNECT_TIMEOUT = float(os.getenv("MODEL_CONNECT_TIMEOUT", 5))
+# Délai d'une tentative, et échéance de l'appel relances comprises
+MODEL_TIMEOUT = float(os.getenv("MODEL_TIMEOUT", 60))
+MODEL_DEADLINE = float(os.getenv("MODEL_DEADLINE", 120))
+MODEL_MAX_RETRIES = int(os.getenv("MODEL_MAX_RETRIES", 2))
+MODEL_RETRY_BACKOFF = float(os.getenv("MODEL_RETRY_BACKOFF", 1))
+MODEL_RETRY_MAX_DELAY = float(os.getenv("MODEL_RETRY_MAX_DELAY", 20))
+# Couverture : une seconde requête identique part si la première dépasse le
+# quantile MODEL_HEDGE_QUANTILE des latences récentes (MODEL_HEDGE_AFTER
+# secondes tant que l'historique est trop court). 0 désactive.
+MODEL_HEDGE = os.getenv("MODEL_HEDGE", "0") != "0"
+MODEL_HEDGE_QUANTILE = float(os.getenv("MODEL_HEDGE_QUANTILE", 0.95))
+MODEL_HEDGE_AFTER = float(os.getenv("MODEL_HEDGE_AFTER", 15))
+# Disjoncteur : ouvert après N échecs consécutifs (5xx, délai, connexion), pendant COOLDOWN secondes
+MODEL_BREAKER_THRESHOLD = int(os.getenv("MODEL_BREAKER_THRESHOLD", 5))
+MODEL_BREAKER_COOLDOWN = float(os.getenv("MODEL_BREAKER_COOLDOWN", 30))
+
+HEDGE_MIN_SAMPLES = 20
+
+
+# Le SDK openai (environ 0,5 s d'import) n'est chargé qu'à la création du client,
+# ou par load_sdk() pendant le démarrage : les erreurs à classer viennent forcément
+# d'un client déjà créé.
+def load_sdk():
+    import openai  # noqa: F401
+
+
+class CircuitOpen(Exception):
+    """Appel refusé sans contacter l'API : le disjoncteur est ouvert"""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"API du modèle indisponible, nouvel essai dans {retry_after:.0f} s")
+        self.retry_after = retry_after
+
+
+def is_retryable(error: Exception) -> bool:
+    """429, 5xx, délai dépassé et erreurs de connexion ; pas les 4xx du client"""
+    from openai import APIConnectionError, APIStatusError, RateLimitError
+    if isinstance(error, APIStatusError):
+        return isinstance(error, RateLimitError) or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def is_upstream_failure(error: Exception) -> bool:
+    """Échecs qui comptent pour le disjoncteur : une limitation de débit (429)
+    signale un débit trop élevé, pas une API dégradée"""
+    from openai import RateLimitError
+    return is_retryable(error) and not isinstance(error, RateLimitError)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """Disjoncteur à trois états, utilisé depuis la boucle d'événements uniquement.
+
+    Fermé : les appels passent. Après `threshold` échecs consécutifs, ouvert :
+    les appels échouent aussitôt (CircuitOpen) pendant `cooldown` secondes.
+    Ensuite, demi-ouvert : un seul appel d'essai passe ; son succès referme
+    le disjoncteur, son échec le rouvre pour un nouveau `cooldown`.
+    """
+
+    def __init__(self, threshold: int = MODEL_BREAKER_THRESHOLD, cooldown: float = MODEL_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        if self.threshold <= 0 or self.opened_at is None:
+            return
+        remaining = self.cooldown - (time.monotonic() - self.opened_at)
+        if remaining > 0 or self.probing:
+            raise CircuitOpen(max(remaining, 1.0))
+        self.probing = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self, probe: bool = False):
+        """`probe` : l'échec est celui de l'appel d'essai ; un appel ordinaire encore en
+        cours ne doit pas libérer la place de l'essai"""
+        self.failures += 1
+        if probe or (self.threshold > 0 and self.failures >= self.threshold):
+            if self.opened_at is None or probe:
+                print(f"DEBUG: model circuit breaker opened after {self.failures} failures")
+                metrics.model_events.inc("breaker_open")
+            self.opened_at = time.monotonic()
+        if probe:
+            self.probing = False
+
+
+class ModelClient:
+    """Client OpenAI unique du processus, créé au premier appel dans la boucle d'événements"""
+
+    def __init__(self, max_connections: int = MODEL_MAX_CONNECTIONS, timeout: float = MODEL_TIMEOUT,
+                 deadline: float = MODEL_DEADLINE, max_retries: int = MODEL_MAX_RETRIES,
+                 backoff: float = MODEL_RETRY_BACKOFF, hedge: bool = MODEL_HEDGE,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.breaker = breaker or CircuitBreaker()
+        self.latencies: Deque[float] = deque(maxlen=200)
+        self._client: Optional["AsyncOpenAI"] = None
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        if self._client is None:
+            from openai import AsyncOpenAI
+            timeout = httpx.Timeout(self.timeout, connect=MODEL_CONNECT_TIMEOUT)
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections,
+                                    keepalive_expiry=MODEL_KEEPALIVE),
+                timeout=timeout
+            )
+            # Les relances sont gérées ici (disjoncteur, échéance), pas par le SDK
+            self._client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=http_client,
+                                       timeout=timeout, max_retries=0)
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return MODEL_HEDGE_AFTER
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * MODEL_HEDGE_QUANTILE))]
+
+    async def complete(self, **request):
+        """chat.completions.create avec relances, couverture et disjoncteur"""
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            self.breaker.allow()
+            # allow() ne met probing à vrai que pour l'appel d'essai
+            probe = self.breaker.probing
+            try:
+                response = await (self._hedged(request) if self.hedge else self._attempt(request))
+            except Exception as e:
+                if not is_retryable(e):
+                    from openai import APIStatusError
+                    if isinstance(e, APIStatusError):
+                        # Requête refusée (4xx) : l'API répond, le disjoncteur n'est pas en cause
+                        self.breaker.record_success()
+                    elif probe:
+                        self.breaker.probing = False
+                    raise
+                if is_upstream_failure(e):
+                    self.breaker.record_failure(probe)
+                elif probe:
+                    # 429 : ni succès ni panne ; l'essai est à refaire
+                    self.breaker.probing = False
+                delay = min(MODEL_RETRY_MAX_DELAY,
+                            retry_after(e) or self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+                if attempt >= self.max_retries or time.monotonic() - start + delay > self.deadline:
+                    raise
+                attempt += 1
+                metrics.model_events.inc("retry")
+                print(f"DEBUG: model call failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # Annulation (CancelledError…) de l'appel d'essai : sans cela, probing
+                # resterait vrai et le disjoncteur refuserait tout appel jusqu'au redémarrage
+                if probe:
+                    self.breaker.probing = False
+                raise
+            self.breaker.record_success()
+            return response
+
+    async def _attempt(self, request: dict):
+        start = time.monotonic()
+        response = await self.client.chat.completions.create(**request)
+        self.latencies.append(time.monotonic() - start)
+        return response
+
+    async def _hedged(self, request: dict):
+        """Première réponse entre la requête et sa copie, lancée si la première tarde.
+        Si l'une échoue, l'autre est encore attendue."""
+        first = asyncio.ensure_future(self._attempt(request))
+        pending = {first}
+        error = None
+        # Annulation de l'appelant à tout moment, attente initiale comprise : les
+        # tentatives en cours sont annulées avec lui
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_delay())
+            if done:
+                return first.result()
+
+            metrics.model_events.inc("hedge")
+            pending.add(asyncio.ensure_future(self._attempt(request)))
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+model_client = ModelClient()
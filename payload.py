@@ -0,0 +1,162 @@
+import os
+import math
+import base64
+from typing import List, NamedTuple, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from analyzer import PreparedImage
+
+# Stratégie d'envoi des vues au modèle :
+#   inline : JPEG base64 collé dans le texte du prompt (historique)
+#   parts  : une partie image_url par vue, résolution et qualité adaptées
+#   crop   : comme parts, recadrée sur le cuir chevelu d'après analyze_anatomy
+#   grid   : les quatre vues recadrées en une seule mosaïque 2×2, un seul appel
+PAYLOAD_MODES = ("inline", "parts", "crop", "grid")
+PAYLOAD_MODE = os.getenv("PAYLOAD_MODE", "parts")
+if PAYLOAD_MODE not in PAYLOAD_MODES:
+    raise ValueError(f"PAYLOAD_MODE inconnu : {PAYLOAD_MODE} (attendu : {', '.join(PAYLOAD_MODES)})")
+
+PAYLOAD_DETAIL = os.getenv("PAYLOAD_DETAIL", "high")
+PAYLOAD_MAX_SIDE = int(os.getenv("PAYLOAD_MAX_SIDE", 768))
+# Tuiles de 512 px facturées par image en détail "high" (85 + 170 jetons par tuile)
+PAYLOAD_MAX_TILES = int(os.getenv("PAYLOAD_MAX_TILES", 4))
+PAYLOAD_QUALITY = int(os.getenv("PAYLOAD_QUALITY", 85))
+PAYLOAD_MIN_QUALITY = int(os.getenv("PAYLOAD_MIN_QUALITY", 50))
+PAYLOAD_MAX_BYTES = int(os.getenv("PAYLOAD_MAX_BYTES", 150_000))
+
+# Les réponses en cache dépendent de ce que le modèle a vu
+PAYLOAD_SIGNATURE = f"{PAYLOAD_MODE}:{PAYLOAD_DETAIL}:{PAYLOAD_MAX_SIDE}:{PAYLOAD_MAX_TILES}"
+
+# Ordre des vues dans la mosaïque : haut gauche, haut droite, bas gauche, bas droite
+GRID_LAYOUT = ("front", "top", "side", "back")
+
+
+class ImagePayload(NamedTuple):
+    """Image encodée prête à l'envoi, avec son coût estimé"""
+    b64: str
+    width: int
+    height: int
+    quality: int
+    bytes: int
+    tokens: int
+
+
+def image_tokens(width: int, height: int, detail: str = PAYLOAD_DETAIL) -> int:
+    """Jetons facturés pour une image (règle publiée pour les modèles vision GPT-4)"""
+    if detail == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+
+def text_tokens(text: str) -> int:
+    """Estimation grossière : environ quatre caractères par jeton"""
+    return (len(text) + 3) // 4
+
+
+def fit_size(width: int, height: int, max_side: int = PAYLOAD_MAX_SIDE,
+             max_tiles: int = PAYLOAD_MAX_TILES) -> Tuple[int, int]:
+    """Plus grande taille sous `max_side` qui tient dans le budget de tuiles"""
+    scale = min(1.0, max_side / max(width, height))
+    while True:
+        w, h = max(1, int(width * scale)), max(1, int(height * scale))
+        if PAYLOAD_DETAIL == "low" or image_tokens(w, h) <= 85 + 170 * max_tiles or max(w, h) <= 512:
+            return w, h
+        scale *= 0.9
+
+
+def scalp_region(shape: Tuple[int, ...], anatomy: dict) -> Tuple[int, int, int, int]:
+    """Rectangle (x0, y0, x1, y1) du cuir chevelu : au-dessus du tiers haut du visage,
+    élargi aux tempes. Sans visage détecté (vues dessus et arrière), l'image entière."""
+    height, width = shape[:2]
+    if not anatomy.get('face_bbox'):
+        return 0, 0, width, height
+    x, y, w, h = (int(v) for v in anatomy['face_bbox'])
+    x0, x1 = max(0, x - w // 2), min(width, x + w + w // 2)
+    y1 = min(height, max(y + h // 3, height // 4))
+    return x0, 0, x1, y1
+
+
+def encode_jpeg(bgr: np.ndarray, max_bytes: int = PAYLOAD_MAX_BYTES) -> Tuple[bytes, int]:
+    """JPEG à la meilleure qualité qui tient dans `max_bytes`, sans descendre sous PAYLOAD_MIN_QUALITY"""
+    quality = PAYLOAD_QUALITY
+    while True:
+        _, encoded = cv2.imencode('.jpg', bgr, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if encoded.size <= max_bytes or quality <= PAYLOAD_MIN_QUALITY:
+            return encoded.tobytes(), quality
+        quality = max(PAYLOAD_MIN_QUALITY, quality - 10)
+
+
+def _payload(bgr: np.ndarray) -> ImagePayload:
+    data, quality = encode_jpeg(bgr)
+    height, width = bgr.shape[:2]
+    return ImagePayload(
+        b64=base64.b64encode(data).decode(),
+        width=width,
+        height=height,
+        quality=quality,
+        bytes=len(data),
+        tokens=image_tokens(width, height)
+    )
+
+
+def _resize(bgr: np.ndarray, size: Tuple[int, int]) -> np.ndarray:
+    if (bgr.shape[1], bgr.shape[0]) == size:
+        return bgr
+    return cv2.resize(bgr, size, interpolation=cv2.INTER_AREA)
+
+
+def build_view_payload(prepared: PreparedImage, anatomy: dict, mode: str = PAYLOAD_MODE) -> ImagePayload:
+    if mode == "inline":
+        # Chemin historique : pleine résolution, qualité 90, coût compté comme du texte
+        _, encoded = cv2.imencode('.jpg', prepared.bgr, [cv2.IMWRITE_JPEG_QUALITY, 90])
+        b64 = base64.b64encode(encoded.tobytes()).decode()
+        height, width = prepared.bgr.shape[:2]
+        return ImagePayload(b64, width, height, 90, encoded.size, text_tokens(b64))
+
+    bgr = prepared.bgr
+    if mode == "crop":
+        x0, y0, x1, y1 = scalp_region(bgr.shape, anatomy)
+        bgr = bgr[y0:y1, x0:x1]
+    return _payload(_resize(bgr, fit_size(bgr.shape[1], bgr.shape[0])))
+
+
+def _letterbox(bgr: np.ndarray, side: int) -> np.ndarray:
+    """Redimensionne en conservant les proportions dans un carré `side`×`side` bordé de noir"""
+    height, width = bgr.shape[:2]
+    scale = side / max(width, height)
+    w, h = max(1, int(width * scale)), max(1, int(height * scale))
+    cell = np.zeros((side, side, 3), dtype=np.uint8)
+    top, left = (side - h) // 2, (side - w) // 2
+    cell[top:top + h, left:left + w] = _resize(bgr, (w, h))
+    return cell
+
+
+def build_grid_payload(views: Sequence[Tuple[PreparedImage, dict]]) -> ImagePayload:
+    """Mosaïque 2×2 des vues recadrées, dans l'ordre de GRID_LAYOUT"""
+    side = fit_size(PAYLOAD_MAX_SIDE, PAYLOAD_MAX_SIDE)[0] // 2
+    cells: List[np.ndarray] = []
+    for prepared, anatomy in views:
+        x0, y0, x1, y1 = scalp_region(prepared.bgr.shape, anatomy)
+        cells.append(_letterbox(prepared.bgr[y0:y1, x0:x1], side))
+    grid = np.vstack([np.hstack(cells[0:2]), np.hstack(cells[2:4])])
+    return _payload(grid)
+
+
+def image_messages(prompt: str, image: ImagePayload, mode: str = PAYLOAD_MODE) -> list:
+    if mode == "inline":
+        return [{"role": "user", "content": prompt + f"\nImage: {image.b64}"}]
+    return [{"role": "user", "content": [
+        {"type": "text", "text": prompt},
+        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image.b64}", "detail": PAYLOAD_DETAIL}}
+    ]}]
+
+
+def payload_tokens(prompt: str, image: ImagePayload) -> int:
+    """Jetons d'entrée estimés pour un appel : texte du prompt plus image"""
+    return text_tokens(prompt) + image.tokens
@@ -0,0 +1,112 @@
+import os
+import math
+from typing import Dict, NamedTuple, Tuple
+
+from analyzer import DensityMap
+
+# Seuil de confiance au-delà duquel l'estimation locale remplace l'appel au
+# modèle pour les stades de PRECLASSIFIER_STAGES. 0 désactive le court-circuit :
+# l'estimation est alors seulement enregistrée, pour l'évaluation hors ligne.
+PRECLASSIFIER_THRESHOLD = float(os.getenv("PRECLASSIFIER_THRESHOLD", 0))
+PRECLASSIFIER_STAGES = tuple(os.getenv("PRECLASSIFIER_STAGES", "1,7").split(","))
+
+# Poids des zones dans le score de perte
+FEATURE_WEIGHTS = {"frontal": 0.4, "temporal": 0.3, "vertex": 0.3}
+# Bornes du score de perte entre stades Norwood successifs (1 à 7)
+STAGE_BOUNDS = (0.2, 0.3, 0.4, 0.5, 0.6, 0.7)
+# Distance à la borne la plus proche pour laquelle la confiance atteint 63 %
+CONFIDENCE_SCALE = 0.05
+
+# Zones par défaut, en fractions de l'image (x0, y0, x1, y1), quand aucun repère n'est détecté
+VIEW_REGIONS = {
+    "front": {"frontal": (0.3, 0.0, 0.7, 0.25), "temporal": (0.1, 0.05, 0.3, 0.3)},
+    "top": {"frontal": (0.3, 0.05, 0.7, 0.3), "vertex": (0.3, 0.35, 0.7, 0.75)},
+    "side": {"temporal": (0.25, 0.1, 0.6, 0.35)},
+    "back": {"vertex": (0.3, 0.1, 0.7, 0.45)},
+}
+
+# Réponse locale au format du modèle, pour les stades qu'elle peut trancher
+STAGE_TREATMENTS = {
+    "1": ["Surveillance annuelle"],
+    "2": ["Minoxidil topique", "Finastéride"],
+    "3": ["Minoxidil topique", "Finastéride"],
+    "4": ["Finastéride", "Greffe capillaire FUE"],
+    "5": ["Greffe capillaire FUE"],
+    "6": ["Greffe capillaire FUE", "Micropigmentation du cuir chevelu"],
+    "7": ["Micropigmentation du cuir chevelu", "Prothèse capillaire"],
+}
+
+
+class LocalEstimate(NamedTuple):
+    stage: str
+    confidence: float
+    score: float
+    features: Dict[str, float]
+
+
+def view_regions(label: str, shape: Tuple[int, ...], anatomy: dict) -> Dict[str, Tuple[int, int, int, int]]:
+    """Zones mesurées pour une vue : d'après les repères anatomiques si un visage
+    est détecté, sinon d'après VIEW_REGIONS"""
+    height, width = shape[:2]
+    regions = {
+        name: (int(x0 * width), int(y0 * height), int(x1 * width), int(y1 * height))
+        for name, (x0, y0, x1, y1) in VIEW_REGIONS.get(label, {}).items()
+    }
+    if anatomy.get('face_bbox'):
+        x, y, w, h = (int(v) for v in anatomy['face_bbox'])
+        # Ligne frontale : bande au-dessus du front, sur la moitié centrale du visage
+        regions["frontal"] = (x + w // 4, max(0, y - h // 3), x + 3 * w // 4, max(y + h // 8, 1))
+        # Golfes temporaux : au-dessus de chaque point temporal
+        tx = min(px for px, _ in anatomy['temporal_points'])
+        ty = anatomy['temporal_points'][0][1]
+        regions["temporal"] = (max(0, tx - w // 8), max(0, ty - h // 2), tx + w // 8, max(ty - h // 6, 1))
+    return {name: box for name, box in regions.items() if box[2] - box[0] >= 8 and box[3] - box[1] >= 8}
+
+
+def density_features(density_map: DensityMap, label: str, anatomy: dict) -> Dict[str, float]:
+    regions = view_regions(label, (density_map.height, density_map.width), anatomy)
+    if not regions:
+        return {}
+    return dict(zip(regions, density_map.densities(list(regions.values())).tolist()))
+
+
+def estimate_stage(features: Dict[str, float]) -> LocalEstimate:
+    """Stade Norwood provisoire à partir des densités des zones.
+
+    Le score de perte est la moyenne pondérée de (1 - densité) ; la confiance
+    croît avec la distance du score à la borne de stade la plus proche et
+    décroît quand des zones manquent.
+    """
+    weights = {name: FEATURE_WEIGHTS[name] for name in features if name in FEATURE_WEIGHTS}
+    if not weights:
+        return LocalEstimate("1", 0.0, 0.0, features)
+    total = sum(weights.values())
+    score = sum(weight * (1 - features[name]) for name, weight in weights.items()) / total
+
+    index = sum(score >= bound for bound in STAGE_BOUNDS)
+    neighbours = [STAGE_BOUNDS[i] for i in (index - 1, index) if 0 <= i < len(STAGE_BOUNDS)]
+    margin = min(abs(score - bound) for bound in neighbours)
+    coverage = total / sum(FEATURE_WEIGHTS.values())
+    confidence = (1 - math.exp(-margin / CONFIDENCE_SCALE)) * coverage
+    return LocalEstimate(str(index + 1), round(confidence, 3), round(score, 3), features)
+
+
+def should_skip(estimate: LocalEstimate, threshold: float = PRECLASSIFIER_THRESHOLD) -> bool:
+    return threshold > 0 and estimate.stage in PRECLASSIFIER_STAGES and estimate.confidence >= threshold
+
+
+def local_result(estimate: LocalEstimate) -> dict:
+    """Résultat au schéma de la réponse du modèle, construit sans appel"""
+    density = sum(estimate.features.values()) / len(estimate.features) if estimate.features else 0.0
+    return {
+        "stade": estimate.stage,
+        "sous_type": None,
+        "densite": round(density * 100),
+        "zones_affectees": sorted(name for name, value in estimate.features.items() if value < 0.5),
+        "traitements": list(STAGE_TREATMENTS[estimate.stage]),
+        "confiance": round(estimate.confidence * 100)
+    }
+
+
+def estimate_summary(estimate: LocalEstimate) -> dict:
+    return {"stade": estimate.stage, "confiance": estimate.confidence, "score": estimate.score}
@@ -0,0 +1,175 @@
+import os
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def perceptual_hash(gray: np.ndarray) -> int:
+    """pHash 64 bits : signe des basses fréquences de la DCT d'une vignette 32×32"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class ResultCache:
+    """Cache des réponses du modèle par vue, indexé par hash perceptuel.
+
+    Une photo renvoyée à l'identique, ou à quelques bits près (recompression,
+    léger recadrage), réutilise la réponse déjà obtenue au lieu d'un nouvel
+    appel au modèle. `scope` isole les entrées par version de prompt, clinique,
+    patient et vue. Le niveau disque, optionnel, ne sert que les correspondances
+    exactes et survit aux redémarrages ; il garde au plus `disk_maxsize` fichiers,
+    les moins récemment lus ou écrits étant supprimés en premier.
+
+    Le cache ne vise que les renvois rapprochés (email perdu, page rechargée) :
+    une entrée plus vieille que `ttl` secondes n'est plus servie, dans aucun des
+    deux niveaux, pour qu'un patient qui revient des mois plus tard soit réanalysé.
+    """
+
+    def __init__(self, maxsize: int = 2048, max_distance: int = 6, directory: Optional[str] = None,
+                 disk_maxsize: int = 20000, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.max_distance = max_distance
+        self.directory = directory
+        self.disk_maxsize = disk_maxsize
+        self.ttl = ttl
+        # (scope, phash) -> (horodatage d'enregistrement, réponse)
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Le répertoire est partagé entre workers : on le parcourt tous les
+        # `_prune_every` écritures plutôt qu'à chacune
+        self._prune_every = max(1, disk_maxsize // 20)
+        self._writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._prune_disk()
+
+    def lookup(self, scope: str, phash: int) -> Optional[dict]:
+        oldest = time.time() - self.ttl
+        with self._lock:
+            key = (scope, phash)
+            if key in self._entries and self._entries[key][0] < oldest:
+                del self._entries[key]
+            if key not in self._entries:
+                key = self._nearest(scope, phash, oldest)
+            if key is not None:
+                self._entries.move_to_end(key)
+                return dict(self._entries[key][1])
+
+        entry = self._read_disk(scope, phash)
+        if entry is None or entry[0] < oldest:
+            return None
+        self._remember(scope, phash, entry[1], entry[0])
+        return entry[1]
+
+    def store(self, scope: str, phash: int, result: dict):
+        stored_at = time.time()
+        self._remember(scope, phash, result, stored_at)
+        self._write_disk(scope, phash, result, stored_at)
+
+    def _nearest(self, scope: str, phash: int, oldest: float) -> Optional[Tuple[str, int]]:
+        best, best_distance = None, self.max_distance + 1
+        for key, (stored_at, _) in self._entries.items():
+            if key[0] != scope or stored_at < oldest:
+                continue
+            distance = hamming(key[1], phash)
+            if distance < best_distance:
+                best, best_distance = key, distance
+        return best
+
+    def _remember(self, scope: str, phash: int, result: dict, stored_at: float):
+        with self._lock:
+            self._entries[(scope, phash)] = (stored_at, dict(result))
+            self._entries.move_to_end((scope, phash))
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _path(self, scope: str, phash: int) -> str:
+        digest = hashlib.sha1(scope.encode()).hexdigest()[:16]
+        return os.path.join(self.directory, f"{digest}_{phash:016x}.json")
+
+    def _read_disk(self, scope: str, phash: int) -> Optional[Tuple[float, dict]]:
+        """(horodatage d'enregistrement, réponse), ou None ; la date de modification
+        du fichier ne convient pas, elle est rafraîchie à chaque lecture"""
+        if not self.directory:
+            return None
+        try:
+            path = self._path(scope, phash)
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            # La date de modification sert d'horodatage d'accès pour l'éviction
+            os.utime(path)
+            return float(entry["stored_at"]), entry["result"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # Fichier illisible, ou d'un format antérieur sans horodatage : ignoré
+            return None
+
+    def _write_disk(self, scope: str, phash: int, result: dict, stored_at: float):
+        if not self.directory:
+            return
+        path = self._path(scope, phash)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"stored_at": stored_at, "result": result}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"DEBUG: result cache write failed: {e}")
+            return
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % self._prune_every == 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Supprime les fichiers expirés, puis ramène le niveau disque à `disk_maxsize`
+        fichiers en supprimant les moins récemment utilisés. Un fichier non lu depuis
+        `ttl` secondes est forcément expiré : il a été écrit avant sa dernière lecture."""
+        oldest = time.time() - self.ttl
+        files = []
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        files.append((entry.stat().st_mtime, entry.path))
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"DEBUG: result cache prune failed: {e}")
+            return
+        files.sort()
+        expired = sum(1 for mtime, _ in files if mtime < oldest)
+        excess = max(expired, len(files) - self.disk_maxsize)
+        if excess <= 0:
+            return
+        for _, path in files[:excess]:
+            try:
+                os.remove(path)
+            except OSError:
+                # Déjà supprimé par un autre worker
+                continue
+        print(f"DEBUG: result cache pruned {excess} files")
+
+
+result_cache = ResultCache(
+    maxsize=int(os.getenv("RESULT_CACHE_SIZE", 2048)),
+    max_distance=int(os.getenv("RESULT_CACHE_MAX_DISTANCE", 6)),
+    directory=os.getenv("RESULT_CACHE_DIR") or None,
+    disk_maxsize=int(os.getenv("RESULT_CACHE_DISK_SIZE", 20000)),
+    # Durée de vie d'une réponse en cache (s) : renvois rapprochés seulement
+    ttl=float(os.getenv("RESULT_CACHE_TTL", 3600))
+)
@@ -0,0 +1,216 @@
+"""Agrégats quotidiens par clinique, tenus à jour à chaque analyse enregistrée.
+
+    DATABASE_URL=postgresql://... python -m rollups rebuild [--clinic KEY]
+    DATABASE_URL=postgresql://... python -m rollups check [--clinic KEY]
+
+`rebuild` recalcule les agrégats depuis l'historique complet ; `check` les
+compare, sans rien modifier, à un parcours complet de `analyses`.
+"""
+import argparse
+import sys
+from datetime import date
+from typing import Optional
+
+from psycopg2.extras import DictCursor
+
+from database import connect
+
+# Une ligne par clinique et par jour (UTC) : volume et densité
+DAILY_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS clinic_daily_stats (
+        clinic_api_key TEXT NOT NULL,
+        day DATE NOT NULL,
+        analyses INTEGER NOT NULL DEFAULT 0,
+        density_sum DOUBLE PRECISION NOT NULL DEFAULT 0,
+        density_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (clinic_api_key, day)
+    )
+'''
+# Compteurs par valeur : dimension 'stade' (stade Norwood) ou 'traitement'
+COUNTS_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS clinic_daily_counts (
+        clinic_api_key TEXT NOT NULL,
+        day DATE NOT NULL,
+        dimension TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (clinic_api_key, day, dimension, value)
+    )
+'''
+
+# Les mêmes requêtes servent à l'incrément (une analyse) et à la reconstruction
+# (tout l'historique) : les deux chemins ne peuvent pas diverger.
+DAY_SQL = "(timestamp AT TIME ZONE 'UTC')::date"
+# Analyses historiques dont l'horodatage TEXT était illisible : converties avec un
+# timestamp NULL par la migration 002, elles n'appartiennent à aucun jour
+ROLLUP_ROWS_SQL = "clinic_api_key IS NOT NULL AND timestamp IS NOT NULL"
+DENSITY_FILTER_SQL = "jsonb_typeof(result->'densite_moyenne') = 'number'"
+
+DAILY_SELECT_SQL = f'''
+    SELECT clinic_api_key, {DAY_SQL} AS day, count(*) AS analyses,
+           coalesce(sum((result->>'densite_moyenne')::float) FILTER (WHERE {DENSITY_FILTER_SQL}), 0) AS density_sum,
+           count(*) FILTER (WHERE {DENSITY_FILTER_SQL}) AS density_count
+    FROM analyses
+    WHERE {ROLLUP_ROWS_SQL} AND {{where}}
+    GROUP BY 1, 2
+'''
+COUNTS_SELECT_SQL = f'''
+    SELECT clinic_api_key, {DAY_SQL} AS day, 'stade' AS dimension,
+           coalesce(result->>'stade_principal', 'inconnu') AS value, count(*) AS count
+    FROM analyses
+    WHERE {ROLLUP_ROWS_SQL} AND {{where}}
+    GROUP BY 1, 2, 3, 4
+    UNION ALL
+    SELECT clinic_api_key, {DAY_SQL}, 'traitement', treatment.value, count(*)
+    FROM analyses
+    CROSS JOIN LATERAL jsonb_array_elements_text(
+        CASE WHEN jsonb_typeof(result->'traitements_recommandes') = 'array'
+             THEN result->'traitements_recommandes' ELSE '[]'::jsonb END
+    ) AS treatment(value)
+    WHERE {ROLLUP_ROWS_SQL} AND {{where}}
+    GROUP BY 1, 2, 3, 4
+'''
+
+DAILY_UPSERT_SQL = f'''
+    INSERT INTO clinic_daily_stats (clinic_api_key, day, analyses, density_sum, density_count)
+    {DAILY_SELECT_SQL}
+    ON CONFLICT (clinic_api_key, day) DO UPDATE SET
+        analyses = clinic_daily_stats.analyses + excluded.analyses,
+        density_sum = clinic_daily_stats.density_sum + excluded.density_sum,
+        density_count = clinic_daily_stats.density_count + excluded.density_count
+'''
+COUNTS_UPSERT_SQL = f'''
+    INSERT INTO clinic_daily_counts (clinic_api_key, day, dimension, value, count)
+    {COUNTS_SELECT_SQL}
+    ON CONFLICT (clinic_api_key, day, dimension, value) DO UPDATE SET
+        count = clinic_daily_counts.count + excluded.count
+'''
+
+
+def apply_analysis(db, analysis_id: int):
+    """Ajoute une analyse aux agrégats, dans la transaction de l'appelant"""
+    with db.cursor() as cursor:
+        cursor.execute(DAILY_UPSERT_SQL.format(where="id = %(id)s"), {"id": analysis_id})
+        cursor.execute(COUNTS_UPSERT_SQL.format(where="id = %(id)s"), {"id": analysis_id})
+
+
+def rebuild(db, clinic: Optional[str] = None):
+    """Recalcule les agrégats depuis l'historique complet, en une transaction.
+
+    Le verrou EXCLUSIVE laisse l'admin lire les agrégats mais met en attente
+    les enregistrements concurrents : une analyse insérée pendant le parcours
+    ajoute son incrément après la reconstruction, jamais deux fois.
+    """
+    where = "clinic_api_key = %(clinic)s" if clinic else "TRUE"
+    params = {"clinic": clinic}
+    try:
+        with db.cursor() as cursor:
+            cursor.execute("LOCK TABLE clinic_daily_stats, clinic_daily_counts IN EXCLUSIVE MODE")
+            cursor.execute(f"DELETE FROM clinic_daily_stats WHERE {where}", params)
+            cursor.execute(f"DELETE FROM clinic_daily_counts WHERE {where}", params)
+            cursor.execute(DAILY_UPSERT_SQL.format(where=where), params)
+            cursor.execute(COUNTS_UPSERT_SQL.format(where=where), params)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+def check(db, clinic: Optional[str] = None) -> list:
+    """Lignes où les agrégats diffèrent d'un parcours complet de `analyses`"""
+    where = "clinic_api_key = %(clinic)s" if clinic else "TRUE"
+    params = {"clinic": clinic}
+    with db.cursor() as cursor:
+        cursor.execute(
+            f'''
+            WITH expected AS ({DAILY_SELECT_SQL.format(where=where)}),
+                 stored AS (SELECT * FROM clinic_daily_stats WHERE {where})
+            SELECT 'jour', clinic_api_key, day, NULL, e.analyses, s.analyses
+            FROM expected e FULL JOIN stored s USING (clinic_api_key, day)
+            WHERE e.analyses IS DISTINCT FROM s.analyses
+               OR e.density_count IS DISTINCT FROM s.density_count
+               OR abs(coalesce(e.density_sum, 0) - coalesce(s.density_sum, 0)) > 1e-6
+            ''',
+            params
+        )
+        mismatches = cursor.fetchall()
+        cursor.execute(
+            f'''
+            WITH expected AS ({COUNTS_SELECT_SQL.format(where=where)}),
+                 stored AS (SELECT * FROM clinic_daily_counts WHERE {where} AND count <> 0)
+            SELECT dimension, clinic_api_key, day, value, e.count, s.count
+            FROM expected e FULL JOIN stored s USING (clinic_api_key, day, dimension, value)
+            WHERE e.count IS DISTINCT FROM s.count
+            ''',
+            params
+        )
+        mismatches.extend(cursor.fetchall())
+    db.rollback()
+    return mismatches
+
+
+def fetch_stats(db, clinic: Optional[str], date_from: Optional[date], date_to: Optional[date]) -> dict:
+    """Statistiques sur une période, lues uniquement dans les agrégats"""
+    conditions, params = ["TRUE"], {}
+    if clinic:
+        conditions.append("clinic_api_key = %(clinic)s")
+        params["clinic"] = clinic
+    if date_from:
+        conditions.append("day >= %(date_from)s")
+        params["date_from"] = date_from
+    if date_to:
+        conditions.append("day <= %(date_to)s")
+        params["date_to"] = date_to
+    where = " AND ".join(conditions)
+    with db.cursor(cursor_factory=DictCursor) as cursor:
+        cursor.execute(
+            f"SELECT day, sum(analyses) AS analyses, sum(density_sum) AS density_sum, "
+            f"sum(density_count) AS density_count FROM clinic_daily_stats WHERE {where} GROUP BY day ORDER BY day",
+            params
+        )
+        days = cursor.fetchall()
+        cursor.execute(
+            f"SELECT dimension, value, sum(count) AS count FROM clinic_daily_counts WHERE {where} "
+            "GROUP BY dimension, value HAVING sum(count) > 0 ORDER BY dimension, count DESC, value",
+            params
+        )
+        counts = cursor.fetchall()
+
+    density_sum = sum(row['density_sum'] for row in days)
+    density_count = sum(row['density_count'] for row in days)
+    return {
+        "total": sum(row['analyses'] for row in days),
+        "densite_moyenne": density_sum / density_count if density_count else None,
+        "stades": {row['value']: row['count'] for row in counts if row['dimension'] == 'stade'},
+        "traitements": {row['value']: row['count'] for row in counts if row['dimension'] == 'traitement'},
+        "jours": [{
+            "jour": row['day'].isoformat(),
+            "analyses": row['analyses'],
+            "densite_moyenne": row['density_sum'] / row['density_count'] if row['density_count'] else None
+        } for row in days]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["rebuild", "check"])
+    parser.add_argument("--clinic", help="limite l'opération à une clinique")
+    args = parser.parse_args()
+
+    db = connect()
+    try:
+        if args.command == "rebuild":
+            rebuild(db, args.clinic)
+            print("Agrégats reconstruits")
+            return
+        mismatches = check(db, args.clinic)
+        for mismatch in mismatches:
+            print("écart :", mismatch)
+        print(f"{len(mismatches)} écart(s)")
+        sys.exit(1 if mismatches else 0)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -52,20 +52,24 @@ class ProhairWidget {
       const formData = new FormData(e.target);
       // Ajoute la clé API dans le formulaire
       formData.append("api_key", this.apiKey);
+      document.querySelector(".result").innerHTML = `
+        <div class="result-views"></div>
+        <div class="result-final"><p>Analyse en cours…</p></div>
+      `;
       try {
-        const result = await this.sendAnalysis(formData);
+        const result = await this.sendAnalysis(formData, (view, viewResult) => this.displayView(view, viewResult));
         console.log("Réponse de l'API :", result);
         this.displayResult(result);
       } catch (error) {
         console.error("Erreur lors de l'envoi de l'analyse :", error);
-        document.querySelector(".result").innerHTML = `<p style="color:red;">Erreur: ${error}</p>`;
+        document.querySelector(".result-final").innerHTML = `<p style="color:red;">Erreur: ${error}</p>`;
       }
     });
   }
 
-  async sendAnalysis(formData) {
-    console.log("Envoi des données au endpoint /analyze");
-    const response = await fetch("https://hairxplorer-production.up.railway.app/analyze", {
+  async sendAnalysis(formData, onView) {
+    console.log("Envoi des données au endpoint /analyze/stream");
+    const response = await fetch("https://hairxplorer-production.up.railway.app/analyze/stream", {
       method: "POST",
       body: formData
     });
@@ -74,17 +78,51 @@ class ProhairWidget {
       console.error("Erreur fetch:", errorText);
       throw new Error("Erreur réseau lors de l'appel à l'API");
     }
-    const jsonResponse = await response.json();
-    console.log("jsonResponse reçue :", jsonResponse);
-    return jsonResponse;
+    // Réponse NDJSON : une ligne par vue analysée, puis le résultat agrégé
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+    let finalResult = null;
+    while (true) {
+      const { done, value } = await reader.read();
+      buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
+      let newline;
+      while ((newline = buffer.indexOf("\n")) >= 0) {
+        const line = buffer.slice(0, newline).trim();
+        buffer = buffer.slice(newline + 1);
+        if (!line) continue;
+        const event = JSON.parse(line);
+        console.log("Événement reçu :", event);
+        if (event.type === "view") {
+          onView(event.view, event.result);
+        } else if (event.type === "result") {
+          finalResult = event.result;
+        } else if (event.type === "error") {
+          throw new Error(event.detail);
+        }
+      }
+      if (done) break;
+    }
+    if (!finalResult) {
+      throw new Error("Analyse interrompue avant le résultat final");
+    }
+    return finalResult;
+  }
+
+  displayView(view, data) {
+    console.log("Vue analysée:", view, data);
+    const labels = { front: "Face", top: "Dessus", side: "Profil", back: "Arrière" };
+    document.querySelector(".result-views").insertAdjacentHTML("beforeend", `
+      <p>${labels[view] || view} : stade ${data.stade || "N/A"} (confiance ${data.confiance ?? "N/A"} %)</p>
+    `);
   }
 
   displayResult(data) {
     console.log("Affichage du résultat:", data);
-    document.querySelector(".result").innerHTML = `
+    document.querySelector(".result-final").innerHTML = `
       <h3>Estimation : ${data.price_range || "N/A"}</h3>
       <p>${data.details || "Aucun détail disponible"}</p>
-      <p>Évaluation : ${data.evaluation || "N/A"}</p>
+      <p>Évaluation : ${data.evaluation || data.stade_principal || "N/A"}</p>
     `;
   }
 }
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+import warnings
+from typing import BinaryIO, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Toutes les vues sont analysées en 1024×1024
+TARGET_SIZE = (1024, 1024)
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_UPLOAD_PIXELS = int(os.getenv("MAX_UPLOAD_PIXELS", 50_000_000))
+
+# Garde-fou de Pillow aligné sur notre limite : au-delà du double, Image.open lève
+# DecompressionBombError (refusée ci-dessous en 413) ; entre les deux, l'avertissement
+# est inutile puisque decode_upload refuse ces photos de lui-même
+Image.MAX_IMAGE_PIXELS = MAX_UPLOAD_PIXELS
+warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+
+ORIENTATION_TAG = 0x0112
+# Transformations associées au tag EXIF Orientation (cf. ImageOps.exif_transpose)
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+class UploadRejected(Exception):
+    """Photo refusée avant décodage (poids, définition ou format)"""
+
+    def __init__(self, message: str, status_code: int = 413):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def upload_size(fileobj: BinaryIO) -> int:
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def check_upload(fileobj: BinaryIO):
+    size = upload_size(fileobj)
+    if size == 0:
+        raise UploadRejected("Photo vide", 400)
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"Photo trop volumineuse ({size // 1024} Ko, maximum {MAX_UPLOAD_BYTES // 1024} Ko)")
+
+
+def detach_upload(fileobj: BinaryIO) -> BinaryIO:
+    """Copie de la photo dans un fichier temporaire propre à l'appelant (en mémoire
+    jusqu'à 1 Mo, comme ceux de l'upload), qui survit à la fermeture de la requête"""
+    copy = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    fileobj.seek(0)
+    shutil.copyfileobj(fileobj, copy)
+    copy.seek(0)
+    return copy
+
+
+def decode_upload(fileobj: BinaryIO, size: Tuple[int, int] = TARGET_SIZE) -> np.ndarray:
+    """Décode une photo directement à taille réduite et la redresse selon l'EXIF.
+
+    Seul l'en-tête est lu avant le contrôle de définition. Pour un JPEG, `draft`
+    fait décoder l'image à l'échelle DCT (1/2, 1/4, 1/8) la plus petite qui reste
+    au-dessus de la cible : une photo de 48 MP n'est jamais décompressée en entier.
+    Le fichier est lu depuis le fichier temporaire de l'upload, sans copie en mémoire.
+    """
+    fileobj.seek(0)
+    try:
+        img = Image.open(fileobj)
+    except Image.DecompressionBombError:
+        raise UploadRejected("Définition trop élevée")
+    except (Image.UnidentifiedImageError, OSError):
+        raise UploadRejected("Format d'image non reconnu", 415)
+
+    width, height = img.size
+    if width * height > MAX_UPLOAD_PIXELS:
+        raise UploadRejected(f"Définition trop élevée ({width}×{height})")
+
+    orientation = img.getexif().get(ORIENTATION_TAG, 1)
+    img.draft('RGB', size)
+    try:
+        img = img.convert('RGB').resize(size)
+    except OSError:
+        raise UploadRejected("Photo corrompue ou tronquée", 400)
+
+    # Redressement après réduction : la sortie est carrée, rotation et
+    # redimensionnement commutent et la rotation porte sur 1 MP seulement
+    if orientation in _ORIENTATION_TRANSPOSE:
+        img = img.transpose(_ORIENTATION_TRANSPOSE[orientation])
+    return np.asarray(img)